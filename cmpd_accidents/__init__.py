@@ -1,6 +1,16 @@
 from .logger import *
+from .metrics import *
+from .features import *
+from .flatten import *
+from .geo import *
 from .database import *
 from .rest_service import *
+from .rate_limiter import *
+from .weather_cache import *
 from .weather_service import *
+from .seen_index import *
+from .sinks import *
+from .spool import *
 from .cmpd_service import *
+from .async_service import *
 from .main import *
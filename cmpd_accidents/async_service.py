@@ -0,0 +1,336 @@
+"""
+Module for the asyncio ingestion pipeline
+aiohttp is used for the CMPD feed and OpenWeatherAPI, database calls are
+offloaded to the default executor so writes overlap with network I/O
+"""
+import json
+import time
+import asyncio
+import hashlib
+import aiohttp
+from cmpd_accidents import Logger
+from cmpd_accidents import RestService, RequestStats
+from cmpd_accidents import CMPDService
+from cmpd_accidents import check_status
+
+
+class AsyncResponse(object):
+    """
+    Buffered response from AsyncRestService
+    Args:
+        status_code: the HTTP status code
+        content: the response body bytes
+        headers: the response headers
+    """
+
+    def __init__(self, status_code, content, headers):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+
+class AsyncRestService(RequestStats):
+    """
+    Async service helper class for API requests
+    Args:
+        endpoint: URL endpoint
+        timeout: total request timeout in seconds
+        limit: max concurrent connections
+        max_retries: retry budget for connection errors and 429/5xx responses
+        backoff_factor: exponential backoff factor between retries in seconds
+        rate_limiter: optional RateLimiter every retry waits on, the caller acquires
+            for the first attempt
+    """
+
+    def __init__(self, endpoint, timeout=10, limit=100, max_retries=3, backoff_factor=0.5,
+                 rate_limiter=None):
+        self.endpoint = endpoint
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.limit = limit
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.session = None
+        self.validators = {}  # conditional GET validators per params
+        self.init_stats()
+        self.logger = Logger('log', self.__class__.__name__,
+                             maxbytes=10*1024*1024).get()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        await self.close()
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=aiohttp.TCPConnector(limit=self.limit),
+                headers={'Content-Type': 'application/json'})
+        return self.session
+
+    async def get(self, params, conditional=False):
+        """
+        GET
+        Args:
+            params: parameters for request
+            conditional: send ETag/Last-Modified validators from the previous response,
+                an unchanged resource returns a 304 response with no body
+        """
+        key = tuple(sorted((params or {}).items()))
+        headers = self.validators.get(key, {}) if conditional else {}
+        session = self._get_session()
+        start = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with session.get(self.endpoint, params=params, headers=headers) as r:
+                    response = AsyncResponse(r.status, await r.read(), dict(r.headers))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.max_retries:
+                    self._record(time.perf_counter() - start, attempt + 1, error=True)
+                    self.logger.exception(str(e))
+                    raise
+            else:
+                if (response.status_code not in RestService.retry_statuses
+                        or attempt == self.max_retries):
+                    break
+            await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire_async()
+        self._record(time.perf_counter() - start, attempt + 1,
+                     error=response.status_code >= 400)
+        if (conditional and response.status_code == 304):
+            self.logger.info(
+                "GET API endpoint not modified, endpoint: {0}".format(self.endpoint))
+            return response
+        check_status(self.logger, self.endpoint, 'GET', response.status_code)
+        if conditional:
+            validators = {}
+            if response.headers.get('ETag'):
+                validators['If-None-Match'] = response.headers['ETag']
+            if response.headers.get('Last-Modified'):
+                validators['If-Modified-Since'] = response.headers['Last-Modified']
+            if validators:
+                self.validators[key] = validators
+        return response
+
+    def clear_validators(self):
+        """
+        Forget stored validators so the next conditional GET fetches in full
+        """
+        self.validators.clear()
+
+    async def close(self):
+        """
+        Close the underlying aiohttp session
+        """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class AsyncWeatherService(object):
+    """
+    Async class for Weather API operations
+    Args:
+        endpoint: endpoint for requests
+        apiKey: the API key to use
+        cache: optional WeatherCache to serve nearby/recent lookups from
+        limit: max concurrent connections
+        rate_limiter: optional RateLimiter every request (cache miss) and retry waits on
+    """
+
+    def __init__(self, endpoint, apiKey, cache=None, limit=100, rate_limiter=None):
+        self.apiKey = apiKey
+        self.rest_service = AsyncRestService(endpoint=endpoint, limit=limit,
+                                             rate_limiter=rate_limiter)
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+
+    async def get(self, params):
+        """
+        Get request
+        Args:
+            params: the parameters for the request in dictionary
+        """
+        lat, lon = params.get('lat'), params.get('lon')
+        cacheable = self.cache is not None and lat is not None and lon is not None
+        loop = asyncio.get_running_loop()
+        if cacheable:
+            # the cache may block on its shelve tier, keep it off the event loop
+            cached = await loop.run_in_executor(None, self.cache.get, lat, lon)
+            if cached is not None:
+                return cached
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire_async()
+        params["appid"] = self.apiKey
+        res = await self.rest_service.get(params=params)
+        weather_details = res.json()
+        if cacheable:
+            await loop.run_in_executor(None, self.cache.set, lat, lon, weather_details)
+        return weather_details
+
+    async def close(self):
+        await self.rest_service.close()
+
+
+class AsyncCMPDService(CMPDService):
+    """
+    Asyncio variant of CMPDService with the same semantics
+    Args:
+        database: the database to interact with, calls run in the default executor
+        rest_service: the AsyncRestService to use with api endpoint
+        weather_service: the AsyncWeatherService
+        concurrency: max weather lookups in flight
+        batch_size: enriched events per database write, writes overlap remaining lookups
+        seen_index: optional SeenIndex to diff new events without a database query
+        weather_region: share one weather observation per 'division' or grid 'cell' per cycle,
+            None looks up weather per accident
+        region_precision: decimal places of the lat/lon grid cells
+        spool: optional Spool enriched events are appended to instead of writing the database,
+            a SpoolFlusher writes them in the background
+        sinks: optional list of sinks or FanOut every enriched batch is written to concurrently,
+            defaults to a MongoSink of database
+    """
+
+    def __init__(self, database, rest_service, weather_service, concurrency=100, batch_size=50,
+                 seen_index=None, weather_region=None, region_precision=2, spool=None,
+                 sinks=None):
+        super(AsyncCMPDService, self).__init__(
+            database, rest_service, weather_service, max_workers=concurrency, seen_index=seen_index,
+            weather_region=weather_region, region_precision=region_precision, spool=spool,
+            sinks=sinks)
+        self.batch_size = batch_size
+
+    async def update_traffic_data(self):
+        """
+        Update the traffic data persistence
+        An unchanged feed (304 or same content hash) skips diffing and enrichment
+        Returns the number of new accidents persisted
+        """
+        self._start_cycle()
+        status = 'error'
+        try:
+            status = await self._update_cycle()
+        finally:
+            persisted = self._finish_cycle(status)
+        return persisted
+
+    async def _update_cycle(self):
+        """
+        Fetch the feed and persist its new accidents
+        Returns the cycle status: ok, not_modified or unchanged
+        """
+        # Events a sink failed are already in the database, so the feed diff will not return them
+        if self.spool is None and any(self.sinks.undelivered().values()):
+            with self._stage('redeliver'):
+                await asyncio.get_running_loop().run_in_executor(None, self.sinks.redeliver)
+        with self._stage('fetch'):
+            res = await self.rest_service.get(
+                params={'Content-Type': 'application/json'}, conditional=True)
+        if res.status_code == 304:
+            self.logger.info('Traffic feed not modified, skipping cycle')
+            return 'not_modified'
+        feed_hash = hashlib.sha1(res.content).hexdigest()
+        if feed_hash == self.last_feed_hash:
+            self.logger.info('Traffic feed unchanged, skipping cycle')
+            return 'unchanged'
+        try:
+            await self._update_from_feed(res.json())
+        except Exception:
+            # Force a full fetch next cycle so the feed is not skipped
+            self.rest_service.clear_validators()
+            raise
+        self.last_feed_hash = feed_hash
+        return 'ok'
+
+    async def _get_weather(self, accident, semaphore):
+        async with semaphore:
+            start = time.perf_counter()
+            weather_details = await self.weather_service.get(
+                params={
+                    'lat': accident.get('Latitude'),
+                    'lon': accident.get('Longitude')
+                }
+            )
+            latency = time.perf_counter() - start
+        return weather_details, latency
+
+    def _weather_lookup(self, accidents, semaphore):
+        """
+        Build the per-accident weather lookup for a cycle
+        In region mode every accident of a region awaits one shared lookup at the centroid,
+        accidents without coordinates are looked up on their own
+        Args:
+            accidents: the accidents of the cycle
+            semaphore: the asyncio semaphore bounding lookups in flight
+        Returns function of an accident to an awaitable of weather details and latency
+        """
+        if not self.weather_region:
+            return lambda accident: self._get_weather(accident, semaphore)
+        centroids = self.region_centroids(accidents)
+        flights = {}
+
+        def lookup(accident):
+            key = self.region_key(accident)
+            if key is None:
+                return self._get_weather(accident, semaphore)
+            if key not in flights:
+                lat, lon = centroids[key]
+                flights[key] = asyncio.ensure_future(self._get_weather(
+                    {'EventNo': 'region {0}'.format(key), 'Latitude': lat, 'Longitude': lon},
+                    semaphore))
+            return flights[key]
+        self.logger.info('Sharing weather for {0} events across {1} regions'.format(
+            len(accidents), len(centroids)))
+        return lookup
+
+    async def _update_from_feed(self, res_data):
+        """
+        Persist new accidents from a parsed traffic feed
+        Weather lookups run concurrently, each completed batch is written while
+        the following lookups are still in flight. On a failure the remaining lookups
+        are cancelled and writes already started are awaited before raising
+        Args:
+            res_data: list of accident json from the feed
+        Returns the number of new accidents persisted
+        """
+        loop = asyncio.get_running_loop()
+        new_accidents = await loop.run_in_executor(None, self.select_new_accidents, res_data)
+        if not new_accidents:
+            return 0
+        start = time.perf_counter()
+        lookup = self._weather_lookup(new_accidents, asyncio.Semaphore(self.max_workers))
+        tasks = [asyncio.ensure_future(lookup(accident)) for accident in new_accidents]
+        writes, latencies = [], []
+        try:
+            for offset in range(0, len(new_accidents), self.batch_size):
+                batch = new_accidents[offset:offset + self.batch_size]
+                results = await asyncio.gather(*tasks[offset:offset + self.batch_size])
+                for accident, (weather_details, latency) in zip(batch, results):
+                    # Weather API data to dictionary
+                    accident["weatherInfo"] = weather_details
+                    latencies.append(latency)
+                self._count('enriched', len(batch))
+                writes.append(loop.run_in_executor(
+                    None, self.persist_accidents, batch))
+            await asyncio.gather(*writes)
+        except Exception:
+            for task in tasks:
+                task.cancel()
+            for result in await asyncio.gather(*writes, return_exceptions=True):
+                if isinstance(result, Exception):
+                    self.logger.error('Write of a partial cycle failed: {0}'.format(str(result)))
+            raise
+        finally:
+            for task in tasks:
+                task.cancel()
+        self.logger.info(
+            'Enriched and persisted {0} events in {1:.3f}s (mean lookup: {2:.3f}s, max lookup: {3:.3f}s)'.format(
+                len(new_accidents), time.perf_counter() - start,
+                sum(latencies) / len(latencies), max(latencies)))
+        return len(new_accidents)
@@ -0,0 +1,310 @@
+"""
+Module for offline ingestion benchmarks
+Local stand-ins for the CMPD traffic feed, OpenWeatherAPI and MongoDB let
+CMPDService be driven end to end without network access or a database
+"""
+import abc
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from cmpd_accidents import RestService
+from cmpd_accidents import WeatherService
+from cmpd_accidents import WeatherCache
+from cmpd_accidents import CMPDService
+
+
+class FakeServer(abc.ABC):
+    """
+    Local HTTP server answering GETs from a background thread, subclasses build the responses
+    Args:
+        latency: seconds to wait before answering
+        error_rate: fraction of requests answered with a 503
+        seed: random seed for error injection
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/'.format(self._server.server_port)
+
+    @abc.abstractmethod
+    def respond(self, query):
+        """
+        Build the json body for a request
+        Args:
+            query: parsed query string of the request
+        """
+
+    def start(self):
+        """
+        Start serving on a free local port
+        """
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with fake._lock:
+                    fake.requests += 1
+                    failed = fake._random.random() < fake.error_rate
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if failed:
+                    status, content = 503, b'{}'
+                else:
+                    status = 200
+                    content = json.dumps(fake.respond(
+                        parse_qs(urlparse(self.path).query))).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        """
+        Stop serving
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class FakeCMPDServer(FakeServer):
+    """
+    Stand-in for the CMPD traffic feed
+    Every poll returns feed_size events of which new_events were not in the previous poll
+    Args:
+        feed_size: events per feed response
+        new_events: new events per poll
+        latency: seconds to wait before answering
+        error_rate: fraction of requests answered with a 503
+        seed: random seed for error injection
+    """
+
+    def __init__(self, feed_size=100, new_events=10, latency=0.0, error_rate=0.0, seed=None):
+        super(FakeCMPDServer, self).__init__(latency, error_rate, seed)
+        self.feed_size = max(feed_size, new_events)
+        self.new_events = new_events
+        self._polls = 0
+
+    def respond(self, query):
+        with self._lock:
+            self._polls += 1
+            last = self._polls * self.new_events
+        return [{
+            'EventNo': 'BENCH{0:09d}'.format(event),
+            'DateTime': '2019-01-01T00:00:00',
+            'Division': 'Division {0}'.format(event % 13),
+            'TypeDescription': 'ACCIDENT-PROPERTY DAMAGE',
+            'Address': '{0} N TRYON ST'.format(event % 900),
+            'Latitude': 35.05 + (event % 400) * 0.001,
+            'Longitude': -80.95 + (event % 500) * 0.001
+        } for event in range(last - self.feed_size, last)]
+
+
+class FakeWeatherServer(FakeServer):
+    """
+    Stand-in for OpenWeatherAPI current weather
+    Args:
+        latency: seconds to wait before answering
+        error_rate: fraction of requests answered with a 503
+        seed: random seed for error injection
+    """
+
+    def respond(self, query):
+        lat = float(query.get('lat', [0])[0])
+        lon = float(query.get('lon', [0])[0])
+        return {
+            'coord': {'lon': lon, 'lat': lat},
+            'weather': [{'id': 800, 'main': 'Clear', 'description': 'clear sky', 'icon': '01d'}],
+            'base': 'stations',
+            'main': {'temp': 290.15, 'pressure': 1016, 'humidity': 60,
+                     'temp_min': 288.15, 'temp_max': 292.15},
+            'visibility': 16093,
+            'wind': {'speed': 2.1, 'deg': 200},
+            'clouds': {'all': 1},
+            'dt': int(time.time()),
+            'sys': {'type': 1, 'id': 3616, 'country': 'US',
+                    'sunrise': 1546344000, 'sunset': 1546380000},
+            'id': 4460243,
+            'name': 'Charlotte',
+            'cod': 200
+        }
+
+
+class MemoryStore(object):
+    """
+    In-memory stand-in for MongoDBConnect
+    Args:
+        latency: seconds added to every database call
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.collections = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def _documents(self, collection):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.collections.setdefault(collection, {})
+
+    def find_ids(self, collection, ids, cursor_limit):
+        with self._lock:
+            documents = self._documents(collection)
+            return [item for item in ids if item in documents][:cursor_limit or None]
+
+    def all_ids(self, collection):
+        with self._lock:
+            return list(self._documents(collection))
+
+    def insert_bulk(self, collection, items):
+        with self._lock:
+            documents = self._documents(collection)
+            for item in items:
+                documents[item.get('EventNo')] = item
+
+    def upsert_bulk(self, collection, items, key='EventNo', batch_size=500):
+        with self._lock:
+            documents = self._documents(collection)
+            counts = {'inserted': 0, 'matched': 0}
+            for item in items:
+                if item.get(key) in documents:
+                    counts['matched'] += 1
+                else:
+                    documents[item.get(key)] = item
+                    counts['inserted'] += 1
+            return counts
+
+    def get_all(self, collection, limit, order=1):
+        with self._lock:
+            items = sorted(self._documents(collection).values(),
+                           key=lambda item: item.get('datetime_add', ''), reverse=order == -1)
+            return items[:limit or None]
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile
+    Args:
+        values: list of numbers
+        percent: the percentile, ie, 99
+    """
+    ordered = sorted(values)
+    index = max(0, int(math.ceil(percent / 100.0 * len(ordered))) - 1)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def run_benchmark(new_events, cycles=5, feed_size=None, max_workers=32, feed_latency=0.0,
+                  weather_latency=0.01, db_latency=0.0, error_rate=0.0, cache=False,
+                  weather_region=None):
+    """
+    Drive CMPDService against the local stand-ins
+    Args:
+        new_events: new events per poll
+        cycles: poll cycles to run
+        feed_size: events per feed response, defaults to twice new_events
+        max_workers: max concurrent weather lookups
+        feed_latency: CMPD feed response latency in seconds
+        weather_latency: OpenWeather response latency in seconds
+        db_latency: latency added to every database call in seconds
+        error_rate: fraction of feed/weather requests answered with a 503
+        cache: use a WeatherCache
+        weather_region: share weather per 'division' or 'cell' per cycle
+    Returns dictionary of throughput, failed cycles and cycle latency percentiles
+    """
+    feed_size = feed_size or new_events * 2
+    with FakeCMPDServer(feed_size, new_events, feed_latency, error_rate, seed=1) as feed, \
+            FakeWeatherServer(weather_latency, error_rate, seed=2) as weather_server:
+        store = MemoryStore(latency=db_latency)
+        weather = WeatherService(weather_server.url, apiKey='benchmark',
+                                 cache=WeatherCache() if cache else None,
+                                 rest_service=RestService(weather_server.url, pool_size=max_workers,
+                                                          backoff_factor=0.01))
+        cmpd = CMPDService(store, RestService(feed.url, backoff_factor=0.01), weather,
+                           max_workers=max_workers, weather_region=weather_region)
+        latencies, persisted, errors = [], 0, 0
+        for _ in range(cycles):
+            start = time.perf_counter()
+            try:
+                persisted += cmpd.update_traffic_data()
+            except Exception:
+                errors += 1  # ie, retries exhausted on injected errors
+            latencies.append(time.perf_counter() - start)
+    return {
+        'new_events': new_events,
+        'cycles': cycles,
+        'persisted': persisted,
+        'errors': errors,
+        'weather_requests': weather_server.requests,
+        'events_per_second': persisted / sum(latencies) if sum(latencies) else 0.0,
+        'p50_seconds': percentile(latencies, 50),
+        'p99_seconds': percentile(latencies, 99)
+    }
+
+
+def main():
+    """ From Main argparse for command line """
+    parser = argparse.ArgumentParser(
+        description='Offline CMPDService ingestion benchmark')
+    parser.add_argument('--sizes', help='New events per poll to benchmark', type=int, nargs='+',
+                        default=[10, 100, 1000, 10000])
+    parser.add_argument('--cycles', help='Poll cycles per size', type=int, default=5)
+    parser.add_argument('--workers', help='Max concurrent weather lookups', type=int, default=32)
+    parser.add_argument('--feed-latency', help='Feed latency in seconds', type=float, default=0.05)
+    parser.add_argument('--weather-latency', help='Weather latency in seconds', type=float, default=0.01)
+    parser.add_argument('--db-latency', help='Database call latency in seconds', type=float, default=0.0)
+    parser.add_argument('--error-rate', help='Fraction of 503 responses', type=float, default=0.0)
+    parser.add_argument('--cache', help='Use the weather cache', action='store_true')
+    parser.add_argument('--weather-region', help='Share weather per region per cycle',
+                        choices=['division', 'cell'])
+    args = parser.parse_args()
+    print('{0:>10} {1:>12} {2:>10} {3:>10} {4:>10} {5:>8}'.format(
+        'new/poll', 'events/s', 'p50 (s)', 'p99 (s)', 'weather', 'errors'))
+    for size in args.sizes:
+        result = run_benchmark(size, cycles=args.cycles, max_workers=args.workers,
+                               feed_latency=args.feed_latency, weather_latency=args.weather_latency,
+                               db_latency=args.db_latency, error_rate=args.error_rate,
+                               cache=args.cache, weather_region=args.weather_region)
+        print('{0:>10} {1:>12.1f} {2:>10.3f} {3:>10.3f} {4:>10} {5:>8}'.format(
+            size, result['events_per_second'], result['p50_seconds'],
+            result['p99_seconds'], result['weather_requests'], result['errors']))
+
+
+if __name__ == '__main__':
+    main()
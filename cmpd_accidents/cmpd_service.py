@@ -1,6 +1,17 @@
 """
 Module for CMPD Traffic business logic
 """
+import time
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from cmpd_accidents import Logger
+from cmpd_accidents import METRICS
+from cmpd_accidents import SingleFlight
+from cmpd_accidents import FanOut, MongoSink
 
 
 class CMPDService(object):
@@ -10,48 +21,377 @@ class CMPDService(object):
         database: the database to interact with
         rest_service: the rest service to use with api endpoint
         weather_service: the OpenWeatherAPI service
+        max_workers: max concurrent weather lookups per poll cycle
+        host_limit: max in-flight weather requests per API host (defaults to max_workers)
+        seen_index: optional SeenIndex to diff new events without a database query
+        weather_region: share one weather observation per 'division' or grid 'cell' per cycle,
+            None looks up weather per accident
+        region_precision: decimal places of the lat/lon grid cells
+        spool: optional Spool enriched events are appended to instead of writing the database,
+            a SpoolFlusher writes them in the background
+        sinks: optional list of sinks or FanOut every enriched batch is written to concurrently,
+            defaults to a MongoSink of database
     """
 
-    def __init__(self, database, rest_service, weather_service):
+    def __init__(self, database, rest_service, weather_service, max_workers=8, host_limit=None,
+                 seen_index=None, weather_region=None, region_precision=2, spool=None,
+                 sinks=None):
         self.database = database
         self.rest_service = rest_service
         self.weather_service = weather_service
+        self.seen_index = seen_index
+        self.weather_region = weather_region
+        self.region_precision = region_precision
+        self.spool = spool
+        self.sinks = sinks if isinstance(sinks, FanOut) else FanOut(
+            sinks or [MongoSink(database)])
+        self.last_feed_hash = None
+        self.cycle_stats = {'stages': {}}
+        self._stats_lock = threading.Lock()  # cycle_stats is updated from writer threads
+        self.max_workers = max_workers
+        self.host_limit = host_limit or max_workers
+        self._host_semaphores = {}
+        self._host_lock = threading.Lock()
+        self.logger = Logger('log', self.__class__.__name__,
+                             maxbytes=10 * 1024 * 1024).get()
+
+    def _host_semaphore(self):
+        """
+        Semaphore bounding concurrent requests to the weather API host
+        """
+        rest_service = getattr(self.weather_service, 'rest_service', None)
+        host = urlparse(getattr(rest_service, 'endpoint', '') or '').netloc
+        with self._host_lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(
+                    self.host_limit)
+            return self._host_semaphores[host]
+
+    def _get_weather(self, accident, semaphore):
+        """
+        Single weather lookup for an accident, timed
+        Args:
+            accident: the accident json to look up weather for
+            semaphore: the host semaphore to acquire for the request
+        Returns tuple of weather details and latency in seconds
+        """
+        with semaphore:
+            start = time.perf_counter()
+            weather_details = self.weather_service.get(
+                params={
+                    'lat': accident.get('Latitude'),
+                    'lon': accident.get('Longitude')
+                }
+            )
+            latency = time.perf_counter() - start
+        self.logger.info('Weather lookup for event: {0} took {1:.3f}s'.format(
+            accident.get('EventNo'), latency))
+        return weather_details, latency
+
+    def region_key(self, accident):
+        """
+        Region an accident shares weather with
+        Args:
+            accident: the accident json
+        Returns the division or the rounded lat/lon cell, None without coordinates
+        """
+        coords = self._coordinates(accident)
+        if coords is None:
+            return None
+        if self.weather_region == 'division' and accident.get('Division'):
+            return accident.get('Division')
+        return '{0:.{p}f}:{1:.{p}f}'.format(coords[0], coords[1], p=self.region_precision)
+
+    @staticmethod
+    def _coordinates(accident):
+        """
+        Latitude and longitude of an accident as floats
+        Args:
+            accident: the accident json
+        Returns tuple of lat, lon or None when either is missing or invalid
+        """
+        try:
+            return float(accident.get('Latitude')), float(accident.get('Longitude'))
+        except (TypeError, ValueError):
+            return None
+
+    def region_centroids(self, accidents):
+        """
+        Mean coordinate of the accidents in each region
+        Args:
+            accidents: list of accident json, accidents without coordinates are skipped
+        Returns dictionary of region key to (lat, lon)
+        """
+        sums = {}
+        for accident in accidents:
+            key = self.region_key(accident)
+            if key is None:
+                continue
+            lat, lon = self._coordinates(accident)
+            lat_sum, lon_sum, count = sums.get(key, (0.0, 0.0, 0))
+            sums[key] = (lat_sum + lat, lon_sum + lon, count + 1)
+        return {key: (lat_sum / count, lon_sum / count)
+                for key, (lat_sum, lon_sum, count) in sums.items()}
+
+    def _weather_lookup(self, accidents, semaphore):
+        """
+        Build the per-accident weather lookup for a cycle
+        In region mode every accident of a region shares one in-flight lookup at the centroid,
+        accidents without coordinates are looked up on their own as before
+        Args:
+            accidents: the accidents of the cycle
+            semaphore: the host semaphore to acquire for requests
+        """
+        if not self.weather_region:
+            return lambda accident: self._get_weather(accident, semaphore)
+        centroids = self.region_centroids(accidents)
+        flight = SingleFlight(memoize=True)
+
+        def lookup(accident):
+            key = self.region_key(accident)
+            if key is None:
+                return self._get_weather(accident, semaphore)
+            lat, lon = centroids[key]
+            return flight.do(key, lambda: self._get_weather(
+                {'EventNo': 'region {0}'.format(key), 'Latitude': lat, 'Longitude': lon}, semaphore))
+        self.logger.info('Sharing weather for {0} events across {1} regions'.format(
+            len(accidents), len(centroids)))
+        return lookup
+
+    def enrich_accidents(self, accidents):
+        """
+        Attach weather info to accidents using a bounded thread pool
+        Args:
+            accidents: list of accident json to enrich
+        Returns list of enriched accidents in the original order
+        """
+        if not accidents:
+            return []
+        semaphore = self._host_semaphore()
+        workers = min(self.max_workers, len(accidents))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                self._weather_lookup(accidents, semaphore), accidents))
+        elapsed = time.perf_counter() - start
+        final_data = []
+        for accident, (weather_details, _) in zip(accidents, results):
+            # Weather API data to dictionary
+            accident["weatherInfo"] = weather_details
+            final_data.append(accident)
+        latencies = [latency for _, latency in results]
+        self.logger.info(
+            'Enriched {0} events with {1} workers in {2:.3f}s (mean lookup: {3:.3f}s, max lookup: {4:.3f}s)'.format(
+                len(final_data), workers, elapsed,
+                sum(latencies) / len(latencies), max(latencies)))
+        return final_data
 
     def update_traffic_data(self):
         """
         Update the traffic data persistence
+        An unchanged feed (304 or same content hash) skips diffing and enrichment
+        Returns the number of new accidents persisted
         """
+        self._start_cycle()
+        status = 'error'
+        try:
+            status = self._update_cycle()
+        finally:
+            persisted = self._finish_cycle(status)
+        return persisted
+
+    def _update_cycle(self):
+        """
+        Fetch the feed and persist its new accidents
+        Returns the cycle status: ok, not_modified or unchanged
+        """
+        # Events a sink failed are already in the database, so the feed diff will not return them
+        if self.spool is None and any(self.sinks.undelivered().values()):
+            with self._stage('redeliver'):
+                self.sinks.redeliver()
         # Get current events and event ids
-        res = self.rest_service.get(
-            params={'Content-Type': 'application/json'})
-        res_data = res.json()
+        with self._stage('fetch'):
+            res = self.rest_service.get(
+                params={'Content-Type': 'application/json'}, conditional=True)
+        if res.status_code == 304:
+            self.logger.info('Traffic feed not modified, skipping cycle')
+            return 'not_modified'
+        feed_hash = hashlib.sha1(res.content).hexdigest()
+        if feed_hash == self.last_feed_hash:
+            self.logger.info('Traffic feed unchanged, skipping cycle')
+            return 'unchanged'
+        try:
+            self._update_from_feed(res.json())
+        except Exception:
+            # Force a full fetch next cycle so the feed is not skipped
+            self.rest_service.clear_validators()
+            raise
+        self.last_feed_hash = feed_hash
+        return 'ok'
+
+    def _start_cycle(self):
+        """
+        Reset per-cycle counters and timers
+        """
+        cache = getattr(self.weather_service, 'cache', None)
+        cycle_stats = {
+            'fetched': 0, 'new': 0, 'enriched': 0, 'inserted': 0, 'persisted': 0,
+            'stages': {}, 'start': time.perf_counter(),
+            'cache_hits': cache.stats()['hits'] if cache is not None else 0
+        }
+        with self._stats_lock:
+            self.cycle_stats = cycle_stats
+
+    def _finish_cycle(self, status):
+        """
+        Log the JSON summary line of the cycle
+        Args:
+            status: the cycle outcome
+        Returns the number of new accidents persisted
+        """
+        with self._stats_lock:
+            stats = dict(self.cycle_stats, stages=dict(self.cycle_stats['stages']))
+        cache = getattr(self.weather_service, 'cache', None)
+        summary = {
+            'status': status,
+            'fetched': stats['fetched'],
+            'new': stats['new'],
+            'enriched': stats['enriched'],
+            'inserted': stats['inserted'],
+            'spooled': stats.get('spooled', 0),
+            'cache_hits': (cache.stats()['hits'] - stats['cache_hits']) if cache is not None else 0,
+            'stages': {stage: round(seconds, 4) for stage, seconds in stats['stages'].items()},
+            'total_seconds': round(time.perf_counter() - stats['start'], 4)
+        }
+        METRICS.inc('cycles_total', status=status)
+        METRICS.observe('cycle_seconds', summary['total_seconds'])
+        self.logger.info('Cycle summary: {0}'.format(json.dumps(summary)))
+        return stats['persisted']
+
+    @contextmanager
+    def _stage(self, stage):
+        """
+        Time a pipeline stage into the cycle summary and the stage histogram
+        Args:
+            stage: the stage name, ie, fetch, find_ids, enrich, insert
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            METRICS.observe('stage_seconds', elapsed, stage=stage)
+            with self._stats_lock:
+                stages = self.cycle_stats.setdefault('stages', {})
+                stages[stage] = stages.get(stage, 0.0) + elapsed
+
+    def _count(self, name, value):
+        """
+        Add to a cycle counter and its process-wide events counter
+        Args:
+            name: the counter name, ie, fetched, new, enriched, inserted
+            value: the amount to add
+        """
+        with self._stats_lock:
+            self.cycle_stats[name] = self.cycle_stats.get(name, 0) + value
+        METRICS.inc('events_{0}_total'.format(name), value)
+
+    def _update_from_feed(self, res_data):
+        """
+        Persist new accidents from a parsed traffic feed
+        Args:
+            res_data: list of accident json from the feed
+        Returns the number of new accidents persisted
+        """
+        new_accidents = self.select_new_accidents(res_data)
+        with self._stage('enrich'):
+            final_data = self.enrich_accidents(new_accidents)
+        self._count('enriched', len(final_data))
+        if final_data:
+            self.persist_accidents(final_data)
+        return len(final_data)
+
+    def persist_accidents(self, final_data):
+        """
+        Persist enriched accidents and mark them as seen
+        With a spool the accidents are durably appended and written by its flusher
+        Args:
+            final_data: list of enriched accident json
+        """
+        if self.spool is not None:
+            with self._stage('spool'):
+                self.spool.append(final_data)
+            self._count('spooled', len(final_data))
+            self._mark_persisted(final_data)
+            return
+        with self._stage('insert'):
+            results = self.sinks.write(final_data)
+        counts = self.sinks.primary(results)
+        self._count('inserted', counts['inserted'] if counts else len(final_data))
+        self._mark_persisted(final_data)
+
+    def _mark_persisted(self, final_data):
+        """
+        Count persisted accidents and add them to the seen index
+        Args:
+            final_data: list of enriched accident json
+        """
+        with self._stats_lock:
+            self.cycle_stats['persisted'] = self.cycle_stats.get(
+                'persisted', 0) + len(final_data)
+        if self.seen_index is not None:
+            self.seen_index.add(item.get('EventNo') for item in final_data)
+
+    def select_new_accidents(self, res_data):
+        """
+        Select accidents not yet persisted, in feed order
+        Args:
+            res_data: list of accident json from the feed
+        Returns list of new accident json
+        """
         current_accidents = res_data
         current_ids = [item.get('EventNo') for item in res_data]
+        self._count('fetched', len(current_ids))
+
+        # Get new accidents only
+        with self._stage('find_ids'):
+            diffs = self.find_new_ids(current_ids)
+        new_accidents = []
+        for item in current_accidents:
+            event_no = item.get('EventNo')
+            if event_no in diffs:
+                diffs.discard(event_no)  # skip repeats within the same feed
+                new_accidents.append(item)
+        self._count('new', len(new_accidents))
+        return new_accidents
 
+    def find_new_ids(self, current_ids):
+        """
+        Find event ids not yet persisted
+        Uses the seen index when available, otherwise queries persistence
+        Events still waiting in the spool count as persisted
+        Args:
+            current_ids: the event ids in the current feed
+        Returns set of new event ids
+        """
+        if not current_ids:
+            return set()  # a zero cursor limit would read the whole collection
+        if self.spool is not None and self.seen_index is None:
+            spooled = self.spool.pending_ids()
+            current_ids = [item for item in current_ids if item not in spooled]
+            if not current_ids:
+                return set()
+        if self.seen_index is not None:
+            if not self.seen_index.loaded:
+                with self.database as db:
+                    self.seen_index.rebuild(db, collection="accidentsv2")
+                if self.spool is not None:
+                    self.seen_index.add(self.spool.pending_ids())
+                self.logger.info(
+                    'Rebuilt seen index with {0} events'.format(len(self.seen_index)))
+            return self.seen_index.diff(current_ids)
         # Find existing events from persistence that match current event ids
         with self.database as db:
             exist_ids = db.find_ids(
-                collection="accidentsv2", ids=current_ids, cursor_limit=500)
-
-        # Get new accidents only
-        diffs = set(current_ids) - set(exist_ids)
-        new_accidents = [item for item in current_accidents if any(
-            diff in item.get('EventNo') for diff in diffs)]
-
-        if new_accidents:
-            final_data = []
-            for json in new_accidents:
-                weather_details = self.weather_service.get(
-                    params={
-                        'lat': json.get('Latitude'),
-                        'lon': json.get('Longitude')
-                    }
-                )
-                # Weather API data to dictionary
-                json["weatherInfo"] = weather_details
-                final_data.append(json)
-            #print(final_data)
-            if final_data:
-                with self.database as db:
-                    db.insert_bulk(collection="accidentsv2",
-                                   items=final_data)
+                collection="accidentsv2", ids=current_ids, cursor_limit=len(current_ids))
+        return set(current_ids) - set(exist_ids)
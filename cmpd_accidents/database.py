@@ -4,12 +4,106 @@ PyMongo is used for MongoDB related persistence
 SQLAlchemy is used for relational db type persistence
 """
 from pymongo import MongoClient  # pymongo
+from pymongo import UpdateOne  # pymongo
+from pymongo.errors import BulkWriteError  # pymongo
 from sqlalchemy import create_engine  # sqlalchemy
 from sqlalchemy.orm import sessionmaker  # sqlalchemy
 from sqlalchemy import MetaData  # sqlalchemy
 from sqlalchemy import Table  # sqlalchemy
+from sqlalchemy import select  # sqlalchemy
+from sqlalchemy.engine.url import make_url  # sqlalchemy
+from sqlalchemy.dialects import mysql, postgresql, sqlite  # sqlalchemy
 from urllib.parse import urlparse
-from cmpd_accidents import Logger
+import threading
+import time
+import functools
+from cmpd_accidents import Logger, log_items
+from cmpd_accidents import METRICS
+from cmpd_accidents import feature_map
+from cmpd_accidents import flatten_accidents
+from cmpd_accidents import with_location
+
+
+def timed(operation):
+    """
+    Decorator timing a connector method into the database latency histogram
+    Args:
+        operation: the operation label, ie, mongo_find_ids
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with METRICS.timer('db_operation_seconds', operation=operation):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+_mongo_clients = {}
+_mongo_clients_lock = threading.Lock()
+
+
+def get_mongo_client(host, max_pool_size=100):
+    """
+    Get the shared process-wide MongoClient for a host
+    The client connects lazily and is reused by every MongoDBConnect on the host
+    Args:
+        host: host to connect
+        max_pool_size: max connections in the client pool, used on first creation
+    """
+    with _mongo_clients_lock:
+        client = _mongo_clients.get(host)
+        if client is None:
+            client = MongoClient(
+                host, maxPoolSize=max_pool_size, connect=False)
+            _mongo_clients[host] = client
+        return client
+
+
+def close_mongo_clients():
+    """
+    Close and forget all shared MongoClients, ie, on process shutdown
+    """
+    with _mongo_clients_lock:
+        for client in _mongo_clients.values():
+            client.close()
+        _mongo_clients.clear()
+
+
+_sql_engines = {}
+_sql_tables = {}
+_sql_lock = threading.RLock()
+
+
+def get_sql_engine(connection_string, pool_size=5, max_overflow=10):
+    """
+    Get the shared process-wide engine (and connection pool) for a database
+    Args:
+        connection_string: the database connection string
+        pool_size: connections kept in the pool, used on first creation
+        max_overflow: extra connections allowed above pool_size
+    """
+    with _sql_lock:
+        engine = _sql_engines.get(connection_string)
+        if engine is None:
+            options = {'pool_pre_ping': True}
+            if make_url(connection_string).get_backend_name() != 'sqlite':
+                options.update(pool_size=pool_size,
+                               max_overflow=max_overflow, pool_recycle=3600)
+            engine = create_engine(connection_string, **options)
+            _sql_engines[connection_string] = engine
+        return engine
+
+
+def close_sql_engines():
+    """
+    Dispose all shared engines and forget reflected tables
+    """
+    with _sql_lock:
+        for engine in _sql_engines.values():
+            engine.dispose()
+        _sql_engines.clear()
+        _sql_tables.clear()
 
 
 class MongoDBConnect(object):
@@ -17,24 +111,38 @@ class MongoDBConnect(object):
     The Mongo database connector
     Args:
         host: host to connect
-        collection: the collection to use
+        max_pool_size: max connections in the shared client pool
     """
-
-    def __init__(self, host):
+    def __init__(self, host, max_pool_size=100):
         self.host = host
+        self.max_pool_size = max_pool_size
+        self.db_name = urlparse(host).path[1:]
         self.connection = None
+        self.database = None
         self.logger = Logger('log', self.__class__.__name__,
                              maxbytes=10 * 1024 * 1024).get()
 
     def __enter__(self):
-        self.connection = MongoClient(self.host)
-        self.logger.info(
-            'Mongo connection created: {0}'.format(self.connection))
+        if self.connection is None:
+            self.connection = get_mongo_client(self.host, self.max_pool_size)
+            self.logger.info(
+                'Mongo connection created: {0}'.format(self.connection))
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.connection.close()
+        pass  # shared client stays open, see close_mongo_clients
 
+    def _collection(self, collection):
+        """
+        Get a collection from the cached database handle
+        Args:
+            collection: the collection name
+        """
+        if self.database is None:
+            self.database = self.connection[self.db_name]
+        return self.database[collection]
+
+    @timed('mongo_find_ids')
     def find_ids(self, collection, ids, cursor_limit):
         """
         Find collection items ids based on search of existing ids
@@ -45,8 +153,7 @@ class MongoDBConnect(object):
         """
         try:
             exist_events = []
-            collection = self.connection[urlparse(
-                self.host).path[1:]][collection]
+            collection = self._collection(collection)
             cursor = collection.find({'EventNo': {'$in': ids}}, {
                                      'EventNo': 1}).limit(cursor_limit)
             for doc in cursor:
@@ -57,23 +164,77 @@ class MongoDBConnect(object):
             self.logger.exception('PyMongo database error: {0}'.format(str(e)))
             raise e
 
+    @timed('mongo_all_ids')
+    def all_ids(self, collection):
+        """
+        Find all event ids in a collection
+        Args:
+            collection: the collection to search
+        """
+        try:
+            collection = self._collection(collection)
+            cursor = collection.find({}, {'EventNo': 1, '_id': 0})
+            return [doc.get('EventNo') for doc in cursor if doc.get('EventNo')]
+        except Exception as e:
+            self.logger.exception('PyMongo database error: {0}'.format(str(e)))
+            raise e
+
+    @timed('mongo_insert_bulk')
     def insert_bulk(self, collection, items):
         """
-        MongoDB bulk insert
+        MongoDB bulk insert, events get a GeoJSON location for the 2dsphere index
         Args:
             collection: the collection to insert to
             items: list of json to insert
         """
         try:
-            collection = self.connection[urlparse(
-                self.host).path[1:]][collection]
-            collection.insert(items)
+            collection = self._collection(collection)
+            collection.insert_many([with_location(item) for item in items])
+            log_items(self.logger, 'Successfully inserted items', items)
+        except Exception as e:
+            self.logger.exception('PyMongo database error: {0}'.format(str(e)))
+            raise e
+
+    @timed('mongo_upsert_bulk')
+    def upsert_bulk(self, collection, items, key='EventNo', batch_size=500):
+        """
+        MongoDB unordered bulk upsert keyed on a unique field
+        Existing documents are left untouched; with the unique index created by
+        cmpd_accidents.indexes concurrent writers are safe too.
+        New events get a GeoJSON location for the 2dsphere index
+        Args:
+            collection: the collection to upsert to
+            items: list of json to upsert
+            key: the unique field identifying an item
+            batch_size: max operations per bulk write
+        Returns dictionary of inserted and matched counts
+        """
+        try:
+            collection = self._collection(collection)
+            counts = {'inserted': 0, 'matched': 0}
+            for start in range(0, len(items), batch_size):
+                batch = items[start:start + batch_size]
+                requests = [UpdateOne({key: item.get(key)}, {'$setOnInsert': with_location(item)},
+                                      upsert=True) for item in batch]
+                try:
+                    result = collection.bulk_write(requests, ordered=False)
+                    counts['inserted'] += result.upserted_count
+                    counts['matched'] += result.matched_count
+                except BulkWriteError as e:
+                    # Duplicate key errors mean another writer inserted first
+                    errors = e.details.get('writeErrors', [])
+                    if any(error.get('code') != 11000 for error in errors):
+                        raise
+                    counts['inserted'] += e.details.get('nUpserted', 0)
+                    counts['matched'] += e.details.get('nMatched', 0) + len(errors)
             self.logger.info(
-                'Successfully inserted items: {0}'.format(str(items)))
+                'Successfully upserted items: {0}'.format(counts))
+            return counts
         except Exception as e:
             self.logger.exception('PyMongo database error: {0}'.format(str(e)))
             raise e
 
+    @timed('mongo_get_all')
     def get_all(self, collection, limit, order=1):
         """
         MongoDB get all items
@@ -83,8 +244,7 @@ class MongoDBConnect(object):
             order: datetime sort: asc 1, desc -1
         """
         try:
-            collection = self.connection[urlparse(
-                self.host).path[1:]][collection]
+            collection = self._collection(collection)
             items = collection.find().sort('datetime_add', order).limit(limit)  # oldest
             self.logger.info(
                 'Successfully found items based on limit: {0}'.format(str(limit)))
@@ -99,16 +259,22 @@ class SQLAlchemyConnect(object):
     SQLAlchemy/MySQL connector
     Args:
         connection_string: The database connection string
+        pool_size: connections kept in the shared engine pool
+        max_overflow: extra connections allowed above pool_size
     """
 
-    def __init__(self, connection_string):
+    def __init__(self, connection_string, pool_size=5, max_overflow=10):
         self.connection_string = connection_string
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.engine = None
         self.session = None
         self.logger = Logger('log', self.__class__.__name__,
                              maxbytes=10 * 1024 * 1024).get()
 
     def __enter__(self):
-        self.engine = create_engine(self.connection_string)
+        self.engine = get_sql_engine(
+            self.connection_string, self.pool_size, self.max_overflow)
         Session = sessionmaker()
         self.session = Session(bind=self.engine)
         return self
@@ -116,30 +282,65 @@ class SQLAlchemyConnect(object):
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.session.close()
 
-    def find_ids(self, table, ids, cursor_limit):
+    def _table(self, table):
+        """
+        Get a reflected table, reflecting only on first use per process
+        Args:
+            table: the table name
+        """
+        table_id = (self.connection_string, table)
+        with _sql_lock:
+            active_table = _sql_tables.get(table_id)
+            if active_table is None:
+                active_table = Table(
+                    table, MetaData(), autoload_with=self.engine)
+                _sql_tables[table_id] = active_table
+            return active_table
+
+    @timed('sql_find_ids')
+    def find_ids(self, table, ids, cursor_limit, chunk_size=500):
         """
         SQLAlchemy find rows by ids
         Args:
             table: the table to search
             ids: the existing ids to find in table specified
-            cursor_limit: the cursor limit of the find
+            cursor_limit: unused, kept for parity with MongoDBConnect.find_ids
+            chunk_size: max ids per IN list
         """
         try:
-            metadata = MetaData(bind=self.engine, reflect=True)
-            active_table = Table(
-                table, metadata, autoload=True, autoload_with=self.engine)
-            cursor_results = self.session.execute("""
-                SELECT DISTINCT EventNo FROM {0};
-                """.format(active_table))
+            active_table = self._table(table)
+            column = active_table.c.EventNo
+            ids = list(set(ids))
             exist_events = []
-            for row in cursor_results:
-                exist_events.append(row['EventNo'])
+            for start in range(0, len(ids), chunk_size):
+                chunk = ids[start:start + chunk_size]
+                cursor_results = self.session.execute(
+                    select(column).where(column.in_(chunk)).distinct())
+                exist_events.extend(row[0] for row in cursor_results)
             return exist_events
         except Exception as e:
             self.logger.exception(
                 'SQLAlchemy database error: {0}'.format(str(e)))
             raise e
 
+    @timed('sql_all_ids')
+    def all_ids(self, table):
+        """
+        SQLAlchemy find all event ids in a table
+        Args:
+            table: the table to search
+        """
+        try:
+            column = self._table(table).c.EventNo
+            cursor_results = self.session.execute(
+                select(column).where(column.isnot(None)).distinct())
+            return [row[0] for row in cursor_results]
+        except Exception as e:
+            self.logger.exception(
+                'SQLAlchemy database error: {0}'.format(str(e)))
+            raise e
+
+    @timed('sql_insert_bulk')
     def insert_bulk(self, table, items):
         """
         SQLAlchemy bulk insert
@@ -148,18 +349,96 @@ class SQLAlchemyConnect(object):
             items: list of json to insert
         """
         try:
-            metadata = MetaData(bind=self.engine, reflect=True)
-            active_table = Table(
-                table, metadata, autoload=True, autoload_with=self.engine)
+            active_table = self._table(table)
             self.session.execute(active_table.insert(), items)
             self.session.commit()  # commit transaction
-            self.logger.info('Successfully inserted items: {0} into table: {1}'.format(
-                str(items), active_table))
+            log_items(self.logger, 'Successfully inserted items into table: {0}'.format(
+                active_table), items)
+        except Exception as e:
+            self.logger.exception(
+                'SQLAlchemy database error: {0}'.format(str(e)))
+            raise e
+
+    def _insert_ignore(self, active_table):
+        """
+        Insert statement skipping rows that conflict with an existing key
+        Args:
+            active_table: the reflected table
+        Returns insert statement, a plain insert for dialects without conflict handling
+        """
+        dialect = self.engine.dialect.name
+        if dialect == 'sqlite':
+            return sqlite.insert(active_table).on_conflict_do_nothing()
+        if dialect == 'postgresql':
+            return postgresql.insert(active_table).on_conflict_do_nothing()
+        if dialect in ('mysql', 'mariadb'):
+            return mysql.insert(active_table).prefix_with('IGNORE')
+        return active_table.insert()
+
+    def _new_rows(self, conn, active_table, rows, key, chunk_size=500):
+        """
+        Drop rows whose key already exists in the table or repeats in the rows
+        Args:
+            conn: the open connection
+            active_table: the reflected table
+            rows: list of row dictionaries
+            key: the unique column
+            chunk_size: max keys per IN list
+        Returns list of new rows
+        """
+        column = active_table.c[key]
+        keys = list({row.get(key) for row in rows if row.get(key) is not None})
+        existing = set()
+        for start in range(0, len(keys), chunk_size):
+            existing.update(row[0] for row in conn.execute(
+                select(column).where(column.in_(keys[start:start + chunk_size]))))
+        new_rows = []
+        for row in rows:
+            if row.get(key) is not None and row.get(key) in existing:
+                continue
+            existing.add(row.get(key))
+            new_rows.append(row)
+        return new_rows
+
+    @timed('sql_insert_flat')
+    def insert_flat(self, table, items, mapping=None, batch_size=1000, key='EventNo'):
+        """
+        SQLAlchemy flattened bulk insert for enriched accidents
+        Rows are inserted with chunked executemany inside one transaction.
+        Idempotent: rows whose key already exists are skipped, so a replayed batch
+        only adds its new rows
+        Args:
+            table: table to insert data
+            items: list of enriched json to insert
+            mapping: column name to nested path map, defaults to feature_map
+            batch_size: max rows per executemany
+            key: the unique column rows are deduplicated on, skipped when not in the table
+        Returns number of rows inserted
+        """
+        try:
+            active_table = self._table(table)
+            rows = flatten_accidents(
+                items, [column.name for column in active_table.columns],
+                feature_map if mapping is None else mapping)
+            start = time.perf_counter()
+            with self.engine.begin() as conn:  # single transaction
+                if key in active_table.c:
+                    rows = self._new_rows(conn, active_table, rows, key)
+                    statement = self._insert_ignore(active_table)
+                else:
+                    statement = active_table.insert()
+                for offset in range(0, len(rows), batch_size):
+                    conn.execute(statement, rows[offset:offset + batch_size])
+            elapsed = time.perf_counter() - start
+            self.logger.info('Inserted {0} flattened rows into table: {1} in {2:.3f}s ({3:.0f} rows/s)'.format(
+                len(rows), active_table, elapsed, len(rows) / elapsed if elapsed else 0))
+            return len(rows)
         except Exception as e:
             self.logger.exception(
                 'SQLAlchemy database error: {0}'.format(str(e)))
             raise e
 
+    @timed('sql_get_all')
     def get_all(self, table):
         """
         SQLAlchemy get all items
@@ -167,12 +446,10 @@ class SQLAlchemyConnect(object):
             table: table to get from
         """
         try:
-            metadata = MetaData(bind=self.engine, reflect=True)
-            active_table = Table(
-                table, metadata, autoload=True, autoload_with=self.engine)
+            active_table = self._table(table)
             items = self.session.query(active_table).all()
-            self.logger.info('Successfully retrieved selected items: {0} from table: {1}'.format(
-                str(items), active_table))
+            log_items(self.logger, 'Successfully retrieved selected items from table: {0}'.format(
+                active_table), items)
             return items
         except Exception as e:
             self.logger.exception(
@@ -0,0 +1,58 @@
+"""
+Module for flattening enriched accidents into relational rows
+Column names and nested paths come from a feature map such as
+cmpd_accidents.features.feature_map, ie, "weatherTemp": "weatherInfo.main.temp"
+"""
+import json
+
+
+def resolve_path(item, path):
+    """
+    Resolve a dotted path in nested json
+    Args:
+        item: the json to search
+        path: dotted path, ie, weatherInfo.main.temp
+    Returns the value found or None
+    """
+    for key in path.split('.'):
+        if not isinstance(item, dict):
+            return None
+        item = item.get(key)
+    return item
+
+
+def flatten_accident(item, mapping):
+    """
+    Flatten an enriched accident
+    Top-level fields are kept as is, mapped paths are resolved into their
+    column names and nested values are serialized as JSON
+    Args:
+        item: enriched accident json
+        mapping: dictionary of column name to dotted path
+    Returns flat dictionary
+    """
+    row = {}
+    for column, path in mapping.items():
+        value = resolve_path(item, path)
+        if value is not None:
+            row[column] = value
+    for key, value in item.items():
+        row.setdefault(key, value)
+    return {key: json.dumps(value) if isinstance(value, (dict, list)) else value
+            for key, value in row.items()}
+
+
+def flatten_accidents(items, columns, mapping):
+    """
+    Flatten enriched accidents to rows sharing the same columns
+    Args:
+        items: list of enriched accident json
+        columns: the column names to keep, ie, columns of the target table
+        mapping: dictionary of column name to dotted path
+    Returns list of flat dictionaries
+    """
+    rows = []
+    for item in items:
+        flat = flatten_accident(item, mapping)
+        rows.append({column: flat.get(column) for column in columns})
+    return rows
@@ -0,0 +1,34 @@
+"""
+Module for event geometry
+Events carry a GeoJSON point so MongoDB can serve them from a 2dsphere index
+"""
+
+
+def event_location(item):
+    """
+    GeoJSON point of an event
+    Args:
+        item: event json with Latitude and Longitude
+    Returns GeoJSON point dictionary, None when coordinates are missing or invalid
+    """
+    try:
+        lat = float(item.get('Latitude'))
+        lon = float(item.get('Longitude'))
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return {'type': 'Point', 'coordinates': [lon, lat]}
+
+
+def with_location(item):
+    """
+    Copy of an event with its GeoJSON location field
+    Args:
+        item: event json
+    Returns the event with location set, or the event itself when it has no valid coordinates
+    """
+    location = event_location(item)
+    if location is None or item.get('location') == location:
+        return item
+    return dict(item, location=location)
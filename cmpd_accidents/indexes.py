@@ -0,0 +1,248 @@
+"""
+Module for MongoDB index management
+Creates the indexes the package's queries rely on and checks their query
+plans with explain() so collection scans show up before data grows
+"""
+import sys
+import json
+import argparse
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE  # pymongo
+from pymongo import UpdateOne  # pymongo
+from cmpd_accidents import Logger
+from cmpd_accidents import MongoDBConnect, close_mongo_clients
+from cmpd_accidents import event_location
+
+# Indexes per collection: accidentsv2 is written by CMPDService (event lookups/upserts and
+# event location), the legacy accidents collection (event_no, datetime_add) is read by get_all
+INDEX_SPECS = {
+    'accidentsv2': [
+        {'name': 'EventNo_1', 'keys': [('EventNo', ASCENDING)], 'unique': True},
+        {'name': 'location_2dsphere', 'keys': [('location', GEOSPHERE)]}
+    ],
+    'accidents': [
+        {'name': 'datetime_add_1', 'keys': [('datetime_add', ASCENDING)]}
+    ]
+}
+
+# Queries issued by MongoDBConnect per collection, all_ids reads every document by design
+QUERIES = {
+    'accidentsv2': {
+        'find_ids': lambda collection: collection.find(
+            {'EventNo': {'$in': ['explain']}}, {'EventNo': 1}).limit(500),
+        'upsert_bulk': lambda collection: collection.find({'EventNo': 'explain'})
+    },
+    'accidents': {
+        'get_all': lambda collection: collection.find().sort('datetime_add', DESCENDING).limit(1000)
+    }
+}
+
+
+def _logger():
+    """
+    The indexes logger, created on first use so importing the module opens no log file
+    """
+    return Logger('log', 'indexes', maxbytes=10 * 1024 * 1024).get()
+
+
+def _matches(info, spec):
+    return ([tuple(key) for key in info.get('key', [])] == [tuple(key) for key in spec['keys']]
+            and bool(info.get('unique')) == bool(spec.get('unique')))
+
+
+def find_duplicates(db, collection, key='EventNo'):
+    """
+    Find values of a key held by more than one document
+    Args:
+        db: the MongoDBConnect, entered
+        collection: the collection name
+        key: the field to check
+    Returns dictionary of duplicated value to document _ids, oldest first
+    """
+    active = db._collection(collection)
+    cursor = active.aggregate([
+        {'$match': {key: {'$exists': True, '$ne': None}}},
+        {'$group': {'_id': '${0}'.format(key), 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}}
+    ], allowDiskUse=True)
+    return {group['_id']: sorted(group['ids']) for group in cursor}
+
+
+def remove_duplicates(db, collection, key='EventNo', batch_size=1000):
+    """
+    Keep the oldest document per value of a key and delete the others
+    Args:
+        db: the MongoDBConnect, entered
+        collection: the collection name
+        key: the field to deduplicate on
+        batch_size: max _ids per delete
+    Returns number of documents deleted
+    """
+    active = db._collection(collection)
+    extra = [_id for ids in find_duplicates(db, collection, key).values() for _id in ids[1:]]
+    removed = 0
+    for start in range(0, len(extra), batch_size):
+        removed += active.delete_many({'_id': {'$in': extra[start:start + batch_size]}}).deleted_count
+    _logger().info('Removed {0} duplicate {1} documents from {2}'.format(removed, key, collection))
+    return removed
+
+
+def ensure_indexes(db, collection, specs=None, create=True, dedupe=False):
+    """
+    Create and validate indexes on a collection
+    Unique indexes are only created once no duplicates exist, see remove_duplicates
+    Args:
+        db: the MongoDBConnect, entered
+        collection: the collection name
+        specs: list of index specs with name, keys and optional unique,
+            defaults to the INDEX_SPECS of the collection
+        create: create missing indexes, False only validates
+        dedupe: delete duplicates before creating a unique index, False reports them
+    Returns list of dictionaries of index name and status: ok, created, missing,
+        duplicates or failed
+    """
+    specs = INDEX_SPECS.get(collection, []) if specs is None else specs
+    active = db._collection(collection)
+    existing = active.index_information()
+    report = []
+    for spec in specs:
+        info = existing.get(spec['name'])
+        if info is not None and _matches(info, spec):
+            report.append({'name': spec['name'], 'status': 'ok'})
+            continue
+        if not create:
+            report.append({'name': spec['name'], 'status': 'missing'})
+            continue
+        if spec.get('unique'):
+            key = spec['keys'][0][0]
+            if dedupe:
+                remove_duplicates(db, collection, key)
+            duplicates = find_duplicates(db, collection, key)
+            if duplicates:
+                _logger().error('Index {0} on {1} not created, {2} duplicated {3} values'.format(
+                    spec['name'], collection, len(duplicates), key))
+                report.append({'name': spec['name'], 'status': 'duplicates',
+                               'duplicates': len(duplicates)})
+                continue
+        try:
+            active.create_index(spec['keys'], name=spec['name'],
+                                unique=spec.get('unique', False))
+            report.append({'name': spec['name'], 'status': 'created'})
+            _logger().info('Created index {0} on {1}'.format(spec['name'], collection))
+        except Exception as e:
+            # ie, duplicate EventNo values or an index with the same name but other options
+            _logger().exception('Index {0} on {1} failed: {2}'.format(
+                spec['name'], collection, str(e)))
+            report.append({'name': spec['name'], 'status': 'failed', 'error': str(e)})
+    return report
+
+
+def backfill_locations(db, collection, batch_size=1000):
+    """
+    Add the GeoJSON location to events written before it existed
+    Args:
+        db: the MongoDBConnect, entered
+        collection: the collection name
+        batch_size: max updates per bulk write
+    Returns number of events updated
+    """
+    active = db._collection(collection)
+    cursor = active.find({'location': {'$exists': False}, 'Latitude': {'$exists': True}},
+                         {'Latitude': 1, 'Longitude': 1})
+    updated, requests = 0, []
+    for doc in cursor:
+        location = event_location(doc)
+        if location is not None:
+            requests.append(UpdateOne({'_id': doc['_id']}, {'$set': {'location': location}}))
+        if len(requests) >= batch_size:
+            updated += active.bulk_write(requests, ordered=False).modified_count
+            requests = []
+    if requests:
+        updated += active.bulk_write(requests, ordered=False).modified_count
+    _logger().info('Backfilled location on {0} events in {1}'.format(updated, collection))
+    return updated
+
+
+def plan_stages(plan):
+    """
+    Stage names of a query plan, outermost first
+    Args:
+        plan: the winning plan of an explain() result
+    Returns list of stage names
+    """
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(plan_stages(value))
+    return stages
+
+
+def check_queries(db, collection, queries=None):
+    """
+    Explain the package's queries and flag collection scans
+    Args:
+        db: the MongoDBConnect, entered
+        collection: the collection name
+        queries: dictionary of query name to callable building a cursor from a collection,
+            defaults to the QUERIES of the collection
+    Returns list of dictionaries of query name, plan stages and collscan flag
+    """
+    queries = QUERIES.get(collection, {}) if queries is None else queries
+    active = db._collection(collection)
+    report = []
+    for name, query in sorted(queries.items()):
+        explain = query(active).explain()
+        stages = plan_stages(explain.get('queryPlanner', {}).get('winningPlan', {}))
+        collscan = 'COLLSCAN' in stages
+        if collscan:
+            _logger().warning('Query {0} on {1} does a collection scan: {2}'.format(
+                name, collection, stages))
+        report.append({'name': name, 'stages': stages, 'collscan': collscan})
+    return report
+
+
+def main():
+    """ From Main argparse for command line """
+    parser = argparse.ArgumentParser(
+        description='Create MongoDB indexes and check query plans for collection scans')
+    parser.add_argument(
+        'host', help='Enter the db host to connect, full connection string')
+    parser.add_argument(
+        '--collections', help='Collections to index, see INDEX_SPECS', nargs='+',
+        default=sorted(INDEX_SPECS), choices=sorted(INDEX_SPECS))
+    parser.add_argument(
+        '--check-only', help='Validate indexes and plans without creating indexes',
+        action='store_true')
+    parser.add_argument(
+        '--dedupe', help='Delete duplicate events, keeping the oldest, before unique indexes',
+        action='store_true')
+    parser.add_argument(
+        '--backfill-locations', help='Add the GeoJSON location to existing events',
+        action='store_true')
+    args = parser.parse_args()
+    report, ok = {}, True
+    try:
+        with MongoDBConnect(args.host) as db:
+            for collection in args.collections:
+                location_indexed = any(spec['name'] == 'location_2dsphere'
+                                       for spec in INDEX_SPECS[collection])
+                if args.backfill_locations and location_indexed and not args.check_only:
+                    backfill_locations(db, collection)
+                indexes = ensure_indexes(db, collection, create=not args.check_only,
+                                         dedupe=args.dedupe)
+                queries = check_queries(db, collection)
+                ok = ok and all(index['status'] in ('ok', 'created') for index in indexes) \
+                    and not any(query['collscan'] for query in queries)
+                report[collection] = {'indexes': indexes, 'queries': queries}
+    finally:
+        close_mongo_clients()
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
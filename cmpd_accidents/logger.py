@@ -1,7 +1,13 @@
 import os
+import json
+import queue
+import atexit
 import logging
 import logging.handlers
 
+_listeners = []
+_file_loggers = []  # loggers writing synchronously, see enable_queue_mode
+
 
 class Logger(object):
     """
@@ -12,12 +18,16 @@ class Logger(object):
 	path: The directory/path for the log files
         name: The name of the class utilizing logging
 	maxbytes: The max bytes for the log rotations
+        level: The log level, full payload dumps are only written at DEBUG
+        use_queue: Write log records from a background thread (defaults to Logger.queue_mode),
+            see enable_queue_mode to also switch loggers created earlier
     """
+    queue_mode = False
 
-    def __init__(self, path, name, maxbytes):
+    def __init__(self, path, name, maxbytes, level=logging.INFO, use_queue=None):
         name = name.replace('.log', '')
         logger = logging.getLogger('log_namespace.%s' % name)
-        logger.setLevel(logging.DEBUG)
+        logger.setLevel(level)
         if not logger.handlers:
             if not os.path.isdir(path):
                 os.mkdir(path)
@@ -28,6 +38,10 @@ class Logger(object):
                 '%(asctime)s %(levelname)s:%(name)s %(message)s')
             handler.setFormatter(formatter)
             handler.setLevel(logging.DEBUG)
+            if Logger.queue_mode if use_queue is None else use_queue:
+                handler = queue_handler(handler)
+            elif use_queue is None:
+                _file_loggers.append(logger)
             logger.addHandler(handler)
         self._logger = logger
 
@@ -40,3 +54,77 @@ class Logger(object):
 
     def get(self):
         return self._logger
+
+
+def queue_handler(handler):
+    """
+    Wrap a handler so records are queued and written by a background listener
+    Args:
+        handler: the handler doing the actual log I/O
+    Returns QueueHandler to attach to the logger
+    """
+    log_queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(
+        log_queue, handler, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+    return logging.handlers.QueueHandler(log_queue)
+
+
+def enable_queue_mode():
+    """
+    Queue log records from now on, including loggers created before the call,
+    ie, module level loggers created at import time
+    """
+    Logger.queue_mode = True
+    while _file_loggers:
+        logger = _file_loggers.pop()
+        for handler in list(logger.handlers):
+            if not isinstance(handler, logging.handlers.QueueHandler):
+                logger.removeHandler(handler)
+                logger.addHandler(queue_handler(handler))
+
+
+@atexit.register
+def stop_log_listeners():
+    """
+    Flush and stop all background log listeners
+    """
+    while _listeners:
+        _listeners.pop().stop()
+
+
+def summarize_items(items, key='EventNo', size=False):
+    """
+    Summarize a payload for logging instead of dumping it
+    Args:
+        items: list of json/rows
+        key: the id field to report a range for
+        size: also report the serialized size, costs a full json.dumps of the payload
+    Returns summary string of count, id range and optionally serialized size
+    """
+    items = list(items)
+    ids = sorted(str(item_id) for item_id in (
+        item.get(key) if isinstance(item, dict) else getattr(item, key, None)
+        for item in items) if item_id is not None)
+    id_range = '{0}..{1}'.format(ids[0], ids[-1]) if ids else 'n/a'
+    summary = 'count: {0}, {1}: {2}'.format(len(items), key, id_range)
+    if size:
+        summary += ', bytes: {0}'.format(len(json.dumps(items, default=str).encode('utf-8')))
+    return summary
+
+
+def log_items(logger, message, items, key='EventNo'):
+    """
+    Log a payload summary at INFO and the full payload only at DEBUG
+    The serialized size is only computed at DEBUG, keeping INFO logging off the hot path
+    Args:
+        logger: the logger to use
+        message: the message prefix
+        items: list of json/rows
+        key: the id field to report a range for
+    """
+    debug = logger.isEnabledFor(logging.DEBUG)
+    logger.info('{0}: {1}'.format(message, summarize_items(items, key, size=debug)))
+    if debug:
+        logger.debug('{0} payload: {1}'.format(message, str(items)))
@@ -1,20 +1,58 @@
 """
 Main module for data mining/gathering, persistence
 """
+import time
+import signal
 import argparse
-from cmpd_accidents import MongoDBConnect
+import threading
+from cmpd_accidents import MongoDBConnect, close_mongo_clients
+from cmpd_accidents import SQLAlchemyConnect, close_sql_engines
+from cmpd_accidents import MongoSink, SQLSink, FileSink
 from cmpd_accidents import RestService
 from cmpd_accidents import WeatherService
+from cmpd_accidents import WeatherCache
+from cmpd_accidents import RateLimiter
+from cmpd_accidents import SeenIndex
+from cmpd_accidents import Spool, SpoolFlusher
 from cmpd_accidents import CMPDService
+from cmpd_accidents import Logger, enable_queue_mode
+from cmpd_accidents import METRICS
 
 
-def update_traffic_data(host, weatherApi):
+def create_sinks(db, sql_connection=None, file_path=None):
     """
-    Updates traffic data for persistence Mongo connector
+    Sinks every enriched batch is written to, Mongo first
+    Args:
+        db: the MongoDBConnect
+        sql_connection: optional SQLAlchemy connection string to also write flattened rows to
+        file_path: optional JSONL file to also append events to
+    Returns list of sinks
+    """
+    sinks = [MongoSink(db)]
+    if sql_connection:
+        sinks.append(SQLSink(SQLAlchemyConnect(sql_connection)))
+    if file_path:
+        sinks.append(FileSink(file_path))
+    return sinks
+
+
+def create_cmpd_service(host, weatherApi, max_workers=8, cache_path=None, seen_index=None,
+                        weather_region=None, spool=None, sql_sink=None, file_sink=None,
+                        rate_limiter=None):
+    """
+    Creates the CMPD service and its dependencies
     Args:
         host: db host to connect to
-        port: db port
         weatherApi: api key for OpenWeatherAPI
+        max_workers: max concurrent weather lookups
+        cache_path: optional file path for the persistent weather cache
+        seen_index: optional SeenIndex for database-free dedup
+        weather_region: share weather per 'division' or 'cell' per cycle
+        spool: optional Spool to append enriched events to instead of writing the database
+        sql_sink: optional SQLAlchemy connection string to also write flattened rows to
+        file_sink: optional JSONL file to also append events to
+        rate_limiter: optional RateLimiter keeping weather calls within the API quota
+    Returns tuple of CMPD service and weather cache
     """
     # DB Service
     db = MongoDBConnect(host)
@@ -22,11 +60,108 @@ def update_traffic_data(host, weatherApi):
     endpoint = 'https://cmpdinfo.charlottenc.gov/api/v2/traffic'
     service = RestService(endpoint)
     # Weather Service
+    cache = WeatherCache(path=cache_path)
     weather = WeatherService(
-        endpoint='https://api.openweathermap.org/data/2.5/weather', apiKey=weatherApi)
+        endpoint='https://api.openweathermap.org/data/2.5/weather', apiKey=weatherApi, cache=cache,
+        pool_size=max_workers, rate_limiter=rate_limiter)
     # CMPD Service
-    cmpd = CMPDService(db, service, weather)
-    cmpd.update_traffic_data()
+    cmpd = CMPDService(db, service, weather, max_workers=max_workers,
+                       seen_index=seen_index, weather_region=weather_region, spool=spool,
+                       sinks=create_sinks(db, sql_sink, file_sink))
+    return cmpd, cache
+
+
+def update_traffic_data(host, weatherApi, max_workers=8, cache_path=None, weather_region=None,
+                        metrics_path=None, spool_path=None, sql_sink=None, file_sink=None,
+                        rate_limiter=None):
+    """
+    Updates traffic data for persistence Mongo connector
+    Args:
+        host: db host to connect to
+        port: db port
+        weatherApi: api key for OpenWeatherAPI
+        max_workers: max concurrent weather lookups
+        cache_path: optional file path for the persistent weather cache
+        weather_region: share weather per 'division' or 'cell' per cycle
+        metrics_path: optional file to write Prometheus metrics to
+        spool_path: optional spool directory, events left from earlier runs are written first
+        sql_sink: optional SQLAlchemy connection string to also write flattened rows to
+        file_sink: optional JSONL file to also append events to
+        rate_limiter: optional RateLimiter keeping weather calls within the API quota
+    """
+    spool = Spool(spool_path) if spool_path else None
+    cmpd, cache = create_cmpd_service(
+        host, weatherApi, max_workers=max_workers, cache_path=cache_path,
+        weather_region=weather_region, spool=spool, sql_sink=sql_sink, file_sink=file_sink,
+        rate_limiter=rate_limiter)
+    flusher = SpoolFlusher(spool, cmpd.database, sinks=cmpd.sinks) if spool else None
+    try:
+        with cache:
+            if flusher:
+                flusher.start()
+            cmpd.update_traffic_data()
+    finally:
+        if flusher:
+            flusher.stop()
+            spool.close()
+        cmpd.sinks.close()
+        close_mongo_clients()
+        close_sql_engines()
+        if metrics_path:
+            METRICS.write_prometheus(metrics_path)
+
+
+def next_interval(interval, new_events, min_interval, max_interval):
+    """
+    Adapt the poll interval to feed activity
+    Args:
+        interval: the current interval in seconds
+        new_events: number of new events in the last cycle
+        min_interval: shortest interval in seconds
+        max_interval: longest interval in seconds
+    Returns halved interval when new events arrived, otherwise backed off by 1.5x
+    """
+    if new_events:
+        return max(min_interval, interval / 2.0)
+    return min(max_interval, interval * 1.5)
+
+
+def run_daemon(cmpd, interval=300, min_interval=60, max_interval=900, stop_event=None,
+               metrics_path=None):
+    """
+    Poll the CMPD feed until stopped, keeping services and connections warm
+    Args:
+        cmpd: the CMPD service to poll with
+        interval: the starting poll interval in seconds
+        min_interval: shortest poll interval in seconds
+        max_interval: longest poll interval in seconds
+        stop_event: threading.Event ending the loop, ie, set by SIGTERM
+        metrics_path: optional file to write Prometheus metrics to after each cycle
+    Returns number of cycles run
+    """
+    logger = Logger('log', 'main', maxbytes=10 * 1024 * 1024).get()
+    stop_event = stop_event or threading.Event()
+    cycles = 0
+    while not stop_event.is_set():
+        start = time.perf_counter()
+        try:
+            new_events = cmpd.update_traffic_data()
+            status = 'ok'
+        except Exception as e:
+            logger.exception('Poll cycle failed: {0}'.format(str(e)))
+            new_events = 0
+            status = 'error'
+        elapsed = time.perf_counter() - start
+        cycles += 1
+        interval = next_interval(
+            interval, new_events, min_interval, max_interval)
+        logger.info('Cycle {0} {1}: {2} new events in {3:.3f}s, next poll in {4:.0f}s'.format(
+            cycles, status, new_events, elapsed, interval))
+        if metrics_path:
+            METRICS.write_prometheus(metrics_path)
+        stop_event.wait(interval)
+    logger.info('Daemon stopped after {0} cycles'.format(cycles))
+    return cycles
 
 
 def main():
@@ -36,8 +171,73 @@ def main():
         'host', help='Enter the db host to connect, full connection string')
     parser.add_argument(
         'weatherApi', help='Enter OpenWeatherAPI key to use for weather info')
+    parser.add_argument(
+        '--workers', help='Max concurrent weather lookups', type=int, default=8)
+    parser.add_argument(
+        '--weather-cache', help='File path for a persistent weather cache shared across runs')
+    parser.add_argument(
+        '--weather-region', help='Share one weather lookup per region per cycle',
+        choices=['division', 'cell'])
+    parser.add_argument(
+        '--queue-logging', help='Write logs from a background thread', action='store_true')
+    parser.add_argument(
+        '--daemon', help='Keep running and poll on an adaptive schedule', action='store_true')
+    parser.add_argument(
+        '--interval', help='Starting poll interval in seconds (daemon)', type=float, default=300)
+    parser.add_argument(
+        '--min-interval', help='Shortest poll interval in seconds (daemon)', type=float, default=60)
+    parser.add_argument(
+        '--max-interval', help='Longest poll interval in seconds (daemon)', type=float, default=900)
+    parser.add_argument(
+        '--metrics-file', help='Write Prometheus metrics to this file after each cycle')
+    parser.add_argument(
+        '--metrics-port', help='Serve Prometheus metrics at /metrics on this port (daemon)', type=int)
+    parser.add_argument(
+        '--spool', help='Directory of a local spool decoupling database writes from polling')
+    parser.add_argument(
+        '--sql-sink', help='SQLAlchemy connection string to also write flattened rows to')
+    parser.add_argument(
+        '--file-sink', help='JSONL file to also append enriched events to')
+    parser.add_argument(
+        '--weather-quota', help='Max OpenWeatherAPI calls per minute', type=int)
+    parser.add_argument(
+        '--rate-limit-file', help='State file sharing the weather quota across processes')
     args = parser.parse_args()
-    update_traffic_data(args.host, args.weatherApi)
+    if args.queue_logging:
+        enable_queue_mode()
+    rate_limiter = RateLimiter(args.weather_quota, path=args.rate_limit_file) \
+        if args.weather_quota else None
+    if not args.daemon:
+        update_traffic_data(args.host, args.weatherApi, max_workers=args.workers,
+                            cache_path=args.weather_cache, weather_region=args.weather_region,
+                            metrics_path=args.metrics_file, spool_path=args.spool,
+                            sql_sink=args.sql_sink, file_sink=args.file_sink,
+                            rate_limiter=rate_limiter)
+        return
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    spool = Spool(args.spool) if args.spool else None
+    cmpd, cache = create_cmpd_service(args.host, args.weatherApi, max_workers=args.workers,
+                                      cache_path=args.weather_cache, seen_index=SeenIndex(),
+                                      weather_region=args.weather_region, spool=spool,
+                                      sql_sink=args.sql_sink, file_sink=args.file_sink,
+                                      rate_limiter=rate_limiter)
+    flusher = SpoolFlusher(spool, cmpd.database, sinks=cmpd.sinks).start() if spool else None
+    if args.metrics_port:
+        METRICS.serve(args.metrics_port)
+    try:
+        with cache:
+            run_daemon(cmpd, interval=args.interval, min_interval=args.min_interval,
+                       max_interval=args.max_interval, stop_event=stop_event,
+                       metrics_path=args.metrics_file)
+    finally:
+        if flusher:
+            flusher.stop()
+            spool.close()
+        cmpd.sinks.close()
+        close_mongo_clients()
+        close_sql_engines()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,193 @@
+"""
+Module for ingestion metrics
+Counters, gauges and latency histograms kept in process and exported in the
+Prometheus text format, either as a file or over a small HTTP endpoint
+"""
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Metrics(object):
+    """
+    In-process metrics registry
+    Args:
+        prefix: prefix for exported metric names
+        buckets: histogram bucket upper bounds in seconds
+    """
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1,
+                       0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, prefix='cmpd', buckets=None):
+        self.prefix = prefix
+        self.buckets = tuple(buckets or self.default_buckets)
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increment a counter
+        Args:
+            name: the counter name
+            value: amount to add
+            labels: metric labels, ie, stage='fetch'
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """
+        Set a gauge
+        Args:
+            name: the gauge name
+            value: the current value
+            labels: metric labels
+        """
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name, seconds, **labels):
+        """
+        Record a latency in a histogram
+        Args:
+            name: the histogram name
+            seconds: the observed latency
+            labels: metric labels
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = {'buckets': [0] * len(self.buckets),
+                             'count': 0, 'sum': 0.0}
+                self._histograms[key] = histogram
+            index = bisect.bisect_left(self.buckets, seconds)
+            if index < len(self.buckets):
+                histogram['buckets'][index] += 1
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Time a block into a histogram
+        Args:
+            name: the histogram name
+            labels: metric labels
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter(self, name, **labels):
+        """
+        Current value of a counter
+        """
+        with self._lock:
+            return self._counters.get(self._key(name, labels), 0)
+
+    def reset(self):
+        """
+        Clear all metrics
+        """
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def _name(self, name, labels, suffix=''):
+        metric = '{0}_{1}{2}'.format(self.prefix, name, suffix)
+        if labels:
+            metric += '{' + ','.join('{0}="{1}"'.format(k, str(v).replace('"', '\\"'))
+                                     for k, v in labels) + '}'
+        return metric
+
+    def to_prometheus(self):
+        """
+        Export metrics in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            for kind, metrics in (('counter', self._counters), ('gauge', self._gauges)):
+                typed = set()
+                for (name, labels), value in sorted(metrics.items()):
+                    if name not in typed:
+                        lines.append('# TYPE {0}_{1} {2}'.format(
+                            self.prefix, name, kind))
+                        typed.add(name)
+                    lines.append('{0} {1}'.format(
+                        self._name(name, labels), value))
+            typed = set()
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name not in typed:
+                    lines.append('# TYPE {0}_{1} histogram'.format(
+                        self.prefix, name))
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(self.buckets, histogram['buckets']):
+                    cumulative += count
+                    lines.append('{0} {1}'.format(self._name(
+                        name, labels + (('le', bound),), '_bucket'), cumulative))
+                lines.append('{0} {1}'.format(self._name(
+                    name, labels + (('le', '+Inf'),), '_bucket'), histogram['count']))
+                lines.append('{0} {1}'.format(
+                    self._name(name, labels, '_sum'), histogram['sum']))
+                lines.append('{0} {1}'.format(
+                    self._name(name, labels, '_count'), histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """
+        Atomically write metrics to a file, ie, for the node_exporter textfile collector
+        Args:
+            path: the file path to write
+        """
+        tmp_path = '{0}.tmp'.format(path)
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def serve(self, port, host='0.0.0.0'):
+        """
+        Serve metrics at /metrics from a background thread
+        Args:
+            port: the port to listen on, 0 for any free port
+            host: the interface to bind
+        Returns the running HTTP server
+        """
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                content = metrics.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header(
+                    'Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+METRICS = Metrics()  # process-wide registry
@@ -0,0 +1,164 @@
+"""
+Module for rate limiting API calls against a quota
+A sliding window shared by threads, or by processes through a locked state file
+"""
+import os
+import json
+import time
+import asyncio
+import threading
+from cmpd_accidents import Logger
+from cmpd_accidents import METRICS
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+
+class RateLimiter(object):
+    """
+    Sliding window keeping calls within a quota per period
+    Up to quota calls are allowed in any window of per seconds, ie, OpenWeatherAPI's
+    60 calls per minute, so the sustained rate is the full quota
+    Args:
+        quota: max calls per period
+        per: the quota period in seconds
+        path: optional state file to share the window across processes (file lock)
+        name: the limiter name for metrics
+    """
+
+    def __init__(self, quota, per=60.0, path=None, name='openweather'):
+        if path is not None and fcntl is None:
+            raise RuntimeError('Shared rate limiting requires fcntl file locks')
+        if quota < 1:
+            raise ValueError('The quota must allow at least one call')
+        self.quota = quota
+        self.per = per
+        self.path = path
+        self.name = name
+        self._lock = threading.Lock()
+        self._state = {'calls': []}
+        self.logger = Logger('log', self.__class__.__name__,
+                             maxbytes=10 * 1024 * 1024).get()
+
+    def _update(self, func):
+        """
+        Apply func to the window state under the thread lock and, when shared, the file lock
+        Args:
+            func: callable taking the state dictionary, mutating it and returning a result
+        Returns the result of func
+        """
+        with self._lock:
+            if self.path is None:
+                return func(self._state)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                with os.fdopen(os.dup(fd), 'r+') as f:
+                    content = f.read()
+                    state = json.loads(content) if content else {}
+                    state = {'calls': state.get('calls', [])}
+                    result = func(state)
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                return result
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+    def _expire(self, state, now):
+        """
+        Drop calls older than the window
+        Args:
+            state: the window state
+            now: epoch seconds
+        """
+        calls = state['calls']
+        start = 0
+        while start < len(calls) and calls[start] <= now - self.per:
+            start += 1
+        state['calls'] = calls[start:]
+
+    def _take(self, tokens):
+        """
+        Take tokens if the window allows it, in one locked update
+        Args:
+            tokens: number of calls to reserve
+        Returns tuple of seconds to wait (0 when taken) and utilization after the attempt
+        """
+        if tokens > self.quota:
+            raise ValueError('Cannot reserve {0} calls of a {1} call quota'.format(
+                tokens, self.quota))
+
+        def take(state):
+            now = time.time()
+            self._expire(state, now)
+            calls = state['calls']
+            if len(calls) + tokens <= self.quota:
+                calls.extend([now] * tokens)
+                wait = 0.0
+            else:
+                # wait until enough calls leave the window
+                wait = max(calls[len(calls) + tokens - self.quota - 1] + self.per - now, 1e-6)
+            return wait, round(len(calls) / float(self.quota), 4)
+        return self._update(take)
+
+    def try_acquire(self, tokens=1):
+        """
+        Take tokens if available without waiting
+        Args:
+            tokens: number of calls to reserve
+        Returns 0 when taken, otherwise the seconds to wait before trying again
+        """
+        return self._take(tokens)[0]
+
+    def acquire(self, tokens=1, timeout=None):
+        """
+        Block until tokens are available
+        Args:
+            tokens: number of calls to reserve
+            timeout: max seconds to wait, None waits as long as needed
+        Returns True when acquired, False on timeout
+        """
+        start = time.perf_counter()
+        wait, used = self._take(tokens)
+        while wait:
+            if timeout is not None and time.perf_counter() - start + wait > timeout:
+                return False
+            time.sleep(wait)
+            wait, used = self._take(tokens)
+        self._record(time.perf_counter() - start, used)
+        return True
+
+    async def acquire_async(self, tokens=1):
+        """
+        Wait for tokens without blocking the event loop
+        Args:
+            tokens: number of calls to reserve
+        """
+        start = time.perf_counter()
+        wait, used = self._take(tokens)
+        while wait:
+            await asyncio.sleep(wait)
+            wait, used = self._take(tokens)
+        self._record(time.perf_counter() - start, used)
+        return True
+
+    def _record(self, waited, used):
+        METRICS.inc('rate_limit_acquired_total', limiter=self.name)
+        METRICS.observe('rate_limit_wait_seconds', waited, limiter=self.name)
+        METRICS.set_gauge('rate_limit_utilization', used, limiter=self.name)
+        if waited > 1:
+            self.logger.info('Waited {0:.3f}s for {1} quota'.format(waited, self.name))
+
+    def utilization(self):
+        """
+        Share of the quota used in the current window
+        Returns 0.0 for an idle window up to 1.0 when calls are held back by the quota
+        """
+        def used(state):
+            self._expire(state, time.time())
+            return len(state['calls']) / float(self.quota)
+        return round(self._update(used), 4)
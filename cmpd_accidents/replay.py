@@ -0,0 +1,229 @@
+"""
+Module for replaying archived CMPD feed snapshots
+Rebuilds the accidents collection from JSONL snapshot files, one feed response
+(or single event) per line, with checkpoints so a large backfill can resume.
+Only archived weather is kept: OpenWeatherAPI current weather would attach today's
+conditions to old accidents, so events without weatherInfo are written without it
+"""
+import os
+import gzip
+import json
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from cmpd_accidents import Logger
+from cmpd_accidents import METRICS
+from cmpd_accidents import MongoDBConnect, close_mongo_clients
+from cmpd_accidents import SeenIndex
+
+
+def iter_snapshot(path, start_line=0):
+    """
+    Stream the events of a snapshot file line by line
+    Args:
+        path: JSONL snapshot file, gzip compressed when ending in .gz
+        start_line: number of lines already replayed to skip
+    Returns generator of (line number, list of events)
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            if line_no <= start_line:
+                continue
+            line = line.strip()
+            if not line:
+                yield line_no, []
+                continue
+            data = json.loads(line)
+            yield line_no, data if isinstance(data, list) else [data]
+
+
+class ReplayEngine(object):
+    """
+    Backfill accidents from archived feed snapshots
+    Archived weatherInfo is kept, events without it are written unenriched
+    Args:
+        database: the database to upsert to
+        seen_index: SeenIndex deduplicating across snapshots, rebuilt from the database when empty
+        checkpoint_path: optional JSON file of lines replayed per snapshot file
+        batch_size: events per write batch
+        writers: parallel write batches in flight
+        collection: the collection to upsert to
+    """
+
+    def __init__(self, database, seen_index=None, checkpoint_path=None, batch_size=500,
+                 writers=4, collection='accidentsv2'):
+        self.database = database
+        self.seen_index = seen_index if seen_index is not None else SeenIndex()
+        self.checkpoint_path = checkpoint_path
+        self.batch_size = batch_size
+        self.writers = writers
+        self.collection = collection
+        self.checkpoint = self._load_checkpoint()
+        self.stats = {'lines': 0, 'events': 0, 'duplicates': 0, 'unenriched': 0,
+                      'inserted': 0, 'matched': 0, 'seconds': 0.0}
+        self.logger = Logger('log', self.__class__.__name__,
+                             maxbytes=10 * 1024 * 1024).get()
+
+    def _load_checkpoint(self):
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                return json.load(f)
+        return {}
+
+    def _save_checkpoint(self, path, line_no):
+        """
+        Atomically record the lines replayed of a snapshot file
+        Args:
+            path: the snapshot file
+            line_no: lines fully written
+        """
+        self.checkpoint[path] = line_no
+        if not self.checkpoint_path:
+            return
+        tmp_path = '{0}.tmp'.format(self.checkpoint_path)
+        with open(tmp_path, 'w') as f:
+            json.dump(self.checkpoint, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def select_new(self, events):
+        """
+        Drop events already seen in the database, earlier snapshots or this batch
+        Args:
+            events: list of event json
+        Returns list of new events, marked as seen
+        """
+        new_ids = self.seen_index.diff(event.get('EventNo') for event in events
+                                       if event.get('EventNo') is not None)
+        new_events = []
+        for event in events:
+            if event.get('EventNo') in new_ids:
+                new_ids.discard(event.get('EventNo'))
+                new_events.append(event)
+        self.seen_index.add(event.get('EventNo') for event in new_events)
+        self.stats['duplicates'] += len(events) - len(new_events)
+        return new_events
+
+    def count_unenriched(self, events):
+        """
+        Count events without archived weather, they are written without weatherInfo
+        Args:
+            events: list of event json
+        Returns the events
+        """
+        self.stats['unenriched'] += sum(1 for event in events if not event.get('weatherInfo'))
+        return events
+
+    def _write(self, events):
+        with self.database as db:
+            return db.upsert_bulk(collection=self.collection, items=events,
+                                  batch_size=self.batch_size)
+
+    def replay(self, paths):
+        """
+        Replay snapshot files in order, resuming from the checkpoint
+        Args:
+            paths: list of snapshot file paths
+        Returns dictionary of counters and throughput
+        """
+        if not self.seen_index.loaded:
+            with self.database as db:
+                self.seen_index.rebuild(db, collection=self.collection)
+            self.logger.info('Rebuilt seen index with {0} events'.format(len(self.seen_index)))
+        start = time.perf_counter()
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.writers) as executor:
+            for path in paths:
+                key = os.path.abspath(path)
+                start_line = self.checkpoint.get(key, 0)
+                if start_line:
+                    self.logger.info('Resuming {0} after line {1}'.format(path, start_line))
+                batch, line_no = [], start_line
+                for line_no, events in iter_snapshot(path, start_line):
+                    self.stats['lines'] += 1
+                    self.stats['events'] += len(events)
+                    batch.extend(self.select_new(events))
+                    if len(batch) >= self.batch_size:
+                        self._submit(executor, in_flight, batch, key, line_no)
+                        batch = []
+                self._submit(executor, in_flight, batch, key, line_no)
+            self._drain(in_flight, 0)
+        self.stats['seconds'] = time.perf_counter() - start
+        self.logger.info('Replay finished: {0}'.format(json.dumps(self.report())))
+        return self.report()
+
+    def _submit(self, executor, in_flight, batch, path, line_no):
+        """
+        Write a batch in the background
+        Args:
+            executor: the writer pool
+            in_flight: deque of pending (future, path, line) in submit order
+            batch: list of new events
+            path: the snapshot file the batch ends in
+            line_no: the last line of the batch
+        """
+        future = executor.submit(self._write, self.count_unenriched(batch)) if batch else None
+        in_flight.append((future, path, line_no))
+        self._drain(in_flight, self.writers)
+
+    def _drain(self, in_flight, limit):
+        """
+        Wait for the oldest writes until at most limit are in flight, checkpointing in order
+        Args:
+            in_flight: deque of pending (future, path, line) in submit order
+            limit: writes allowed to stay in flight
+        """
+        while in_flight and (len(in_flight) > limit or in_flight[0][0] is None
+                             or in_flight[0][0].done()):
+            future, path, line_no = in_flight.popleft()
+            if future is not None:
+                try:
+                    counts = future.result()
+                except Exception as e:
+                    self.logger.exception('Replay write failed at {0}:{1}: {2}'.format(
+                        path, line_no, str(e)))
+                    raise
+                self.stats['inserted'] += counts['inserted']
+                self.stats['matched'] += counts['matched']
+                METRICS.inc('replay_events_inserted_total', counts['inserted'])
+            self._save_checkpoint(path, line_no)
+
+    def report(self):
+        """
+        Counters and throughput of the replay
+        Returns dictionary of counters, events/second and inserts/second
+        """
+        report = dict(self.stats)
+        seconds = report['seconds'] or 1e-9
+        report['events_per_second'] = round(report['events'] / seconds, 1)
+        report['inserts_per_second'] = round(report['inserted'] / seconds, 1)
+        return report
+
+
+def main():
+    """ From Main argparse for command line """
+    parser = argparse.ArgumentParser(
+        description='Replay archived CMPD feed snapshots into the database')
+    parser.add_argument(
+        'host', help='Enter the db host to connect, full connection string')
+    parser.add_argument(
+        'snapshots', help='JSONL snapshot files (.gz allowed) in replay order', nargs='+')
+    parser.add_argument(
+        '--checkpoint', help='Checkpoint file to resume from', default='replay_checkpoint.json')
+    parser.add_argument(
+        '--batch-size', help='Events per write batch', type=int, default=500)
+    parser.add_argument(
+        '--writers', help='Parallel write batches', type=int, default=4)
+    args = parser.parse_args()
+    engine = ReplayEngine(MongoDBConnect(args.host, max_pool_size=args.writers * 2),
+                          checkpoint_path=args.checkpoint, batch_size=args.batch_size,
+                          writers=args.writers)
+    try:
+        print(json.dumps(engine.replay(args.snapshots), indent=2))
+    finally:
+        close_mongo_clients()
+
+
+if __name__ == '__main__':
+    main()
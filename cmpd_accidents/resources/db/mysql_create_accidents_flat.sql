@@ -0,0 +1,43 @@
+-- Seed script for the flattened accidents table used by SQLAlchemyConnect.insert_flat
+-- Weather columns are named after cmpd_accidents.features.feature_map keys
+CREATE TABLE `cmpd_accidents`.`accidents_flat` (
+  `EventNo` VARCHAR(150) NOT NULL,
+  `XCoordinate` VARCHAR(150) NULL,
+  `YCoordinate` VARCHAR(150) NULL,
+  `EventDateTime` VARCHAR(150) NULL,
+  `TypeDescription` VARCHAR(250) NULL,
+  `CrossStreet1` VARCHAR(150) NULL,
+  `CrossStreet2` VARCHAR(150) NULL,
+  `Latitude` VARCHAR(150) NULL,
+  `Division` VARCHAR(150) NULL,
+  `Longitude` VARCHAR(150) NULL,
+  `TypeCode` VARCHAR(150) NULL,
+  `base` VARCHAR(150) NULL,
+  `weatherClouds` INT NULL,
+  `weatherCod` INT NULL,
+  `weatherLat` DOUBLE NULL,
+  `weatherLong` DOUBLE NULL,
+  `weatherDt` BIGINT NULL,
+  `weatherId` BIGINT NULL,
+  `weatherGrnd` DOUBLE NULL,
+  `weatherHumidity` DOUBLE NULL,
+  `weatherPressure` DOUBLE NULL,
+  `weatherSealevel` DOUBLE NULL,
+  `weatherTemp` DOUBLE NULL,
+  `weatherTempmax` DOUBLE NULL,
+  `weatherTempMin` DOUBLE NULL,
+  `weatherName` VARCHAR(150) NULL,
+  `weatherRain1` DOUBLE NULL,
+  `weatherRain3` DOUBLE NULL,
+  `weatherSnow1` DOUBLE NULL,
+  `weatherCountry` VARCHAR(150) NULL,
+  `weatherMsg` DOUBLE NULL,
+  `weatherSunrise` BIGINT NULL,
+  `weatherSunset` BIGINT NULL,
+  `weatherSysType` INT NULL,
+  `weatherVisibility` INT NULL,
+  `weather` JSON,
+  `weatherWindDeg` DOUBLE NULL,
+  `weatherWindGust` DOUBLE NULL,
+  `weatherWindSpeed` DOUBLE NULL,
+  PRIMARY KEY (`EventNo`));
@@ -1,20 +1,151 @@
+import time
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
+from urllib3.util.retry import Retry
 from cmpd_accidents import Logger
+from cmpd_accidents import METRICS
 
 
-class RestService(object):
+def check_status(logger, endpoint, method, status_code):
+    """
+    Raise on error status codes
+    Args:
+        logger: the logger to report to
+        endpoint: the endpoint requested
+        method: the HTTP method for logging
+        status_code: the response status code
+    """
+    if (status_code == requests.codes.ok):
+        logger.info(
+            "{0} API endpoint request received, endpoint: {1}".format(method, endpoint))
+    elif (status_code == requests.codes.bad_request):
+        logger.error(
+            "Status: {0} | Bad Request. Check API Key or connectivity".format(status_code))
+        raise Exception("Bad Request")
+    elif (status_code == requests.codes.unauthorized):
+        logger.error(
+            "Status: {0} | API Key is incorrect or restricted".format(status_code))
+        raise Exception("Unauthorized")
+    elif (status_code == requests.codes.forbidden):
+        logger.error(
+            "Status: {0} | API Key is incorrect or restricted".format(status_code))
+        raise Exception("Forbidden")
+    elif (status_code == requests.codes.not_found):
+        logger.error(
+            "Status: {0} | Not found".format(status_code))
+        raise Exception("Not Found")
+    elif (status_code == requests.codes.too_many_requests):
+        logger.error(
+            "Status: {0} | Rate limit exceeded, check API quota".format(status_code))
+        raise Exception("Too Many Requests")
+    else:
+        logger.error(
+            "Status: {0} | An error has occurred".format(status_code))
+        raise Exception("Internal server error")
+
+
+class RateLimitedRetry(Retry):
+    """
+    urllib3 Retry taking a rate limiter token before every retry, so retried
+    requests count against the same quota as first attempts
+    Args:
+        rate_limiter: optional RateLimiter to acquire from after the backoff
+    """
+
+    def __init__(self, *args, rate_limiter=None, **kwargs):
+        super(RateLimitedRetry, self).__init__(*args, **kwargs)
+        self.rate_limiter = rate_limiter
+
+    def new(self, **kwargs):
+        retry = super(RateLimitedRetry, self).new(**kwargs)
+        retry.rate_limiter = self.rate_limiter
+        return retry
+
+    def sleep(self, response=None):
+        super(RateLimitedRetry, self).sleep(response)
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
+
+class RequestStats(object):
+    """
+    Latency, attempt and error counters of an endpoint, also recorded to the process metrics
+    Expects an endpoint attribute, call init_stats from __init__
+    """
+
+    def init_stats(self):
+        """
+        Reset the counters
+        """
+        self.stats = {'requests': 0, 'attempts': 0,
+                      'errors': 0, 'latency_total': 0.0, 'latency_max': 0.0}
+        self._stats_lock = threading.Lock()
+
+    def _record(self, latency, attempts, error):
+        """
+        Record a request
+        Args:
+            latency: seconds including retries
+            attempts: number of attempts, None for one
+            error: whether the request failed
+        """
+        METRICS.observe('http_request_seconds', latency, endpoint=self.endpoint)
+        METRICS.inc('http_requests_total', endpoint=self.endpoint)
+        METRICS.inc('http_attempts_total', attempts or 1, endpoint=self.endpoint)
+        if error:
+            METRICS.inc('http_errors_total', endpoint=self.endpoint)
+        with self._stats_lock:
+            self.stats['requests'] += 1
+            self.stats['attempts'] += attempts or 1
+            self.stats['errors'] += int(error)
+            self.stats['latency_total'] += latency
+            self.stats['latency_max'] = max(self.stats['latency_max'], latency)
+
+    def get_stats(self):
+        """
+        Latency and attempt counters for the endpoint
+        Returns dictionary of counters including mean latency in seconds
+        """
+        with self._stats_lock:
+            stats = dict(self.stats, endpoint=self.endpoint)
+        stats['latency_mean'] = (stats['latency_total'] / stats['requests']
+                                 if stats['requests'] else 0.0)
+        return stats
+
+
+class RestService(RequestStats):
     """
     Service helper class for API requests
     Args:
         endpoint: URL endpoint
+        timeout: (connect, read) timeout in seconds
+        pool_size: max pooled connections, match to the number of concurrent callers
+        max_retries: retry budget for connection errors and 429/5xx responses (GET only)
+        backoff_factor: exponential backoff factor between retries in seconds
+        rate_limiter: optional RateLimiter every retry waits on, the caller acquires
+            for the first attempt
     """
+    retry_statuses = (429, 500, 502, 503, 504)
 
-    def __init__(self, endpoint):
+    def __init__(self, endpoint, timeout=(3.05, 10), pool_size=10, max_retries=3, backoff_factor=0.5,
+                 rate_limiter=None):
         self.endpoint = endpoint
+        self.timeout = timeout
         self.session = requests.Session()
+        retry = RateLimitedRetry(total=max_retries, backoff_factor=backoff_factor,
+                                 status_forcelist=self.retry_statuses, raise_on_status=False,
+                                 respect_retry_after_header=True, rate_limiter=rate_limiter)
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         self.session.headers.update(
-            {'Content-Type': 'application/json'})  # default app/json
+            {'Content-Type': 'application/json',  # default app/json
+             'Accept-Encoding': 'gzip, deflate'})
+        self.validators = {}  # conditional GET validators per params
+        self.init_stats()
         self.logger = Logger('log', self.__class__.__name__,
                              maxbytes=10*1024*1024).get()
 
@@ -24,42 +155,25 @@ class RestService(object):
     def __exit__(self, type, value, traceback):
         pass
 
-    def get(self, params):
+    def get(self, params, conditional=False):
         """
         GET
         Args:
             params: parameters for request
+            conditional: send ETag/Last-Modified validators from the previous response,
+                an unchanged resource returns a 304 response with no body
         """
-        try:
-            r = self.session.request(
-                method='get', url=self.endpoint, params=params)
-            if (r.status_code == requests.codes.ok):
-                self.logger.info(
-                    "GET API endpoint request received, endpoint: {0}".format(self.endpoint))
-                return r
-            elif (r.status_code == requests.codes.bad_request):
-                self.logger.error(
-                    "Status: {0} | Bad Request. Check API Key or connectivity".format(r.status_code))
-                raise Exception("Bad Request")
-            elif (r.status_code == requests.codes.unauthorized):
-                self.logger.error(
-                    "Status: {0} | API Key is incorrect or restricted".format(r.status_code))
-                raise Exception("Unauthorized")
-            elif (r.status_code == requests.codes.forbidden):
-                self.logger.error(
-                    "Status: {0} | API Key is incorrect or restricted".format(r.status_code))
-                raise Exception("Forbidden")
-            elif (r.status_code == requests.codes.not_found):
-                self.logger.error(
-                    "Status: {0} | Not found".format(r.status_code))
-                raise Exception("Not Found")
-            else:
-                self.logger.error(
-                    "Status: {0} | An error has occurred".format(r.status_code))
-                raise Exception("Internal server error")
-        except RequestException as e:
-            self.logger.exception(str(e))
-            raise
+        key = tuple(sorted((params or {}).items()))
+        headers = self.validators.get(key, {}) if conditional else {}
+        r = self._request('get', params=params, headers=headers)
+        if (conditional and r.status_code == requests.codes.not_modified):
+            self.logger.info(
+                "GET API endpoint not modified, endpoint: {0}".format(self.endpoint))
+            return r
+        self._check_status('GET', r)
+        if conditional:
+            self._store_validators(key, r)
+        return r
 
     def post(self, payload, headers):
         """
@@ -68,33 +182,58 @@ class RestService(object):
             payload: payload for request
             headers: headers for request (provides option to override headers for text/xml)
         """
+        r = self._request('post', data=payload, headers=headers)
+        self._check_status('POST', r)
+        return r
+
+    def _request(self, method, **kwargs):
+        """
+        Send a request with the configured timeout, recording latency and attempts
+        Args:
+            method: the HTTP method
+            kwargs: arguments for requests.Session.request
+        """
+        start = time.perf_counter()
         try:
             r = self.session.request(
-                method='post', url=self.endpoint, data=payload, headers=headers)
-            if (r.status_code == requests.codes.ok):
-                self.logger.info(
-                    "POST API endpoint request received, endpoint: {0}".format(self.endpoint))
-                return r
-            elif (r.status_code == requests.codes.bad_request):
-                self.logger.error(
-                    "Status: {0} | Bad Request. Check API Key or connectivity".format(r.status_code))
-                raise Exception("Bad Request")
-            elif (r.status_code == requests.codes.unauthorized):
-                self.logger.error(
-                    "Status: {0} | API Key is incorrect or restricted".format(r.status_code))
-                raise Exception("Unauthorized")
-            elif (r.status_code == requests.codes.forbidden):
-                self.logger.error(
-                    "Status: {0} | API Key is incorrect or restricted".format(r.status_code))
-                raise Exception("Forbidden")
-            elif (r.status_code == requests.codes.not_found):
-                self.logger.error(
-                    "Status: {0} | Not found".format(r.status_code))
-                raise Exception("Not Found")
-            else:
-                self.logger.error(
-                    "Status: {0} | An error has occurred".format(r.status_code))
-                raise Exception("Internal server error")
+                method=method, url=self.endpoint, timeout=self.timeout, **kwargs)
         except RequestException as e:
+            self._record(time.perf_counter() - start, None, error=True)
             self.logger.exception(str(e))
             raise
+        retries = getattr(getattr(r, 'raw', None), 'retries', None)
+        history = getattr(retries, 'history', None)
+        self._record(time.perf_counter() - start,
+                     len(history) + 1 if isinstance(history, tuple) else 1,
+                     error=r.status_code >= 400)
+        return r
+
+    def _check_status(self, method, r):
+        """
+        Raise on error status codes
+        Args:
+            method: the HTTP method for logging
+            r: the response
+        """
+        check_status(self.logger, self.endpoint, method, r.status_code)
+
+    def _store_validators(self, key, r):
+        """
+        Keep ETag/Last-Modified of a response for the next conditional GET
+        Args:
+            key: the params key of the request
+            r: the response
+        """
+        validators = {}
+        if r.headers.get('ETag'):
+            validators['If-None-Match'] = r.headers['ETag']
+        if r.headers.get('Last-Modified'):
+            validators['If-Modified-Since'] = r.headers['Last-Modified']
+        if validators:
+            self.validators[key] = validators
+
+    def clear_validators(self):
+        """
+        Forget stored validators so the next conditional GET fetches in full
+        """
+        self.validators.clear()
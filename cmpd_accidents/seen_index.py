@@ -0,0 +1,109 @@
+"""
+Module for tracking already persisted event ids locally
+Lets a poll cycle find new events without a database round trip
+"""
+import math
+import hashlib
+import threading
+
+
+class BloomFilter(object):
+    """
+    Simple Bloom filter for string ids
+    Args:
+        capacity: expected number of ids to hold
+        error_rate: target false-positive rate at capacity, ie, 0.001
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(
+            -capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(
+            1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(str(item).encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        """
+        Add an id to the filter
+        Args:
+            item: the id to add
+        """
+        positions = self._positions(item)
+        with self._lock:  # |= on the bytearray is a read-modify-write
+            for pos in positions:
+                self.bits[pos >> 3] |= 1 << (pos & 7)
+            self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(item))
+
+    def __len__(self):
+        return self.count
+
+
+class SeenIndex(object):
+    """
+    Local index of persisted event ids, rebuilt from the database on startup
+    Args:
+        error_rate: Bloom filter false-positive rate, None for an exact set
+        capacity: expected number of ids when using a Bloom filter
+    A false positive marks a new event as already seen, so it is skipped;
+    use the exact set unless memory is a concern
+    """
+
+    def __init__(self, error_rate=None, capacity=1000000):
+        self.error_rate = error_rate
+        self.capacity = capacity
+        self.loaded = False
+        self._ids = self._new_store()
+
+    def _new_store(self):
+        if self.error_rate:
+            return BloomFilter(self.capacity, self.error_rate)
+        return set()
+
+    def rebuild(self, db, collection):
+        """
+        Rebuild index from all ids already persisted
+        Args:
+            db: the open database connector with all_ids, ie, MongoDBConnect or SQLAlchemyConnect
+            collection: the collection (or table) to load ids from
+        """
+        self._ids = self._new_store()
+        self.add(db.all_ids(collection))
+        self.loaded = True
+
+    def add(self, ids):
+        """
+        Mark ids as seen
+        Args:
+            ids: iterable of ids
+        """
+        for item in ids:
+            self._ids.add(item)
+
+    def diff(self, ids):
+        """
+        Find ids not yet seen
+        Args:
+            ids: iterable of ids to check
+        Returns set of unseen ids
+        """
+        return {item for item in ids if item not in self._ids}
+
+    def __contains__(self, item):
+        return item in self._ids
+
+    def __len__(self):
+        return len(self._ids)
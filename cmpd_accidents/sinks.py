@@ -0,0 +1,264 @@
+"""
+Module for persistence sinks
+Each enriched batch is written to every configured sink concurrently, ie,
+MongoDB plus a flattened relational table, without re-running the pipeline
+"""
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from cmpd_accidents import Logger
+from cmpd_accidents import METRICS
+
+
+class MongoSink(object):
+    """
+    Sink upserting enriched accidents to a MongoDB collection
+    Args:
+        database: the MongoDBConnect to write with
+        collection: the collection to upsert to
+        batch_size: max operations per bulk write
+        name: unique name of the sink for metrics and results
+    """
+
+    def __init__(self, database, collection='accidentsv2', batch_size=500, name='mongo'):
+        self.name = name
+        self.database = database
+        self.collection = collection
+        self.batch_size = batch_size
+
+    def write(self, items):
+        """
+        Upsert items
+        Args:
+            items: list of enriched json
+        Returns dictionary of inserted and matched counts
+        """
+        with self.database as db:
+            counts = db.upsert_bulk(collection=self.collection, items=items,
+                                    batch_size=self.batch_size)
+        return counts if isinstance(counts, dict) else {'inserted': len(items), 'matched': 0}
+
+
+class SQLSink(object):
+    """
+    Sink inserting flattened accidents to a relational table, rows already present are skipped
+    Args:
+        database: the SQLAlchemyConnect to write with
+        table: the table to insert to, ie, the accidents_flat seed table
+        batch_size: max rows per executemany
+        mapping: column name to nested path map, defaults to feature_map
+        name: unique name of the sink for metrics and results
+    """
+
+    def __init__(self, database, table='accidents_flat', batch_size=1000, mapping=None, name='sql'):
+        self.name = name
+        self.database = database
+        self.table = table
+        self.batch_size = batch_size
+        self.mapping = mapping
+
+    def write(self, items):
+        """
+        Insert flattened rows
+        Args:
+            items: list of enriched json
+        Returns dictionary of inserted and matched counts
+        """
+        with self.database as db:
+            inserted = db.insert_flat(table=self.table, items=items, mapping=self.mapping,
+                                      batch_size=self.batch_size)
+        return {'inserted': inserted, 'matched': 0}
+
+
+class FileSink(object):
+    """
+    Sink appending accidents to a JSONL file
+    Args:
+        path: the file to append to
+        batch_size: max lines per write
+        name: unique name of the sink for metrics and results
+    """
+
+    def __init__(self, path, batch_size=1000, name='file'):
+        self.name = name
+        self.path = path
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+
+    def write(self, items):
+        """
+        Append items as JSON lines
+        Args:
+            items: list of enriched json
+        Returns dictionary of inserted and matched counts
+        """
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            for start in range(0, len(items), self.batch_size):
+                f.write(''.join(json.dumps(item, default=str) + '\n'
+                                for item in items[start:start + self.batch_size]))
+        return {'inserted': len(items), 'matched': 0}
+
+
+class FanOut(object):
+    """
+    Write batches to several sinks concurrently with per-sink timing and failure isolation
+    Delivery is tracked per sink per EventNo: events a sink failed are kept and written to it
+    with its next batch or redeliver(), events a sink already has are not written to it again
+    A write fails when any required sink fails, so the batch is not acknowledged or marked seen
+    Args:
+        sinks: list of sinks with a name and a write(items) method
+        required: names of sinks whose failure fails the write, defaults to all sinks;
+            failures of other sinks are logged and counted only (best effort)
+        max_retained: max delivered and undelivered events remembered per sink
+    """
+
+    def __init__(self, sinks, required=None, max_retained=100000):
+        if not sinks:
+            raise ValueError('At least one sink is required')
+        self.sinks = list(sinks)
+        self.required = set(required) if required is not None else {
+            sink.name for sink in self.sinks}
+        self.max_retained = max_retained
+        self.last_results = {}
+        self._delivered = {sink.name: OrderedDict() for sink in self.sinks}
+        self._undelivered = {sink.name: OrderedDict() for sink in self.sinks}
+        self._executor = None
+        self._lock = threading.Lock()
+        self.logger = Logger('log', self.__class__.__name__,
+                             maxbytes=10 * 1024 * 1024).get()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _write_sink(self, sink, items):
+        """
+        Write to a single sink, timed, never raising
+        Args:
+            sink: the sink to write to
+            items: list of enriched json
+        Returns tuple of counts and exception
+        """
+        try:
+            with METRICS.timer('sink_write_seconds', sink=sink.name):
+                counts = sink.write(items)
+            METRICS.inc('sink_events_total', counts['inserted'], sink=sink.name)
+            return counts, None
+        except Exception as e:
+            METRICS.inc('sink_errors_total', sink=sink.name)
+            self.logger.exception('Sink {0} failed to write {1} items: {2}'.format(
+                sink.name, len(items), str(e)))
+            return None, e
+
+    def _sink_batch(self, name, items):
+        """
+        Events a sink still needs, its undelivered events first
+        Args:
+            name: the sink name
+            items: list of enriched json
+        Returns list of enriched json
+        """
+        delivered = self._delivered[name]
+        batch = OrderedDict(self._undelivered[name])
+        unkeyed = []
+        for item in items:
+            event_no = item.get('EventNo')
+            if event_no is None:
+                unkeyed.append(item)
+            elif event_no not in delivered:
+                batch[event_no] = item
+        return list(batch.values()) + unkeyed
+
+    def _record(self, name, batch, error):
+        """
+        Remember the events a sink was or was not delivered
+        Args:
+            name: the sink name
+            batch: list of enriched json written to the sink
+            error: the exception of a failed write, None on success
+        """
+        delivered, undelivered = self._delivered[name], self._undelivered[name]
+        for item in batch:
+            event_no = item.get('EventNo')
+            if event_no is None:
+                continue
+            if error is None:
+                undelivered.pop(event_no, None)
+                delivered[event_no] = True
+                delivered.move_to_end(event_no)
+            else:
+                undelivered[event_no] = item
+        while len(delivered) > self.max_retained:
+            delivered.popitem(last=False)
+        dropped = 0
+        while len(undelivered) > self.max_retained:
+            undelivered.popitem(last=False)
+            dropped += 1
+        if dropped:
+            METRICS.inc('sink_dropped_total', dropped, sink=name)
+            self.logger.error('Sink {0} dropped {1} undelivered events over max_retained {2}'.format(
+                name, dropped, self.max_retained))
+
+    def write(self, items):
+        """
+        Write items and any events still undelivered to all sinks
+        Args:
+            items: list of enriched json
+        Returns dictionary of sink name to counts, None for failed sinks
+        """
+        with self._lock:
+            batches = {sink.name: self._sink_batch(sink.name, items) for sink in self.sinks}
+        pending = [sink for sink in self.sinks if batches[sink.name]]
+        if len(pending) <= 1:
+            outcomes = [self._write_sink(sink, batches[sink.name]) for sink in pending]
+        else:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=len(self.sinks))
+            outcomes = list(self._executor.map(
+                lambda sink: self._write_sink(sink, batches[sink.name]), pending))
+        with self._lock:
+            for sink, (_, error) in zip(pending, outcomes):
+                self._record(sink.name, batches[sink.name], error)
+        results = {sink.name: {'inserted': 0, 'matched': 0} for sink in self.sinks}
+        results.update((sink.name, counts) for sink, (counts, _) in zip(pending, outcomes))
+        self.last_results = results
+        failed = [error for sink, (_, error) in zip(pending, outcomes)
+                  if error is not None and sink.name in self.required]
+        if failed:
+            raise failed[0]
+        return self.last_results
+
+    def undelivered(self):
+        """
+        Number of events not yet delivered per sink
+        Returns dictionary of sink name to count
+        """
+        with self._lock:
+            return {name: len(events) for name, events in self._undelivered.items()}
+
+    def redeliver(self):
+        """
+        Write events sinks failed earlier, without a new batch
+        Returns dictionary of sink name to counts, None for failed sinks
+        """
+        return self.write([])
+
+    def primary(self, results):
+        """
+        Counts of the first sink
+        Args:
+            results: the dictionary returned by write
+        """
+        return results.get(self.sinks[0].name)
+
+    def close(self):
+        """
+        Stop the writer threads
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
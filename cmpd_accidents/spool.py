@@ -0,0 +1,321 @@
+"""
+Module for the durable local spool
+Enriched events are appended to segmented JSONL files and written to the
+database by a background flusher, so a slow or unavailable database does not
+lose already fetched weather data
+"""
+import os
+import json
+import threading
+from cmpd_accidents import Logger
+from cmpd_accidents import METRICS
+from cmpd_accidents import FanOut, MongoSink
+
+
+class Spool(object):
+    """
+    Append-only spool of json items in segment files with an acknowledged read position
+    Args:
+        path: directory holding the segment files
+        segment_bytes: size after which a new segment is started
+        fsync: fsync every append and acknowledgement
+        key: the id field of an item, pending ids are kept for dedup
+    """
+    segment_format = 'segment-{0:012d}.jsonl'
+    ack_file = 'ack.json'
+
+    def __init__(self, path, segment_bytes=8 * 1024 * 1024, fsync=True, key='EventNo'):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.key = key
+        self._lock = threading.Lock()
+        self._pending_ids = set()
+        self._pending = 0
+        self._listeners = []
+        self.logger = Logger('log', self.__class__.__name__,
+                             maxbytes=10 * 1024 * 1024).get()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.ack_position = self._load_ack()
+        segments = self.segments()
+        self.active = segments[-1] if segments else self.ack_position[0] + 1
+        self._recover(self.active)
+        self._file = open(self._segment_path(self.active), 'ab')
+        for item in self._read(self.ack_position)[0]:
+            self._pending += 1
+            self._pending_ids.add(item.get(key))
+        METRICS.set_gauge('spool_pending', self._pending)
+        self.logger.info('Opened spool {0} with {1} pending items'.format(
+            path, self._pending))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _segment_path(self, seq):
+        return os.path.join(self.path, self.segment_format.format(seq))
+
+    def segments(self):
+        """
+        Sequence numbers of the segment files, oldest first
+        """
+        return sorted(int(name[8:20]) for name in os.listdir(self.path)
+                      if name.startswith('segment-') and name.endswith('.jsonl'))
+
+    def _load_ack(self):
+        ack_path = os.path.join(self.path, self.ack_file)
+        if not os.path.exists(ack_path):
+            return (0, 0)
+        with open(ack_path) as f:
+            ack = json.load(f)
+        return (ack['segment'], ack['offset'])
+
+    def _recover(self, seq):
+        """
+        Truncate a torn last line left by a crash mid-append
+        Args:
+            seq: the segment to recover
+        """
+        segment_path = self._segment_path(seq)
+        if not os.path.exists(segment_path):
+            return
+        with open(segment_path, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                self.logger.warning('Truncating {0} torn bytes from {1}'.format(
+                    len(data) - end, segment_path))
+                f.truncate(end)
+
+    def on_append(self, listener):
+        """
+        Register a callable notified after every append, ie, to wake a flusher
+        Args:
+            listener: callable without arguments
+        """
+        self._listeners.append(listener)
+
+    def append(self, items):
+        """
+        Durably append items
+        Args:
+            items: list of json to append
+        """
+        if not items:
+            return
+        data = b''.join(json.dumps(item, default=str).encode('utf-8') + b'\n'
+                        for item in items)
+        with self._lock:
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._pending += len(items)
+            self._pending_ids.update(item.get(self.key) for item in items)
+            if self._file.tell() >= self.segment_bytes:
+                self._file.close()
+                self.active += 1
+                self._file = open(self._segment_path(self.active), 'ab')
+            pending = self._pending
+        METRICS.set_gauge('spool_pending', pending)
+        for listener in self._listeners:
+            listener()
+
+    def _read(self, position, max_items=None):
+        """
+        Read complete lines after a position
+        Args:
+            position: (segment, byte offset) to read from
+            max_items: max items to read, None for all
+        Returns tuple of items and the position after the last item
+        """
+        items = []
+        for seq in self.segments():
+            if seq < position[0]:
+                continue
+            offset = position[1] if seq == position[0] else 0
+            with open(self._segment_path(seq), 'rb') as f:
+                f.seek(offset)
+                for line in iter(f.readline, b''):
+                    if not line.endswith(b'\n'):
+                        break  # torn or in-progress line
+                    items.append(json.loads(line.decode('utf-8')))
+                    position = (seq, f.tell())
+                    if max_items is not None and len(items) >= max_items:
+                        return items, position
+        return items, position
+
+    def read_batch(self, max_items=500):
+        """
+        Read the oldest unacknowledged items
+        Args:
+            max_items: max items in the batch
+        Returns tuple of items and the position to acknowledge once they are written
+        """
+        with self._lock:
+            return self._read(self.ack_position, max_items)
+
+    def ack(self, position, items=()):
+        """
+        Acknowledge items as written up to a position
+        Args:
+            position: position returned by read_batch
+            items: the acknowledged items, dropped from the pending ids
+        """
+        ack_path = os.path.join(self.path, self.ack_file)
+        tmp_path = '{0}.tmp'.format(ack_path)
+        with self._lock:
+            with open(tmp_path, 'w') as f:
+                json.dump({'segment': position[0], 'offset': position[1]}, f)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, ack_path)
+            self.ack_position = tuple(position)
+            items = list(items)
+            self._pending = max(0, self._pending - len(items))
+            self._pending_ids.difference_update(item.get(self.key) for item in items)
+            pending = self._pending
+        METRICS.set_gauge('spool_pending', pending)
+
+    def compact(self):
+        """
+        Delete segments whose items are all acknowledged
+        Returns the number of segments deleted
+        """
+        removed = 0
+        with self._lock:
+            ack_seq, ack_offset = self.ack_position
+            for seq in self.segments():
+                if seq == self.active:
+                    continue
+                segment_path = self._segment_path(seq)
+                if seq < ack_seq or (seq == ack_seq and ack_offset >= os.path.getsize(segment_path)):
+                    os.remove(segment_path)
+                    removed += 1
+        if removed:
+            self.logger.info('Compacted {0} spool segments'.format(removed))
+        return removed
+
+    def pending(self):
+        """
+        Number of items not yet acknowledged
+        """
+        with self._lock:
+            return self._pending
+
+    def pending_ids(self):
+        """
+        Ids of the items not yet acknowledged
+        """
+        with self._lock:
+            return set(self._pending_ids)
+
+    def close(self):
+        """
+        Close the active segment
+        """
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+class SpoolFlusher(object):
+    """
+    Background thread writing spooled items to the database
+    Args:
+        spool: the spool to drain
+        database: the database to write to
+        collection: the collection to upsert to
+        batch_size: max items per database write
+        interval: seconds between flushes when not woken by an append
+        retry_interval: seconds to wait after a failed write
+        sinks: optional FanOut to write to instead of upserting to database
+    """
+
+    def __init__(self, spool, database, collection='accidentsv2', batch_size=500, interval=1.0,
+                 retry_interval=5.0, sinks=None):
+        self.spool = spool
+        self.database = database
+        self.collection = collection
+        self.sinks = sinks or FanOut([MongoSink(database, collection, batch_size)])
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.spool.on_append(self._wake.set)
+        self.logger = Logger('log', self.__class__.__name__,
+                             maxbytes=10 * 1024 * 1024).get()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def flush(self):
+        """
+        Write spooled items until the spool is drained or a write fails
+        Returns the number of items written
+        """
+        flushed = 0
+        while True:
+            items, position = self.spool.read_batch(self.batch_size)
+            if not items:
+                break
+            try:
+                with METRICS.timer('spool_flush_seconds'):
+                    self.sinks.write(items)
+            except Exception as e:
+                METRICS.inc('spool_flush_errors_total')
+                self.logger.exception('Spool flush failed, {0} items pending: {1}'.format(
+                    self.spool.pending(), str(e)))
+                raise
+            self.spool.ack(position, items)
+            METRICS.inc('spool_flushed_total', len(items))
+            flushed += len(items)
+        if flushed:
+            self.spool.compact()
+            self.logger.info('Flushed {0} spooled items'.format(flushed))
+        return flushed
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                self._stop.wait(self.retry_interval)
+
+    def start(self):
+        """
+        Start flushing in a background thread
+        """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """
+        Stop the background thread and make a final flush attempt
+        Args:
+            timeout: seconds to wait for the thread
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        try:
+            self.flush()
+        except Exception:
+            self.logger.warning('{0} items left in spool for the next run'.format(
+                self.spool.pending()))
@@ -0,0 +1,132 @@
+from unittest import TestCase
+from unittest.mock import MagicMock, Mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import asyncio
+import json
+import threading
+import cmpd_accidents
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        if 'lat' in query:
+            body = {'coord': {'lat': float(query['lat'][0])}}
+        else:
+            body = [{'EventNo': str(i), 'Latitude': 35 + i / 100.0, 'Longitude': -80}
+                    for i in range(25)]
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', '"feed"')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class FailingWeather(object):
+    """ Weather service failing for events north of a latitude """
+
+    def __init__(self, max_lat):
+        self.max_lat = max_lat
+
+    async def get(self, params):
+        await asyncio.sleep(0.01)
+        if params['lat'] > self.max_lat:
+            raise ValueError('lookup failed')
+        return {'coord': {'lat': params['lat']}}
+
+
+class TestAsyncService(TestCase):
+    """ Asyncio ingestion pipeline tests """
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.endpoint = 'http://127.0.0.1:{0}/'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_async_update(self):
+        db = MagicMock()
+        db.__enter__.return_value = db
+        db.find_ids.return_value = ['0']
+
+        async def run():
+            rest = cmpd_accidents.AsyncRestService(self.endpoint)
+            weather = cmpd_accidents.AsyncWeatherService(
+                self.endpoint, apiKey='test')
+            cmpd = cmpd_accidents.AsyncCMPDService(
+                db, rest, weather, concurrency=10, batch_size=10)
+            try:
+                return await cmpd.update_traffic_data(), await cmpd.update_traffic_data()
+            finally:
+                await rest.close()
+                await weather.close()
+
+        first, second = asyncio.run(run())
+        self.assertEqual(first, 24)
+        self.assertEqual(second, 0)
+        self.assertEqual(db.upsert_bulk.call_count, 3)
+        written = [item for call in db.upsert_bulk.call_args_list
+                   for item in call[1]['items']]
+        self.assertEqual([item['EventNo'] for item in written],
+                         [str(i) for i in range(1, 25)])
+        self.assertEqual(written[0]['weatherInfo']['coord']['lat'], 35.01)
+
+    def test_async_lookup_failure_awaits_writes(self):
+        db = MagicMock()
+        db.__enter__.return_value = db
+        db.find_ids.return_value = []
+        db.upsert_bulk.side_effect = RuntimeError('write failed')
+
+        async def run():
+            rest = cmpd_accidents.AsyncRestService(self.endpoint)
+            cmpd = cmpd_accidents.AsyncCMPDService(
+                db, rest, FailingWeather(35.15), concurrency=10, batch_size=10)
+            cmpd.logger = Mock()
+            try:
+                with self.assertRaises(ValueError):
+                    await cmpd.update_traffic_data()
+            finally:
+                await rest.close()
+            return cmpd
+
+        cmpd = asyncio.run(run())
+        self.assertEqual(db.upsert_bulk.call_count, 1)
+        cmpd.logger.error.assert_called_once()
+        self.assertIn('write failed', cmpd.logger.error.call_args[0][0])
+
+    def test_async_update_regions_and_sinks(self):
+        db = MagicMock()
+        db.__enter__.return_value = db
+        db.find_ids.return_value = []
+        extra = Mock(write=Mock(side_effect=lambda items: {'inserted': len(items), 'matched': 0}))
+        extra.name = 'extra'
+
+        async def run():
+            rest = cmpd_accidents.AsyncRestService(self.endpoint)
+            weather = cmpd_accidents.AsyncWeatherService(self.endpoint, apiKey='test')
+            cmpd = cmpd_accidents.AsyncCMPDService(
+                db, rest, weather, concurrency=10, batch_size=10, weather_region='cell',
+                region_precision=0, sinks=[cmpd_accidents.MongoSink(db), extra])
+            try:
+                return await cmpd.update_traffic_data(), rest, weather
+            finally:
+                cmpd.sinks.close()
+                await rest.close()
+                await weather.close()
+
+        persisted, rest, weather = asyncio.run(run())
+        self.assertEqual(persisted, 25)
+        # every event is in one grid cell, so one weather request is shared
+        self.assertEqual(weather.rest_service.get_stats()['requests'], 1)
+        self.assertEqual(rest.get_stats()['requests'], 1)
+        self.assertEqual(rest.get_stats()['errors'], 0)
+        self.assertEqual(sum(len(call[0][0]) for call in extra.write.call_args_list), 25)
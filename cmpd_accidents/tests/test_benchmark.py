@@ -0,0 +1,36 @@
+from unittest import TestCase
+from cmpd_accidents.benchmark import MemoryStore, percentile, run_benchmark
+
+
+class TestBenchmark(TestCase):
+    """ Offline ingestion benchmark tests """
+
+    def test_memory_store(self):
+        store = MemoryStore()
+        with store as db:
+            counts = db.upsert_bulk('accidentsv2', [{'EventNo': '1'}, {'EventNo': '2'}])
+            self.assertEqual(counts, {'inserted': 2, 'matched': 0})
+            counts = db.upsert_bulk('accidentsv2', [{'EventNo': '2'}, {'EventNo': '3'}])
+            self.assertEqual(counts, {'inserted': 1, 'matched': 1})
+            self.assertEqual(db.find_ids('accidentsv2', ['3', '4'], 10), ['3'])
+            self.assertEqual(sorted(db.all_ids('accidentsv2')), ['1', '2', '3'])
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([0.5], 99), 0.5)
+
+    def test_run_benchmark(self):
+        result = run_benchmark(10, cycles=3, max_workers=4, weather_latency=0)
+        # first poll returns 20 unseen events, later polls 10 new each
+        self.assertEqual(result['persisted'], 40)
+        self.assertEqual(result['weather_requests'], 40)
+        self.assertGreater(result['events_per_second'], 0)
+        self.assertLessEqual(result['p50_seconds'], result['p99_seconds'])
+        self.assertEqual(result['errors'], 0)
+
+    def test_run_benchmark_errors(self):
+        result = run_benchmark(5, cycles=4, max_workers=4, weather_latency=0, error_rate=0.9)
+        self.assertEqual(result['cycles'], 4)
+        self.assertGreater(result['errors'], 0)
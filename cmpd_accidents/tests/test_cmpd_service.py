@@ -1,5 +1,5 @@
 from unittest import TestCase
-from unittest.mock import patch
+from unittest.mock import patch, Mock, MagicMock
 import cmpd_accidents
 
 
@@ -45,3 +45,62 @@ class TestCMPDService(TestCase):
         mock_cmpd = cmpd_accidents.CMPDService(mock_db, mock_rest, weather)
         self.assertTrue(hasattr(mock_cmpd, "update_traffic_data"))
         mock_cmpd.update_traffic_data()
+
+    def test_cmpd_service_enrich_order(self):
+        """ Test concurrent enrichment keeps event order """
+        weather = Mock(spec=['get'])
+        weather.get.side_effect = lambda params: {'lat': params['lat']}
+        cmpd = cmpd_accidents.CMPDService(
+            Mock(), Mock(), weather, max_workers=4)
+        accidents = [{'EventNo': str(i), 'Latitude': i, 'Longitude': -i}
+                     for i in range(20)]
+        enriched = cmpd.enrich_accidents(accidents)
+        self.assertEqual([item['EventNo'] for item in enriched],
+                         [str(i) for i in range(20)])
+        self.assertEqual([item['weatherInfo']['lat'] for item in enriched],
+                         list(range(20)))
+        self.assertEqual(weather.get.call_count, 20)
+
+    def test_cmpd_service_unchanged_feed(self):
+        """ Test unchanged feed skips diff and enrichment """
+        db = MagicMock()
+        rest = Mock()
+        rest.get.return_value.status_code = 200
+        rest.get.return_value.content = b'[]'
+        rest.get.return_value.json.return_value = []
+        cmpd = cmpd_accidents.CMPDService(db, rest, Mock(spec=['get']))
+        self.assertEqual(cmpd.update_traffic_data(), 0)
+        self.assertEqual(cmpd.update_traffic_data(), 0)
+        self.assertEqual(rest.get.return_value.json.call_count, 1)
+        db.__enter__.return_value.find_ids.assert_not_called()  # empty feed, no query
+        rest.get.return_value.status_code = 304
+        self.assertEqual(cmpd.update_traffic_data(), 0)
+        self.assertEqual(rest.get.return_value.json.call_count, 1)
+
+    def test_cmpd_service_region_weather(self):
+        """ Test one weather lookup per division centroid """
+        weather = Mock(spec=['get'])
+        weather.get.side_effect = lambda params: dict(params)
+        cmpd = cmpd_accidents.CMPDService(
+            Mock(), Mock(), weather, max_workers=4, weather_region='division')
+        accidents = [{'EventNo': str(i), 'Division': 'D{0}'.format(i % 2),
+                      'Latitude': str(35 + i % 2), 'Longitude': str(-80 - i)}
+                     for i in range(6)]
+        enriched = cmpd.enrich_accidents(accidents)
+        self.assertEqual(weather.get.call_count, 2)
+        self.assertEqual(enriched[0]['weatherInfo'], {'lat': 35, 'lon': -82})
+        self.assertIs(enriched[0]['weatherInfo'], enriched[2]['weatherInfo'])
+        self.assertEqual(enriched[1]['weatherInfo']['lon'], -83)
+
+    def test_cmpd_service_region_weather_missing_coordinates(self):
+        """ Test accidents without coordinates fall back to their own lookup """
+        weather = Mock(spec=['get'])
+        weather.get.side_effect = lambda params: dict(params)
+        cmpd = cmpd_accidents.CMPDService(
+            Mock(), Mock(), weather, max_workers=4, weather_region='cell')
+        accidents = [{'EventNo': '1', 'Latitude': '35.2', 'Longitude': '-80.8'},
+                     {'EventNo': '2', 'Latitude': None, 'Longitude': '-80.8'},
+                     {'EventNo': '3', 'Latitude': '', 'Longitude': ''}]
+        enriched = cmpd.enrich_accidents(accidents)
+        self.assertEqual(weather.get.call_count, 3)
+        self.assertEqual(enriched[1]['weatherInfo'], {'lat': None, 'lon': '-80.8'})
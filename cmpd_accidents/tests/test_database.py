@@ -1,5 +1,8 @@
 from unittest import TestCase
-from unittest.mock import patch
+from unittest.mock import patch, Mock
+import os
+import tempfile
+from sqlalchemy import text
 import cmpd_accidents
 
 
@@ -49,3 +52,92 @@ class TestDatabase(TestCase):
         self.assertTrue(hasattr(mock_db, 'engine'))
         self.assertTrue(hasattr(mock_db, 'session'))
         mock_db.__exit__(None, None, None)
+
+    def test_mongo_shared_client(self):
+        first = cmpd_accidents.MongoDBConnect('mongodb://localhost/db')
+        second = cmpd_accidents.MongoDBConnect('mongodb://localhost/db')
+        with first, second:
+            self.assertIs(first.connection, second.connection)
+            self.assertEqual(first._collection('accidents').name, 'accidents')
+            self.assertIs(first.database, first._collection('x').database)
+        cmpd_accidents.close_mongo_clients()
+        with cmpd_accidents.MongoDBConnect('mongodb://localhost/db') as third:
+            self.assertIsNot(third.connection, first.connection)
+        cmpd_accidents.close_mongo_clients()
+
+    def test_mongo_upsert_bulk(self):
+        mock_db = cmpd_accidents.MongoDBConnect('mongodb://localhost/db')
+        collection = Mock()
+        collection.bulk_write.return_value.upserted_count = 2
+        collection.bulk_write.return_value.matched_count = 1
+        mock_db._collection = Mock(return_value=collection)
+        items = [{'EventNo': str(i)} for i in range(3)]
+        counts = mock_db.upsert_bulk(
+            collection='accidentsv2', items=items, batch_size=2)
+        self.assertEqual(collection.bulk_write.call_count, 2)
+        self.assertEqual(counts, {'inserted': 4, 'matched': 2})
+        requests, = collection.bulk_write.call_args_list[0][0]
+        self.assertEqual(len(requests), 2)
+        self.assertFalse(collection.bulk_write.call_args_list[0][1]['ordered'])
+        collection.create_index.assert_not_called()  # indexes are bootstrapped separately
+
+    def test_sqlite_find_ids_chunked(self):
+        path = os.path.join(tempfile.mkdtemp(), 'accidents.db')
+        connection_string = 'sqlite:///{0}'.format(path)
+        engine = cmpd_accidents.get_sql_engine(connection_string)
+        with engine.begin() as conn:
+            conn.execute(text(
+                'CREATE TABLE accidents (EventNo VARCHAR(150) PRIMARY KEY)'))
+        mock_db = cmpd_accidents.SQLAlchemyConnect(connection_string)
+        with mock_db as db:
+            self.assertIs(db.engine, engine)
+            db.insert_bulk(table='accidents',
+                           items=[{'EventNo': str(i)} for i in range(10)])
+            exist_ids = db.find_ids(table='accidents', ids=[str(i) for i in range(5, 15)],
+                                    cursor_limit=500, chunk_size=3)
+            self.assertEqual(sorted(exist_ids), [str(i) for i in range(5, 10)])
+            index = cmpd_accidents.SeenIndex()
+            index.rebuild(db, collection='accidents')
+            self.assertEqual(index.diff([str(i) for i in range(8, 12)]), {'10', '11'})
+            self.assertIs(db._table('accidents'), db._table('accidents'))
+        cmpd_accidents.close_sql_engines()
+
+    def test_sqlite_insert_flat(self):
+        path = os.path.join(tempfile.mkdtemp(), 'accidents.db')
+        connection_string = 'sqlite:///{0}'.format(path)
+        engine = cmpd_accidents.get_sql_engine(connection_string)
+        with engine.begin() as conn:
+            conn.execute(text('CREATE TABLE accidents_flat (EventNo VARCHAR(150) PRIMARY KEY, '
+                              'Latitude VARCHAR(150), weatherTemp DOUBLE, weather JSON)'))
+        mapping = {'weatherTemp': 'weatherInfo.main.temp',
+                   'weather': 'weatherInfo.weather'}
+        items = [{'EventNo': str(i), 'Latitude': '35.2', 'Unknown': 1,
+                  'weatherInfo': {'main': {'temp': 280.0 + i}, 'weather': [{'main': 'Rain'}]}}
+                 for i in range(5)]
+        items.append({'EventNo': '5', 'weatherInfo': {}})
+        with cmpd_accidents.SQLAlchemyConnect(connection_string) as db:
+            inserted = db.insert_flat(
+                table='accidents_flat', items=items, mapping=mapping, batch_size=2)
+            self.assertEqual(inserted, 6)
+            rows = db.get_all(table='accidents_flat')
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[1].weatherTemp, 281.0)
+        self.assertEqual(rows[0].weather, '[{"main": "Rain"}]')
+        self.assertIsNone(rows[5].weatherTemp)
+        # replayed batches only insert their new rows
+        with cmpd_accidents.SQLAlchemyConnect(connection_string) as db:
+            inserted = db.insert_flat(table='accidents_flat', items=items + [{'EventNo': '6'}],
+                                      mapping=mapping, batch_size=2)
+            self.assertEqual(inserted, 1)
+            self.assertEqual(len(db.get_all(table='accidents_flat')), 7)
+        cmpd_accidents.close_sql_engines()
+
+    def test_log_summary(self):
+        items = [{'EventNo': '3', 'weatherInfo': {'temp': 1}},
+                 {'EventNo': '1'}, {'EventNo': '2'}]
+        summary = cmpd_accidents.summarize_items(items)
+        self.assertIn('count: 3', summary)
+        self.assertIn('EventNo: 1..3', summary)
+        self.assertNotIn('weatherInfo', summary)
+        self.assertNotIn('bytes', summary)
+        self.assertIn('bytes: ', cmpd_accidents.summarize_items(items, size=True))
@@ -0,0 +1,79 @@
+from unittest import TestCase
+from unittest.mock import Mock
+import cmpd_accidents
+from cmpd_accidents.indexes import ensure_indexes, check_queries, backfill_locations, plan_stages
+from cmpd_accidents.indexes import find_duplicates
+
+
+class TestIndexes(TestCase):
+    """ Mongo index management tests """
+
+    def setUp(self):
+        self.collection = Mock()
+        self.db = Mock()
+        self.db._collection.return_value = self.collection
+
+    def test_event_location(self):
+        self.assertEqual(cmpd_accidents.event_location({'Latitude': '35.2', 'Longitude': -80.8}),
+                         {'type': 'Point', 'coordinates': [-80.8, 35.2]})
+        self.assertIsNone(cmpd_accidents.event_location({'Latitude': None, 'Longitude': -80.8}))
+        self.assertIsNone(cmpd_accidents.event_location({'Latitude': 135, 'Longitude': -80.8}))
+        item = {'EventNo': '1', 'Latitude': 35.2, 'Longitude': -80.8}
+        self.assertNotIn('location', item)
+        self.assertIn('location', cmpd_accidents.with_location(item))
+
+    def test_ensure_indexes(self):
+        self.collection.index_information.return_value = {
+            '_id_': {'key': [('_id', 1)]},
+            'EventNo_1': {'key': [('EventNo', 1)], 'unique': True}
+        }
+        self.collection.aggregate.return_value = []
+        self.collection.create_index.side_effect = [None, Exception('bad geometry')]
+        report = ensure_indexes(self.db, 'accidentsv2')
+        self.assertEqual([index['status'] for index in report], ['ok', 'created'])
+        self.collection.create_index.assert_any_call(
+            [('location', '2dsphere')], name='location_2dsphere', unique=False)
+        report = ensure_indexes(self.db, 'accidents')
+        self.assertEqual([(index['name'], index['status']) for index in report],
+                         [('datetime_add_1', 'failed')])
+        self.collection.aggregate.assert_not_called()  # no unique index on the legacy collection
+        report = ensure_indexes(self.db, 'accidentsv2', create=False)
+        self.assertEqual([index['status'] for index in report], ['ok', 'missing'])
+
+    def test_ensure_indexes_duplicates(self):
+        self.collection.index_information.return_value = {}
+        self.collection.aggregate.return_value = [{'_id': '1', 'ids': [3, 1], 'count': 2}]
+        self.assertEqual(find_duplicates(self.db, 'accidentsv2'), {'1': [1, 3]})
+        report = ensure_indexes(self.db, 'accidentsv2')
+        self.assertEqual(report[0], {'name': 'EventNo_1', 'status': 'duplicates', 'duplicates': 1})
+        self.assertEqual(self.collection.create_index.call_count, 1)
+        self.collection.aggregate.side_effect = [
+            [{'_id': '1', 'ids': [3, 1], 'count': 2}], []]
+        self.collection.create_index.reset_mock()
+        self.collection.delete_many.return_value.deleted_count = 1
+        report = ensure_indexes(self.db, 'accidentsv2', dedupe=True)
+        self.assertEqual(report[0]['status'], 'created')
+        self.collection.delete_many.assert_called_once_with({'_id': {'$in': [3]}})
+
+    def test_check_queries(self):
+        collscan = {'queryPlanner': {'winningPlan': {
+            'stage': 'LIMIT', 'inputStage': {'stage': 'SORT', 'inputStage': {'stage': 'COLLSCAN'}}}}}
+        ixscan = {'queryPlanner': {'winningPlan': {'queryPlan': {
+            'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN'}}}, 'rejectedPlans': [
+                {'stage': 'COLLSCAN'}]}}
+        self.assertEqual(plan_stages(collscan['queryPlanner']['winningPlan']),
+                         ['LIMIT', 'SORT', 'COLLSCAN'])
+        queries = {'slow': lambda c: Mock(explain=Mock(return_value=collscan)),
+                   'fast': lambda c: Mock(explain=Mock(return_value=ixscan))}
+        report = check_queries(self.db, 'accidentsv2', queries)
+        self.assertEqual({query['name']: query['collscan'] for query in report},
+                         {'slow': True, 'fast': False})
+
+    def test_backfill_locations(self):
+        self.collection.find.return_value = [
+            {'_id': 1, 'Latitude': 35.2, 'Longitude': -80.8},
+            {'_id': 2, 'Latitude': '', 'Longitude': ''},
+            {'_id': 3, 'Latitude': 35.1, 'Longitude': -80.7}]
+        self.collection.bulk_write.return_value.modified_count = 1
+        self.assertEqual(backfill_locations(self.db, 'accidentsv2', batch_size=1), 2)
+        self.assertEqual(self.collection.bulk_write.call_count, 2)
@@ -0,0 +1,45 @@
+from unittest import TestCase
+from unittest.mock import patch
+import os
+import shutil
+import logging
+import tempfile
+import importlib
+import cmpd_accidents
+
+logger_module = importlib.import_module('cmpd_accidents.logger')
+
+
+class TestLogger(TestCase):
+    """ Queue logging tests """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def read(self, name):
+        with open(os.path.join(self.path, '{0}.log'.format(name))) as f:
+            return f.read()
+
+    def test_queue_logger(self):
+        logger = cmpd_accidents.Logger(self.path, 'QueueTest', maxbytes=1024, use_queue=True).get()
+        self.assertIsInstance(logger.handlers[0], logging.handlers.QueueHandler)
+        logger.info('queued record')
+        cmpd_accidents.stop_log_listeners()  # flushes the queue to the file handler
+        self.assertIn('queued record', self.read('QueueTest'))
+
+    def test_enable_queue_mode(self):
+        with patch.object(logger_module, '_file_loggers', []), \
+                patch.object(cmpd_accidents.Logger, 'queue_mode', False):
+            # ie, a module level logger created at import time, before the CLI runs
+            logger = cmpd_accidents.Logger(self.path, 'EarlyTest', maxbytes=1024).get()
+            self.assertIsInstance(logger.handlers[0], logging.handlers.RotatingFileHandler)
+            cmpd_accidents.enable_queue_mode()
+            self.assertTrue(cmpd_accidents.Logger.queue_mode)
+            self.assertEqual(len(logger.handlers), 1)
+            self.assertIsInstance(logger.handlers[0], logging.handlers.QueueHandler)
+            logger.info('switched record')
+            cmpd_accidents.stop_log_listeners()
+        self.assertIn('switched record', self.read('EarlyTest'))
@@ -0,0 +1,31 @@
+from unittest import TestCase
+from unittest.mock import Mock
+import threading
+import cmpd_accidents
+
+
+class TestMain(TestCase):
+    """ Command line/daemon tests """
+
+    def test_next_interval(self):
+        self.assertEqual(cmpd_accidents.next_interval(300, 5, 60, 900), 150)
+        self.assertEqual(cmpd_accidents.next_interval(100, 5, 60, 900), 60)
+        self.assertEqual(cmpd_accidents.next_interval(300, 0, 60, 900), 450)
+        self.assertEqual(cmpd_accidents.next_interval(800, 0, 60, 900), 900)
+
+    def test_run_daemon_stops(self):
+        stop_event = threading.Event()
+        cmpd = Mock()
+        results = [3, Exception('feed down'), 0]
+
+        def update():
+            result = results.pop(0)
+            if not results:
+                stop_event.set()
+            if isinstance(result, Exception):
+                raise result
+            return result
+        cmpd.update_traffic_data.side_effect = update
+        cycles = cmpd_accidents.run_daemon(
+            cmpd, interval=0, min_interval=0, max_interval=0, stop_event=stop_event)
+        self.assertEqual(cycles, 3)
@@ -0,0 +1,67 @@
+from unittest import TestCase
+from unittest.mock import MagicMock, Mock
+import urllib.request
+import cmpd_accidents
+
+
+class TestMetrics(TestCase):
+    """ Ingestion metrics tests """
+
+    def test_metrics_prometheus(self):
+        metrics = cmpd_accidents.Metrics(buckets=(0.1, 1.0))
+        metrics.inc('events_new_total', 3)
+        metrics.set_gauge('rate_limit_utilization', 0.5)
+        metrics.observe('stage_seconds', 0.05, stage='fetch')
+        metrics.observe('stage_seconds', 5, stage='fetch')
+        text = metrics.to_prometheus()
+        self.assertIn('cmpd_events_new_total 3', text)
+        self.assertIn('cmpd_rate_limit_utilization 0.5', text)
+        self.assertIn('cmpd_stage_seconds_bucket{stage="fetch",le="0.1"} 1', text)
+        self.assertIn('cmpd_stage_seconds_bucket{stage="fetch",le="+Inf"} 2', text)
+        self.assertIn('cmpd_stage_seconds_count{stage="fetch"} 2', text)
+
+    def test_metrics_serve(self):
+        metrics = cmpd_accidents.Metrics()
+        metrics.inc('cycles_total')
+        server = metrics.serve(0, host='127.0.0.1')
+        try:
+            url = 'http://127.0.0.1:{0}/metrics'.format(server.server_port)
+            body = urllib.request.urlopen(url).read().decode('utf-8')
+            self.assertIn('cmpd_cycles_total 1', body)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_cmpd_cycle_summary(self):
+        db = MagicMock()
+        db.__enter__.return_value = db
+        db.find_ids.return_value = ['1']
+        db.upsert_bulk.return_value = {'inserted': 1, 'matched': 0}
+        rest = Mock()
+        rest.get.return_value.status_code = 200
+        rest.get.return_value.content = b'feed'
+        rest.get.return_value.json.return_value = [
+            {'EventNo': '1'}, {'EventNo': '2'}]
+        weather = Mock(spec=['get'])
+        weather.get.return_value = {}
+        before = cmpd_accidents.METRICS.counter('events_inserted_total')
+        cmpd = cmpd_accidents.CMPDService(db, rest, weather)
+        self.assertEqual(cmpd.update_traffic_data(), 1)
+        self.assertEqual(cmpd.cycle_stats['fetched'], 2)
+        self.assertEqual(cmpd.cycle_stats['new'], 1)
+        self.assertEqual(cmpd.cycle_stats['inserted'], 1)
+        self.assertEqual(set(cmpd.cycle_stats['stages']),
+                         {'fetch', 'find_ids', 'enrich', 'insert'})
+        self.assertEqual(cmpd_accidents.METRICS.counter(
+            'events_inserted_total'), before + 1)
+
+    def test_cmpd_cycle_summary_fetch_error(self):
+        rest = Mock()
+        rest.get.side_effect = IOError('feed down')
+        before = cmpd_accidents.METRICS.counter('cycles_total', status='error')
+        cmpd = cmpd_accidents.CMPDService(MagicMock(), rest, Mock(spec=['get']))
+        with self.assertRaises(IOError):
+            cmpd.update_traffic_data()
+        self.assertEqual(cmpd_accidents.METRICS.counter(
+            'cycles_total', status='error'), before + 1)
+        self.assertIn('fetch', cmpd.cycle_stats['stages'])
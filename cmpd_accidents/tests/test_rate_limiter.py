@@ -0,0 +1,95 @@
+from unittest import TestCase
+from unittest.mock import Mock
+import os
+import time
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import cmpd_accidents
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """ Answers 503 to the first two requests, then 200 """
+    requests = 0
+
+    def do_GET(self):
+        FlakyHandler.requests += 1
+        status = 503 if FlakyHandler.requests <= 2 else 200
+        content = b'{"temp": 1}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestRateLimiter(TestCase):
+    """ Quota rate limiter tests """
+
+    def test_rate_limiter_quota(self):
+        limiter = cmpd_accidents.RateLimiter(quota=5, per=0.5)
+        start = time.perf_counter()
+        # exactly the quota is allowed per window, back to back
+        self.assertEqual([limiter.try_acquire() for _ in range(5)], [0] * 5)
+        wait = limiter.try_acquire()
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 0.5)
+        self.assertEqual(limiter.utilization(), 1.0)
+        self.assertFalse(limiter.acquire(tokens=1, timeout=0.001))
+        # the next window allows the full quota again
+        self.assertTrue(limiter.acquire())
+        self.assertGreaterEqual(time.perf_counter() - start, 0.45)
+        self.assertEqual([limiter.try_acquire() for _ in range(4)], [0] * 4)
+        self.assertGreater(limiter.try_acquire(), 0)
+
+    def test_rate_limiter_shared_file(self):
+        path = tempfile.mkdtemp()
+        try:
+            state = os.path.join(path, 'quota.json')
+            first = cmpd_accidents.RateLimiter(quota=3, per=60.0, path=state)
+            second = cmpd_accidents.RateLimiter(quota=3, per=60.0, path=state)
+            self.assertEqual(first.try_acquire(), 0)
+            self.assertEqual(second.try_acquire(), 0)
+            self.assertEqual(first.try_acquire(), 0)
+            # the window is shared, so the other process is held back
+            self.assertGreater(second.try_acquire(), 0)
+            self.assertEqual(first.utilization(), second.utilization())
+        finally:
+            shutil.rmtree(path)
+
+    def test_weather_service_rate_limited(self):
+        limiter = Mock()
+        weather = cmpd_accidents.WeatherService(
+            'http://127.0.0.1', 'key', cache=cmpd_accidents.WeatherCache(), rate_limiter=limiter)
+        weather.rest_service = Mock()
+        weather.rest_service.get.return_value.json.return_value = {'temp': 1}
+        weather.get(params={'lat': 35.2, 'lon': -80.8})
+        weather.get(params={'lat': 35.2, 'lon': -80.8})
+        # cache hits do not use the quota
+        limiter.acquire.assert_called_once_with()
+
+    def test_too_many_requests(self):
+        with self.assertRaisesRegex(Exception, 'Too Many Requests'):
+            cmpd_accidents.check_status(Mock(), 'http://127.0.0.1', 'GET', 429)
+
+    def test_weather_service_retries_rate_limited(self):
+        FlakyHandler.requests = 0
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            url = 'http://127.0.0.1:{0}/'.format(server.server_port)
+            limiter = Mock()
+            weather = cmpd_accidents.WeatherService(
+                url, 'key', rate_limiter=limiter,
+                rest_service=cmpd_accidents.RestService(url, backoff_factor=0.01, rate_limiter=limiter))
+            self.assertEqual(weather.get(params={'lat': 35.2, 'lon': -80.8}), {'temp': 1})
+            # the first attempt and both retries take a token
+            self.assertEqual(FlakyHandler.requests, 3)
+            self.assertEqual(limiter.acquire.call_count, 3)
+        finally:
+            server.shutdown()
+            server.server_close()
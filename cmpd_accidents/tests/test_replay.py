@@ -0,0 +1,51 @@
+from unittest import TestCase
+import os
+import gzip
+import json
+import shutil
+import tempfile
+from cmpd_accidents.benchmark import MemoryStore
+from cmpd_accidents.replay import ReplayEngine, iter_snapshot
+
+
+class TestReplay(TestCase):
+    """ Snapshot replay tests """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.first = os.path.join(self.path, 'first.jsonl')
+        with open(self.first, 'w') as f:
+            f.write(json.dumps([{'EventNo': '1'}, {'EventNo': '2', 'weatherInfo': {'temp': 5}}]) + '\n')
+            f.write('\n')
+            f.write(json.dumps({'EventNo': '3'}) + '\n')
+        self.second = os.path.join(self.path, 'second.jsonl.gz')
+        with gzip.open(self.second, 'wt') as f:
+            f.write(json.dumps([{'EventNo': '3'}, {'EventNo': '4'}, {'EventNo': '4'}]) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_iter_snapshot(self):
+        lines = list(iter_snapshot(self.first))
+        self.assertEqual([line_no for line_no, _ in lines], [1, 2, 3])
+        self.assertEqual(lines[2][1], [{'EventNo': '3'}])
+        self.assertEqual(list(iter_snapshot(self.first, start_line=2))[0][0], 3)
+
+    def test_replay(self):
+        store = MemoryStore()
+        checkpoint = os.path.join(self.path, 'checkpoint.json')
+        engine = ReplayEngine(store, checkpoint_path=checkpoint, batch_size=2, writers=2)
+        report = engine.replay([self.first, self.second])
+        self.assertEqual(report['events'], 6)
+        self.assertEqual(report['inserted'], 4)
+        self.assertEqual(report['duplicates'], 2)
+        # archived weather is kept, current weather is never attached to old events
+        self.assertEqual(report['unenriched'], 3)
+        self.assertEqual(store.collections['accidentsv2']['2']['weatherInfo'], {'temp': 5})
+        self.assertNotIn('weatherInfo', store.collections['accidentsv2']['4'])
+        with open(checkpoint) as f:
+            self.assertEqual(json.load(f), {os.path.abspath(self.first): 3,
+                                            os.path.abspath(self.second): 1})
+        # resuming skips replayed lines
+        resumed = ReplayEngine(MemoryStore(), checkpoint_path=checkpoint)
+        self.assertEqual(resumed.replay([self.first, self.second])['events'], 0)
@@ -1,5 +1,7 @@
 from unittest import TestCase
 from unittest.mock import patch, Mock
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
 import requests
 import cmpd_accidents
 
@@ -28,3 +30,44 @@ class TestRestService(TestCase):
         inst = mock_rest.__enter__()
         self.assertTrue(type(inst) == type(mock_rest))
         mock_rest.__exit__(None, None, None)
+
+    def test_rest_conditional_get(self):
+        mock_rest = cmpd_accidents.RestService('https://www.google.com')
+        mock_rest.session = Mock()
+        response = Mock(status_code=200, headers={'ETag': '"abc"'})
+        mock_rest.session.request.return_value = response
+        mock_rest.get(params={}, conditional=True)
+        response.status_code = 304
+        result = mock_rest.get(params={}, conditional=True)
+        self.assertEqual(result.status_code, 304)
+        headers = mock_rest.session.request.call_args[1]['headers']
+        self.assertEqual(headers, {'If-None-Match': '"abc"'})
+        mock_rest.clear_validators()
+        mock_rest.get(params={}, conditional=True)
+        self.assertEqual(mock_rest.session.request.call_args[1]['headers'], {})
+
+    def test_rest_retry_budget(self):
+        statuses = [503, 200]
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(statuses.pop(0) if statuses else 200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            mock_rest = cmpd_accidents.RestService(
+                'http://127.0.0.1:{0}/'.format(server.server_port), backoff_factor=0)
+            result = mock_rest.get(params={})
+            self.assertEqual(result.status_code, 200)
+            stats = mock_rest.get_stats()
+            self.assertEqual(stats['requests'], 1)
+            self.assertEqual(stats['attempts'], 2)
+        finally:
+            server.shutdown()
+            server.server_close()
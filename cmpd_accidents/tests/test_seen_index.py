@@ -0,0 +1,70 @@
+from unittest import TestCase
+from unittest.mock import Mock
+import threading
+import cmpd_accidents
+
+
+class FakeFeed(object):
+    """ Feed returning the same events with changed content on every poll """
+
+    def __init__(self, events):
+        self.events = events
+        self.polls = 0
+
+    def get(self, params, conditional=False):
+        self.polls += 1
+        return Mock(status_code=200, content=str(self.polls).encode(),
+                    json=Mock(return_value=self.events))
+
+    def clear_validators(self):
+        pass
+
+
+class TestSeenIndex(TestCase):
+    """ Seen event index tests """
+
+    def test_seen_index_exact(self):
+        db = Mock()
+        db.all_ids.return_value = ['1', '2']
+        index = cmpd_accidents.SeenIndex()
+        index.rebuild(db, collection='accidentsv2')
+        self.assertTrue(index.loaded)
+        self.assertEqual(index.diff(['1', '2', '3']), {'3'})
+        index.add(['3'])
+        self.assertIn('3', index)
+        self.assertEqual(len(index), 3)
+
+    def test_seen_index_bloom(self):
+        index = cmpd_accidents.SeenIndex(error_rate=0.001, capacity=1000)
+        index.add(str(i) for i in range(1000))
+        self.assertEqual(index.diff(str(i) for i in range(1000)), set())
+        false_positives = len(
+            [i for i in range(1000, 11000) if str(i) in index])
+        self.assertLess(false_positives, 50)
+
+    def test_cmpd_service_uses_seen_index(self):
+        db = Mock()
+        db.__enter__ = Mock(return_value=db)
+        db.__exit__ = Mock(return_value=None)
+        db.all_ids.return_value = ['1']
+        rest = FakeFeed([{'EventNo': '1'}, {'EventNo': '2'}, {'EventNo': '2'}])
+        weather = Mock(spec=['get'])
+        weather.get.return_value = {}
+        cmpd = cmpd_accidents.CMPDService(
+            db, rest, weather, seen_index=cmpd_accidents.SeenIndex())
+        self.assertEqual(cmpd.update_traffic_data(), 1)
+        self.assertEqual(cmpd.update_traffic_data(), 0)
+        db.find_ids.assert_not_called()
+        self.assertEqual(db.all_ids.call_count, 1)
+
+    def test_bloom_filter_concurrent_add(self):
+        index = cmpd_accidents.SeenIndex(error_rate=0.001, capacity=20000)
+        threads = [threading.Thread(target=index.add, args=(
+            ['{0}-{1}'.format(t, i) for i in range(5000)],)) for t in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(index), 20000)
+        self.assertEqual(index.diff('{0}-{1}'.format(t, i) for t in range(4) for i in range(5000)),
+                         set())
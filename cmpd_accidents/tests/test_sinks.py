@@ -0,0 +1,118 @@
+from unittest import TestCase
+from unittest.mock import MagicMock, Mock
+import os
+import json
+import time
+import shutil
+import tempfile
+import cmpd_accidents
+
+
+class TestSinks(TestCase):
+    """ Persistence sink tests """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_fan_out_concurrent(self):
+        def slow_write(items):
+            time.sleep(0.2)
+            return {'inserted': len(items), 'matched': 0}
+        sinks = [Mock(write=Mock(side_effect=slow_write)) for _ in range(3)]
+        for i, sink in enumerate(sinks):
+            sink.name = 'sink{0}'.format(i)
+        with cmpd_accidents.FanOut(sinks) as fan_out:
+            start = time.perf_counter()
+            results = fan_out.write([{'EventNo': '1'}])
+            self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertEqual(results['sink2'], {'inserted': 1, 'matched': 0})
+
+    def test_fan_out_failure_isolation(self):
+        mongo = MagicMock()
+        mongo.__enter__.return_value = mongo
+        mongo.upsert_bulk.return_value = {'inserted': 2, 'matched': 0}
+        sql = MagicMock()
+        sql.__enter__.return_value = sql
+        sql.insert_flat.side_effect = Exception('MySQL unavailable')
+        file_path = os.path.join(self.path, 'events.jsonl')
+        items = [{'EventNo': '1'}, {'EventNo': '2'}]
+        fan_out = cmpd_accidents.FanOut([cmpd_accidents.MongoSink(mongo), cmpd_accidents.SQLSink(sql),
+                                         cmpd_accidents.FileSink(file_path, batch_size=1)])
+        # any sink failing fails the write, the other sinks still get the batch
+        with self.assertRaises(Exception):
+            fan_out.write(items)
+        self.assertIsNone(fan_out.last_results['sql'])
+        self.assertEqual(fan_out.last_results['file'], {'inserted': 2, 'matched': 0})
+        # writing the batch again only retries the failed sink
+        sql.insert_flat.side_effect = None
+        sql.insert_flat.return_value = 2
+        results = fan_out.write(items)
+        self.assertEqual(results['sql'], {'inserted': 2, 'matched': 0})
+        self.assertEqual(mongo.upsert_bulk.call_count, 1)
+        with open(file_path) as f:
+            self.assertEqual([json.loads(line) for line in f], items)
+        # a grown batch only writes the new event
+        fan_out.write(items + [{'EventNo': '3'}])
+        self.assertEqual(sql.insert_flat.call_args[1]['items'], [{'EventNo': '3'}])
+        with open(file_path) as f:
+            self.assertEqual([json.loads(line)['EventNo'] for line in f], ['1', '2', '3'])
+        fan_out.close()
+        # best effort sinks only log failures
+        sql.insert_flat.side_effect = Exception('MySQL unavailable')
+        fan_out = cmpd_accidents.FanOut([cmpd_accidents.MongoSink(mongo), cmpd_accidents.SQLSink(sql)],
+                                        required=['mongo'])
+        self.assertIsNone(fan_out.write(items)['sql'])
+        mongo.upsert_bulk.side_effect = Exception('Mongo unavailable')
+        with self.assertRaises(Exception):
+            fan_out.write([{'EventNo': '4'}])
+        fan_out.close()
+
+    def test_cmpd_service_sinks(self):
+        db = MagicMock()
+        db.__enter__.return_value = db
+        db.find_ids.return_value = []
+        rest = Mock()
+        rest.get.return_value.status_code = 200
+        rest.get.return_value.content = b'feed'
+        rest.get.return_value.json.return_value = [{'EventNo': '1'}]
+        weather = Mock(spec=['get'])
+        weather.get.return_value = {}
+        extra = Mock(write=Mock(return_value={'inserted': 1, 'matched': 0}))
+        extra.name = 'extra'
+        db.upsert_bulk.return_value = {'inserted': 1, 'matched': 0}
+        cmpd = cmpd_accidents.CMPDService(db, rest, weather,
+                                          sinks=[cmpd_accidents.MongoSink(db), extra])
+        self.assertEqual(cmpd.update_traffic_data(), 1)
+        db.upsert_bulk.assert_called_once()
+        extra.write.assert_called_once_with([{'EventNo': '1', 'weatherInfo': {}}])
+        self.assertEqual(weather.get.call_count, 1)
+        cmpd.sinks.close()
+
+    def test_cmpd_service_redelivers_failed_sink(self):
+        db = MagicMock()
+        db.__enter__.return_value = db
+        db.find_ids.side_effect = [[], ['1']]  # mongo has the event after the first cycle
+        db.upsert_bulk.return_value = {'inserted': 1, 'matched': 0}
+        rest = Mock()
+        rest.get.return_value.status_code = 200
+        rest.get.return_value.json.return_value = [{'EventNo': '1'}]
+        weather = Mock(spec=['get'])
+        weather.get.return_value = {}
+        sql = Mock(write=Mock(side_effect=[Exception('sql down'), {'inserted': 1, 'matched': 0}]))
+        sql.name = 'sql'
+        cmpd = cmpd_accidents.CMPDService(db, rest, weather,
+                                          sinks=[cmpd_accidents.MongoSink(db), sql])
+        rest.get.return_value.content = b'feed1'
+        with self.assertRaises(Exception):
+            cmpd.update_traffic_data()
+        self.assertEqual(cmpd.sinks.undelivered(), {'mongo': 0, 'sql': 1})
+        rest.get.return_value.content = b'feed2'
+        self.assertEqual(cmpd.update_traffic_data(), 0)
+        self.assertEqual(sql.write.call_count, 2)
+        sql.write.assert_called_with([{'EventNo': '1', 'weatherInfo': {}}])
+        db.upsert_bulk.assert_called_once()
+        self.assertEqual(cmpd.sinks.undelivered(), {'mongo': 0, 'sql': 0})
+        cmpd.sinks.close()
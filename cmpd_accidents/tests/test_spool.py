@@ -0,0 +1,87 @@
+from unittest import TestCase
+from unittest.mock import MagicMock, Mock
+import os
+import shutil
+import tempfile
+import cmpd_accidents
+
+
+class TestSpool(TestCase):
+    """ Durable spool tests """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_spool_ack_and_compact(self):
+        spool = cmpd_accidents.Spool(self.path, segment_bytes=64, fsync=False)
+        spool.append([{'EventNo': str(i), 'weatherInfo': {'temp': i}} for i in range(10)])
+        spool.append([{'EventNo': '10'}])
+        self.assertEqual(spool.pending(), 11)
+        self.assertGreater(len(spool.segments()), 1)
+        items, position = spool.read_batch(4)
+        self.assertEqual([item['EventNo'] for item in items], ['0', '1', '2', '3'])
+        spool.ack(position, items)
+        self.assertEqual(spool.pending(), 7)
+        self.assertNotIn('0', spool.pending_ids())
+        items, position = spool.read_batch(100)
+        self.assertEqual(len(items), 7)
+        spool.ack(position, items)
+        spool.compact()
+        self.assertEqual(spool.segments(), [spool.active])
+        self.assertEqual(spool.read_batch(100)[0], [])
+        spool.close()
+
+    def test_spool_recovery(self):
+        spool = cmpd_accidents.Spool(self.path, fsync=False)
+        spool.append([{'EventNo': '1'}, {'EventNo': '2'}])
+        items, position = spool.read_batch(1)
+        spool.ack(position, items)
+        spool.close()
+        # torn write from a crash mid-append
+        with open(os.path.join(self.path, spool.segment_format.format(spool.active)), 'ab') as f:
+            f.write(b'{"EventNo": "3"')
+        spool = cmpd_accidents.Spool(self.path, fsync=False)
+        self.assertEqual(spool.pending_ids(), {'2'})
+        spool.append([{'EventNo': '4'}])
+        self.assertEqual([item['EventNo'] for item in spool.read_batch()[0]], ['2', '4'])
+        spool.close()
+
+    def test_spool_flusher(self):
+        spool = cmpd_accidents.Spool(self.path, fsync=False)
+        spool.append([{'EventNo': str(i)} for i in range(5)])
+        db = MagicMock()
+        db.__enter__.return_value = db
+        db.upsert_bulk.side_effect = [Exception('Mongo unavailable'), {'inserted': 3, 'matched': 0},
+                                      {'inserted': 2, 'matched': 0}]
+        flusher = cmpd_accidents.SpoolFlusher(spool, db, batch_size=3)
+        with self.assertRaises(Exception):
+            flusher.flush()
+        self.assertEqual(spool.pending(), 5)
+        self.assertEqual(flusher.flush(), 5)
+        self.assertEqual(spool.pending(), 0)
+        self.assertEqual(len(db.upsert_bulk.call_args_list[2][1]['items']), 2)
+        spool.close()
+
+    def test_cmpd_service_spool(self):
+        spool = cmpd_accidents.Spool(self.path, fsync=False)
+        db = MagicMock()
+        db.__enter__.return_value = db
+        db.find_ids.return_value = []
+        rest = Mock()
+        rest.get.return_value.status_code = 200
+        rest.get.return_value.json.return_value = [{'EventNo': '1'}, {'EventNo': '2'}]
+        rest.get.side_effect = lambda params, conditional: setattr(
+            rest.get.return_value, 'content', str(rest.get.call_count).encode()) or rest.get.return_value
+        weather = Mock(spec=['get'])
+        weather.get.return_value = {'temp': 1}
+        cmpd = cmpd_accidents.CMPDService(db, rest, weather, spool=spool)
+        self.assertEqual(cmpd.update_traffic_data(), 2)
+        db.upsert_bulk.assert_not_called()
+        # spooled events are not enriched again before they are flushed
+        self.assertEqual(cmpd.update_traffic_data(), 0)
+        self.assertEqual(weather.get.call_count, 2)
+        self.assertEqual(cmpd_accidents.SpoolFlusher(spool, db).flush(), 2)
+        spool.close()
@@ -0,0 +1,78 @@
+from unittest import TestCase
+from unittest.mock import Mock
+import os
+import time
+import shelve
+import tempfile
+import cmpd_accidents
+
+
+class TestWeatherCache(TestCase):
+    """ Weather cache tests """
+
+    def test_cache_grid_and_bucket(self):
+        cache = cmpd_accidents.WeatherCache(precision=2, bucket_seconds=600)
+        cache.set(35.2271, -80.8431, {'temp': 1}, now=1200)
+        self.assertEqual(cache.get(35.2269, -80.8429, now=1300), {'temp': 1})
+        self.assertIsNone(cache.get(35.2571, -80.8431, now=1300))
+        self.assertIsNone(cache.get(35.2271, -80.8431, now=1800))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 2)
+
+    def test_cache_ttl_and_lru(self):
+        cache = cmpd_accidents.WeatherCache(
+            bucket_seconds=3600, ttl=60, max_size=2)
+        cache.set(35.1, -80.1, 'a', now=0)
+        cache.set(35.2, -80.2, 'b', now=0)
+        cache.get(35.1, -80.1, now=1)
+        cache.set(35.3, -80.3, 'c', now=1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertIsNone(cache.get(35.2, -80.2, now=2))
+        self.assertEqual(cache.get(35.1, -80.1, now=2), 'a')
+        self.assertIsNone(cache.get(35.1, -80.1, now=61))
+
+    def test_cache_persistent_tier(self):
+        path = os.path.join(tempfile.mkdtemp(), 'weather')
+        now = time.time()
+        with cmpd_accidents.WeatherCache(path=path) as cache:
+            cache.set(35.1, -80.1, {'temp': 2}, now=now)
+        with cmpd_accidents.WeatherCache(path=path) as cache:
+            self.assertEqual(cache.get(35.1, -80.1, now=now + 10), {'temp': 2})
+            self.assertEqual(cache.stats()['disk_hits'], 1)
+
+    def test_cache_persistent_tier_purge(self):
+        path = os.path.join(tempfile.mkdtemp(), 'weather')
+        now = time.time()
+        with cmpd_accidents.WeatherCache(path=path, bucket_seconds=10 ** 9, ttl=60, max_size=2) as cache:
+            cache.set(35.1, -80.1, 'expired', now=now - 120)
+            cache.set(35.2, -80.2, 'a', now=now - 3)
+            cache.set(35.3, -80.3, 'b', now=now - 2)
+        with cmpd_accidents.WeatherCache(path=path, bucket_seconds=10 ** 9, ttl=60, max_size=2) as cache:
+            self.assertEqual(cache.get(35.2, -80.2, now=now - 1), 'a')  # disk hit, refreshes 'a'
+            cache.set(35.4, -80.4, 'c', now=now - 1)
+        with shelve.open(path) as disk:
+            self.assertEqual(sorted(entry[1] for entry in disk.values()), ['a', 'c'])
+
+    def test_cache_persistent_tier_capped_while_open(self):
+        path = os.path.join(tempfile.mkdtemp(), 'weather')
+        now = time.time()
+        with cmpd_accidents.WeatherCache(path=path, ttl=60, max_size=3) as cache:
+            cache.set(35.0, -80.0, 'expired', now=now - 120)
+            for i in range(1, 6):
+                cache.set(35.0 + i / 10.0, -80.0, i, now=now)
+            # still open, the tier never grows past max_size and drops expired entries
+            self.assertEqual(sorted(entry[1] for entry in cache._disk.values()), [3, 4, 5])
+            self.assertEqual(cache.stats()['evictions'], 6)
+
+    def test_weather_service_uses_cache(self):
+        weather = cmpd_accidents.WeatherService(
+            endpoint='http://samples.openweathermap.org/data/2.5/weather',
+            apiKey='b6907d289e10d714a6e88b30761fae22',
+            cache=cmpd_accidents.WeatherCache()
+        )  # fake API key via OpenWeatherAPI
+        weather.rest_service = Mock()
+        weather.rest_service.get.return_value.json.return_value = {'temp': 3}
+        weather.get(params={'lat': 35.2271, 'lon': -80.8431})
+        result = weather.get(params={'lat': 35.2272, 'lon': -80.8432})
+        self.assertEqual(result, {'temp': 3})
+        self.assertEqual(weather.rest_service.get.call_count, 1)
@@ -1,5 +1,8 @@
 from unittest import TestCase
 from unittest.mock import patch
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import cmpd_accidents
 
 
@@ -32,3 +35,21 @@ class TestWeatherService(TestCase):
         )  # fake API key via OpenWeatherAPI
         results = mock_weather.get(params={'lat': 35, 'lon': 139})
         self.assertTrue(results is not None)
+
+    def test_single_flight(self):
+        calls = []
+        started = threading.Event()
+
+        def slow():
+            calls.append(1)
+            started.wait(1)
+            return len(calls)
+        flight = cmpd_accidents.SingleFlight()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(flight.do, 'key', slow)
+                       for _ in range(4)]
+            time.sleep(0.1)
+            started.set()
+            results = [future.result() for future in futures]
+        self.assertEqual(results, [1, 1, 1, 1])
+        self.assertEqual(flight.do('key', slow), 2)  # not memoized
@@ -0,0 +1,192 @@
+"""
+Module for caching OpenWeatherAPI responses
+Entries are keyed on a quantized lat/lon grid cell plus a time bucket so
+accidents close together in space and time share a single weather lookup
+"""
+import time
+import shelve
+import threading
+from collections import OrderedDict
+
+
+class WeatherCache(object):
+    """
+    Spatio-temporal LRU cache for weather responses
+    Args:
+        precision: decimal places to round lat/lon to, ie, 2 is roughly a 1km cell
+        bucket_seconds: size of the time bucket in seconds
+        ttl: seconds before a cached entry expires
+        max_size: max entries held in memory, and on disk, before LRU eviction
+        path: optional file path for a persistent on-disk tier (shelve), expired and
+            least recently used entries over max_size are purged on open, write and close
+    """
+
+    def __init__(self, precision=2, bucket_seconds=600, ttl=900, max_size=1024, path=None):
+        self.precision = precision
+        self.bucket_seconds = bucket_seconds
+        self.ttl = ttl
+        self.max_size = max_size
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        self._disk_index = OrderedDict()  # disk key to expiry, least recently used first
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def key(self, lat, lon, now=None):
+        """
+        Cache key for a coordinate at a point in time
+        Args:
+            lat: latitude
+            lon: longitude
+            now: epoch seconds, defaults to current time
+        """
+        now = time.time() if now is None else now
+        return '{0:.{p}f}:{1:.{p}f}:{2}'.format(
+            float(lat), float(lon), int(now // self.bucket_seconds), p=self.precision)
+
+    def _open_disk(self):
+        if self.path and self._disk is None:
+            self._disk = shelve.open(self.path)
+            self._purge_disk()
+        return self._disk
+
+    def _purge_disk(self, now=None):
+        """
+        Drop expired entries from the persistent tier, then the least recently used over max_size
+        Rebuilds the recency index of the tier
+        Args:
+            now: epoch seconds, defaults to current time
+        Returns the number of entries removed
+        """
+        now = time.time() if now is None else now
+        used = {}
+        expires = {}
+        removed = 0
+        for key in list(self._disk.keys()):
+            entry = self._disk[key]
+            if entry[0] <= now:
+                del self._disk[key]
+                removed += 1
+            else:
+                used[key] = entry[2] if len(entry) > 2 else entry[0] - self.ttl
+                expires[key] = entry[0]
+        ordered = sorted(used, key=used.get)
+        excess = max(0, len(ordered) - self.max_size)
+        for key in ordered[:excess]:
+            del self._disk[key]
+            removed += 1
+        self._disk_index = OrderedDict((key, expires[key]) for key in ordered[excess:])
+        self.evictions += removed
+        return removed
+
+    def _write_disk(self, key, entry, now):
+        """
+        Write an entry to the persistent tier as most recently used, then drop
+        least recently used entries that are expired or over max_size
+        Args:
+            key: the cache key
+            entry: tuple of expiry and value
+            now: epoch seconds of the write
+        """
+        self._disk[key] = (entry[0], entry[1], now)
+        self._disk_index[key] = entry[0]
+        self._disk_index.move_to_end(key)
+        while self._disk_index:
+            oldest, expires = next(iter(self._disk_index.items()))
+            if len(self._disk_index) <= self.max_size and expires > now:
+                break
+            del self._disk_index[oldest]
+            del self._disk[oldest]
+            self.evictions += 1
+
+    def get(self, lat, lon, now=None):
+        """
+        Get cached weather for a coordinate
+        Args:
+            lat: latitude
+            lon: longitude
+            now: epoch seconds, defaults to current time
+        Returns cached weather details or None on a miss
+        """
+        now = time.time() if now is None else now
+        key = self.key(lat, lon, now)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            disk = self._open_disk()
+            if disk is not None and key in disk:
+                entry = disk[key]
+                if entry[0] > now:
+                    self._put(key, entry[:2])
+                    self._write_disk(key, entry, now)  # last used, for disk LRU
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return entry[1]
+                del disk[key]
+                self._disk_index.pop(key, None)
+            self.misses += 1
+            return None
+
+    def set(self, lat, lon, value, now=None):
+        """
+        Cache weather for a coordinate
+        Args:
+            lat: latitude
+            lon: longitude
+            value: weather details to cache
+            now: epoch seconds, defaults to current time
+        """
+        now = time.time() if now is None else now
+        key = self.key(lat, lon, now)
+        entry = (now + self.ttl, value)
+        with self._lock:
+            self._put(key, entry)
+            disk = self._open_disk()
+            if disk is not None:
+                self._write_disk(key, entry, now)
+
+    def _put(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Cache counters
+        Returns dictionary of hits, misses, disk hits, evictions and size
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'evictions': self.evictions,
+                'size': len(self._entries)
+            }
+
+    def close(self):
+        """
+        Purge and close the persistent tier if open
+        """
+        with self._lock:
+            if self._disk is not None:
+                self._purge_disk()
+                self._disk.close()
+                self._disk = None
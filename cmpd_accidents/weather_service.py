@@ -2,7 +2,50 @@
 Module for Weather API (OpenWeatherAPI)
 https://openweathermap.org/api
 """
+import threading
+from concurrent.futures import Future
 from cmpd_accidents import RestService
+from cmpd_accidents import METRICS
+
+
+class SingleFlight(object):
+    """
+    Share one in-flight call among concurrent callers asking for the same key
+    Args:
+        memoize: keep results so later callers with the key reuse them too,
+            ie, for the lifetime of a single poll cycle
+    """
+
+    def __init__(self, memoize=False):
+        self.memoize = memoize
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """
+        Call func once per key for concurrent callers
+        Args:
+            key: the key identifying the call
+            func: callable producing the result
+        Returns the shared result
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+        if not leader:
+            return future.result()
+        try:
+            future.set_result(func())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            if not self.memoize or future.exception() is not None:
+                with self._lock:
+                    del self._calls[key]
+        return future.result()
 
 
 class WeatherService(object):
@@ -12,11 +55,21 @@ class WeatherService(object):
         endpoint: endpoint for requests
         apiKey: the API key to use
         headers: headers to send
+        cache: optional WeatherCache to serve nearby/recent lookups from
+        pool_size: max pooled connections, match to the enrichment concurrency
+        timeout: (connect, read) timeout in seconds
+        rate_limiter: optional RateLimiter every request (cache miss) and retry waits on
+        rest_service: optional RestService to send requests with, ie, with its own retry backoff,
+            replaces the one built from endpoint, pool_size, timeout and rate_limiter
     """
 
-    def __init__(self, endpoint, apiKey):
+    def __init__(self, endpoint, apiKey, cache=None, pool_size=10, timeout=(3.05, 10),
+                 rate_limiter=None, rest_service=None):
         self.apiKey = apiKey
-        self.rest_service = RestService(endpoint=endpoint)
+        self.rest_service = rest_service or RestService(
+            endpoint=endpoint, timeout=timeout, pool_size=pool_size, rate_limiter=rate_limiter)
+        self.cache = cache
+        self.rate_limiter = rate_limiter
 
     def get(self, params):
         """
@@ -26,6 +79,19 @@ class WeatherService(object):
             Example parameters:
             https://api.openweathermap.org/data/2.5/weather?lat=35&lon=139&appid=<apiKey>
         """
+        lat, lon = params.get('lat'), params.get('lon')
+        cacheable = self.cache is not None and lat is not None and lon is not None
+        if cacheable:
+            cached = self.cache.get(lat, lon)
+            if cached is not None:
+                METRICS.inc('weather_cache_hits_total')
+                return cached
+            METRICS.inc('weather_cache_misses_total')
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
         params["appid"] = self.apiKey
         res = self.rest_service.get(params=params)
-        return res.json()
+        weather_details = res.json()
+        if cacheable:
+            self.cache.set(lat, lon, weather_details)
+        return weather_details
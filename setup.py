@@ -19,12 +19,13 @@ setup(name='charlotte_traffic_analysis',
       test_suite='nose.collector',
       tests_require=['nose'],
       # Shapely for Windows requires local pip install # https://www.lfd.uci.edu/~gohlke/pythonlibs/#shapely
-      install_requires=['pymongo', 'requests', 'lxml', 'bs4', 'sqlalchemy',
+      install_requires=['pymongo', 'requests', 'aiohttp', 'lxml', 'bs4', 'sqlalchemy',
                         'pymysql', 'numpy', 'pandas', 'scikit-learn', 'xgboost',
                         'shapely', 'matplotlib', 'google-api-python-client'],
       include_package_data=True,
       data_files=[('', [
           'cmpd_accidents/resources/db/mysql_create_accidents.sql',
+          'cmpd_accidents/resources/db/mysql_create_accidents_flat.sql',
           'traffic_analyzer/resources/reference_data/census_population.csv',
           'traffic_analyzer/resources/reference_data/roads.csv',
           'traffic_analyzer/resources/reference_data/signals.csv',
@@ -1,6 +1,7 @@
 from .utility import *
 from .logger import *
 from .features import feature_map
+from .indexes import *
 from .preprocess import create_train_test_data
 from .ml_functions import *
 from .model import *
@@ -0,0 +1,197 @@
+""" Index module for fast lookups against reference data
+Indexes are built once per reference dataset and queried for whole columns of accidents
+"""
+import numpy as np
+import shapely
+from shapely.strtree import STRtree
+from sklearn.neighbors import BallTree
+from traffic_analyzer import EARTH_RADIUS_M
+
+
+class PolygonIndex(list):
+    """
+    Census polygons with an STRtree over the prepared geometries
+    Still a list of {'poly', 'pop_sq_mile', 'median_age'} dictionaries in census order
+    Args:
+        polygons: list of polygon dictionaries from create_polygons
+    """
+
+    def __init__(self, polygons):
+        super(PolygonIndex, self).__init__(polygons)
+        geoms = np.array([poly_obj["poly"] for poly_obj in self], dtype=object)
+        shapely.prepare(geoms)
+        self.tree = STRtree(geoms)
+        self.median_ages = np.array(
+            [poly_obj["median_age"] for poly_obj in self], dtype=float)
+        self.pops = np.array(
+            [poly_obj["pop_sq_mile"] for poly_obj in self], dtype=float)
+
+    def first_match(self, lats, lons):
+        """ Index of the first polygon containing each point, as the list scan would find it
+        Args:
+            lats: latitudes of the points (polygon x)
+            lons: longitudes of the points (polygon y)
+        Returns:
+            array of polygon positions, -1 where no polygon contains the point
+        """
+        points = shapely.points(np.asarray(lats, dtype=float),
+                                np.asarray(lons, dtype=float))
+        matches = np.full(len(points), -1, dtype=int)
+        if not len(points) or not len(self):
+            return matches
+        point_idx, poly_idx = self.tree.query(points, predicate='within')
+        order = np.lexsort((poly_idx, point_idx))
+        point_idx, poly_idx = point_idx[order], poly_idx[order]
+        first = np.unique(point_idx, return_index=True)[1]
+        matches[point_idx[first]] = poly_idx[first]
+        return matches
+
+    def lookup(self, lats, lons):
+        """ Census attributes for a column of points
+        Args:
+            lats: latitudes of the points
+            lons: longitudes of the points
+        Returns:
+            tuple: median_ages, pops arrays, NaN where no polygon contains the point
+        """
+        matches = self.first_match(lats, lons)
+        found = matches >= 0
+        ages = np.full(len(matches), np.nan)
+        pops = np.full(len(matches), np.nan)
+        ages[found] = self.median_ages[matches[found]]
+        pops[found] = self.pops[matches[found]]
+        return ages, pops
+
+
+class SignalIndex(object):
+    """
+    BallTree over traffic signals with a haversine metric for radius counts
+    Points are (lat, lon) radians as the haversine metric expects
+    Args:
+        signals: dataframe of signals with X (longitude) and Y (latitude)
+        legacy_axis_swap: pair coordinates as the original extract_signals did, signal X/Y
+            and accident lat/long swapped into haversine_np, for parity with models trained
+            on those counts
+    """
+
+    def __init__(self, signals, legacy_axis_swap=False):
+        self.legacy_axis_swap = legacy_axis_swap
+        columns = ["X", "Y"] if legacy_axis_swap else ["Y", "X"]
+        coords = signals[columns].astype(float).dropna().values
+        self.size = len(coords)
+        self.tree = BallTree(np.radians(coords), metric='haversine') if self.size else None
+
+    def count_within(self, lats, lons, radius_m):
+        """ Number of signals within a radius of each point
+        Args:
+            lats: latitudes of the points
+            lons: longitudes of the points
+            radius_m: the radius in meters
+        Returns:
+            integer array of signal counts, 0 for points without coordinates
+        """
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        points = np.column_stack((lons, lats) if self.legacy_axis_swap else (lats, lons))
+        counts = np.zeros(len(points), dtype=int)
+        valid = ~np.isnan(points).any(axis=1)
+        if self.tree is not None and valid.any():
+            counts[valid] = self.tree.query_radius(
+                np.radians(points[valid]), r=radius_m / float(EARTH_RADIUS_M), count_only=True)
+        return counts
+
+
+class _NameIndex(object):
+    """
+    Reference rows grouped by name with a token index for substring matches
+    Args:
+        names: series of names, non-string names never match
+        values: dataframe of numeric columns aligned with names
+    """
+
+    def __init__(self, names, values):
+        valid = names.map(lambda name: isinstance(name, str)).values
+        frame = values[valid].copy()
+        frame["_name"] = names[valid].values
+        grouped = frame.groupby("_name", sort=True)
+        sizes = grouped.size()
+        self.names = np.array(sizes.index, dtype=object)
+        self.rows = sizes.values
+        self.sums = {column: grouped[column].sum().values for column in values.columns}
+        self.counts = {column: grouped[column].count().values for column in values.columns}
+        self.tokens = {}
+        for position, name in enumerate(self.names):
+            for token in set(name.split()):
+                self.tokens.setdefault(token, []).append(position)
+
+    def match(self, word):
+        """ Positions of the names containing word, as str.contains(word) would match them
+        Args:
+            word: a word without whitespace or regex characters
+        Returns:
+            sorted array of name positions
+        """
+        positions = set()
+        for token, token_positions in self.tokens.items():
+            if word in token:
+                positions.update(token_positions)
+        return np.array(sorted(positions), dtype=int)
+
+    def mean(self, positions, column):
+        """ Mean of a column over the rows of the matched names, NaN when none """
+        count = self.counts[column][positions].sum()
+        return self.sums[column][positions].sum() / count if count else np.nan
+
+    def mode(self, positions):
+        """ Most frequent matched name, the first in sort order on ties, None when none """
+        if not len(positions):
+            return None
+        rows = self.rows[positions]
+        return self.names[positions][rows == rows.max()][0]
+
+
+class RoadIndex(object):
+    """
+    Token index over road and traffic volume names for extract_road_info features
+    Same results as the per-row str.contains scans, memoized per word
+    Args:
+        volumes: dataframe of mean volumes with ROUTE and 2016
+        roads: dataframe of roads with STREETNAME, curve and ShapeSTLength
+    """
+    generic_street = "GENERIC_STREET"
+
+    def __init__(self, volumes, roads):
+        self.volumes = _NameIndex(volumes["ROUTE"], volumes[["2016"]])
+        self.roads = _NameIndex(roads["STREETNAME"], roads[["curve", "ShapeSTLength"]])
+        self._cache = {}
+
+    def lookup(self, word):
+        """ Road information for a street word
+        Args:
+            word: first street word of an address, see find_first_word
+        Returns:
+            road volume, curve, length, name
+        """
+        if not isinstance(word, str) or not word:
+            return None, None, None, self.generic_street
+        if word not in self._cache:
+            vols = self.volumes.match(word)
+            roads = self.roads.match(word)
+            name = self.roads.mode(roads)
+            self._cache[word] = (self.volumes.mean(vols, "2016"),
+                                 self.roads.mean(roads, "curve"),
+                                 self.roads.mean(roads, "ShapeSTLength"),
+                                 name if name else self.generic_street)
+        return self._cache[word]
+
+    def lookup_many(self, words):
+        """ Road information for a column of street words
+        Args:
+            words: iterable of first street words
+        Returns:
+            tuple: lists of road volumes, curves, lengths, names
+        """
+        results = [self.lookup(word) for word in words]
+        if not results:
+            return [], [], [], []
+        return tuple(list(column) for column in zip(*results))
@@ -1,4 +1,12 @@
+import queue
+import atexit
 import logging
+import logging.handlers
+
+_FORMAT = '[%(asctime)s] {%(pathname)s:%(lineno)d} %(levelname)s - %(message)s'
+_DATEFMT = '%H:%M:%S'
+_listeners = []
+_root_loggers = []  # loggers writing through the root handler, see enable_queue_mode
 
 
 class Logger(object):
@@ -6,17 +14,24 @@ class Logger(object):
     Class to setup and utilize basic logging
     Args:
         name: Name of class utilizing logger
+        use_queue: Write log records from a background thread (defaults to Logger.queue_mode),
+            see enable_queue_mode to also switch loggers created earlier
     """
+    queue_mode = False
 
-    def __init__(self, name):
+    def __init__(self, name, use_queue=None):
         logging.basicConfig(
             filename=None,
             level=logging.INFO,
-            format='[%(asctime)s] {%(pathname)s:%(lineno)d} %(levelname)s - %(message)s',
-            datefmt='%H:%M:%S'
+            format=_FORMAT,
+            datefmt=_DATEFMT
         )
         name = name.replace('.log', '')
         logger = logging.getLogger('log_namespace.%s' % name)
+        if (Logger.queue_mode if use_queue is None else use_queue) and not logger.handlers:
+            _queue_logger(logger)
+        elif use_queue is None and not logger.handlers:
+            _root_loggers.append(logger)
         self._logger = logger
 
     def get(self):
@@ -24,3 +39,41 @@ class Logger(object):
         Method to return an instance of the logger
         """
         return self._logger
+
+
+def _queue_logger(logger):
+    """
+    Write the records of a logger from a background thread instead of the root handler
+    Args:
+        logger: the logging.Logger to attach a QueueHandler to
+    """
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(_FORMAT, _DATEFMT))
+    log_queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    _listeners.append(listener)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False  # root handler would write synchronously
+
+
+def enable_queue_mode():
+    """
+    Queue log records from now on, including loggers created before the call,
+    ie, the module level preprocess logger created at import time
+    """
+    Logger.queue_mode = True
+    while _root_loggers:
+        logger = _root_loggers.pop()
+        if not logger.handlers:
+            _queue_logger(logger)
+
+
+@atexit.register
+def stop_log_listeners():
+    """
+    Flush and stop all background log listeners
+    """
+    while _listeners:
+        _listeners.pop().stop()
@@ -4,6 +4,7 @@
 from cmpd_accidents import MongoDBConnect
 from traffic_analyzer import load_csv
 from traffic_analyzer import haversine_np
+from traffic_analyzer import PolygonIndex, SignalIndex, RoadIndex
 from traffic_analyzer import feature_map as features
 # Essentials
 import numpy as np
@@ -11,7 +12,7 @@ import pandas as pd
 from pandas.io.json import json_normalize
 import re
 # Spatial features
-from shapely.geometry import Point, LineString, Polygon
+from shapely.geometry import Point, Polygon
 # Sklearn
 from sklearn.model_selection import train_test_split
 # Base libs
@@ -22,6 +23,16 @@ import datetime as datetime
 from traffic_analyzer import Logger
 _logger = Logger(__name__).get()
 
+# Address parsing patterns, compiled once
+MAJOR_HIGHWAYS = ("85", "77", "485")
+_NUMBERS = re.compile(r"[0-9]+")
+_WORDS = re.compile(r"[A-Za-z]+")
+_ORDINAL_STREET = re.compile(r"([0-9]+)(ST|ND|RD|TH)")
+# Column versions: a whole number that is a major highway, else the first word of 4+ letters
+_HIGHWAY_NUMBER = re.compile(
+    r"((?<![0-9])(?:{0})(?![0-9]))".format("|".join(MAJOR_HIGHWAYS)))
+_STREET_WORD = re.compile(r"([A-Za-z]{4,})")
+
 
 def load_reference_data():
     """ Load reference data for other features
@@ -57,11 +68,10 @@ def find_first_word(address):
         address: address to perform matching against known state roads
     Returns first word of the case of matched words in an address
     """
-    major_highways = ["85", "77", "485"]
-    hw_matches = re.findall(r"[0-9]+", address)
-    matches = re.findall(r"[A-Za-z]+", address)
+    hw_matches = _NUMBERS.findall(address)
+    matches = _WORDS.findall(address)
     words = [word for word in matches if len(word) > 3]
-    hw_words = [word for word in hw_matches if word in major_highways]
+    hw_words = [word for word in hw_matches if word in MAJOR_HIGHWAYS]
     hw_word = hw_words[0] if hw_words else None
     first_word = words[0] if words else None
     if hw_word:
@@ -84,12 +94,52 @@ def extract_speed(address):
         return 45
     elif "RP" in address:  # Ramps
         return 35
-    elif re.search("([0-9]+)(ST|ND|RD|TH)", str(address)):  # Ordinal streets
+    elif _ORDINAL_STREET.search(str(address)):  # Ordinal streets
         return 35
     else:
         return 45  # Generic speed limit
 
 
+def find_first_words(addresses):
+    """
+    Column version of find_first_word, parsing each distinct address once
+    Args:
+        addresses: series of addresses
+    Returns series of first matched street words, None where nothing matched
+    """
+    addresses = pd.Series(addresses)
+    codes, uniques = pd.factorize(addresses)
+    uniques = pd.Series(uniques, dtype=object)
+    hw_words = uniques.str.extract(_HIGHWAY_NUMBER, expand=False)
+    words = uniques.str.extract(_STREET_WORD, expand=False)
+    first_words = hw_words.where(hw_words.notna(), words)
+    first_words = first_words.astype(object).where(first_words.notna(), None).values
+    result = np.array([None] * len(codes), dtype=object)
+    result[codes >= 0] = first_words[codes[codes >= 0]]
+    return pd.Series(result, index=addresses.index, dtype=object)
+
+
+def extract_speeds(addresses):
+    """
+    Column version of extract_speed, parsing each distinct address once
+    Args:
+        addresses: series of addresses
+    Returns series of generic speed limits
+    """
+    addresses = pd.Series(addresses)
+    codes, uniques = pd.factorize(addresses)
+    uniques = pd.Series(uniques, dtype=object)
+    speeds = np.select(
+        [uniques.str.contains("HY|FR", na=False),  # Highways/freeways
+         uniques.str.contains("RD", regex=False, na=False),  # Generic roads
+         uniques.str.contains("RP", regex=False, na=False),  # Ramps
+         uniques.str.contains(_ORDINAL_STREET, na=False)],  # Ordinal streets
+        [70, 45, 35, 35], default=45)
+    result = np.full(len(codes), 45)
+    result[codes >= 0] = speeds[codes[codes >= 0]]
+    return pd.Series(result, index=addresses.index)
+
+
 def extract_pop_info(polygons, row):
     """ Extract population information for single instance
     Based on polygons coordinates from reference data
@@ -99,6 +149,12 @@ def extract_pop_info(polygons, row):
     Returns:
         tuple: median_age, median_pop for instance
     """
+    if isinstance(polygons, PolygonIndex):
+        match = polygons.first_match(
+            [row[features.get('lat')]], [row[features.get('long')]])[0]
+        if match < 0:
+            return None, None
+        return polygons[match]["median_age"], polygons[match]["pop_sq_mile"]
     for poly_obj in polygons:
         median_age = None
         median_pop = None
@@ -109,16 +165,24 @@ def extract_pop_info(polygons, row):
     return median_age, median_pop
 
 
-def extract_signals(signals, row):
+def extract_signals(signals, row, legacy_axis_swap=False):
     """ Extract signal proximity using haversine distance
     Args:
         signals: list of valid signal X,Y coords
         row: the dataset training row
+        legacy_axis_swap: swap latitude and longitude as the original computation did
     Returns:
         number of signals nearby
     """
-    dists = haversine_np(
-        signals["Y"], signals["X"], row[features.get('lat')], row[features.get('long')])
+    if isinstance(signals, SignalIndex):
+        return int(signals.count_within(
+            [row[features.get('lat')]], [row[features.get('long')]], 500)[0])
+    if legacy_axis_swap:
+        dists = haversine_np(
+            signals["Y"], signals["X"], row[features.get('lat')], row[features.get('long')])
+    else:
+        dists = haversine_np(
+            signals["X"], signals["Y"], row[features.get('long')], row[features.get('lat')])
     signals_near = len(dists[dists < 500])
     return signals_near
 
@@ -157,7 +221,7 @@ def create_polygons(population):
     Args:
         population: dataframe from census reference data
     Returns:
-        Shapely list of polygons to be used for extraction
+        PolygonIndex, the list of polygons with a spatial index for extraction
     """
     polygons = []
     for _, row in population.iterrows():
@@ -167,7 +231,22 @@ def create_polygons(population):
         polygon = Polygon(list(coords))
         polygons.append(
             {'poly': polygon, 'pop_sq_mile': row["PopSqMi"], 'median_age': row["MedianAge"]})
-    return polygons
+    return PolygonIndex(polygons)
+
+
+def parse_coordinates(coordinates):
+    """ Parse coordinate strings into one ragged array
+    Args:
+        coordinates: series of comma separated "long,lat,long,lat,..." strings
+    Returns:
+        tuple: flat float array of all values, offsets of each string's values (length + 1)
+    """
+    counts = coordinates.str.count(",").values + 1
+    offsets = np.zeros(len(counts) + 1, dtype=int)
+    np.cumsum(counts, out=offsets[1:])
+    values = np.array(",".join(coordinates).split(","), dtype=float) \
+        if len(coordinates) else np.zeros(0)
+    return values, offsets
 
 
 def create_roads(roads):
@@ -177,34 +256,36 @@ def create_roads(roads):
     Returns:
         list of road curves for all roads
     """
-    road_curves = []
-    for _, row in roads.iterrows():
-        splitcoords = row["coordinates"].split(",")
-        longlats = list(zip(*[iter(splitcoords)]*2))
-        latlongs = [tuple(reversed(item))
-                    for item in longlats]  # correct to lat/long, reversed
-        # LineString (Spatial Lines based on road coords)
-        shape_points = []
-        for point in latlongs:
-            shape_point = Point(float(point[0]), float(point[1]))
-            shape_points.append(shape_point)
-        line = LineString(shape_points)
-        # Road curvature/lengths based on line points
-        dist = haversine_np(
-            line.coords.xy[0][0],  # First X
-            line.coords.xy[1][0],  # First Y
-            line.coords.xy[0][len(line.coords.xy[0])-1],  # End X
-            line.coords.xy[1][len(line.coords.xy[0])-1]  # End Y
-        )
-        curve = (line.length / dist) if dist != 0 else 0
-        road_curves.append(curve)
-    return road_curves
-
-
-def join_features(data):
+    values, offsets = parse_coordinates(roads["coordinates"])
+    # Whole long/lat pairs per road, a trailing odd value is dropped
+    pairs = np.diff(offsets) // 2
+    pair_offsets = np.zeros(len(pairs) + 1, dtype=int)
+    np.cumsum(pairs, out=pair_offsets[1:])
+    road_of_pair = np.repeat(np.arange(len(pairs)), pairs)
+    first = np.repeat(offsets[:-1], pairs) + \
+        2 * (np.arange(pair_offsets[-1]) - np.repeat(pair_offsets[:-1], pairs))
+    # correct to lat/long, reversed (x is latitude, y is longitude)
+    x, y = values[first + 1], values[first]
+    # Road lengths in degrees from the segments within each road
+    same_road = road_of_pair[1:] == road_of_pair[:-1]
+    segments = np.hypot(np.diff(x), np.diff(y))
+    lengths = np.bincount(road_of_pair[1:][same_road], weights=segments[same_road],
+                          minlength=len(pairs))
+    # Road curvature based on the end points, roads without points have no curve
+    has_points = pairs > 0
+    start, end = pair_offsets[:-1][has_points], pair_offsets[1:][has_points] - 1
+    dist = np.zeros(len(pairs))
+    dist[has_points] = haversine_np(x[start], y[start], x[end], y[end])
+    curves = np.zeros(len(pairs))
+    np.divide(lengths, dist, out=curves, where=dist != 0)
+    return curves.tolist()
+
+
+def join_features(data, legacy_signal_axes=False):
     """
     Args:
         data: dataframe to join based on
+        legacy_signal_axes: count signals with the original swapped latitude/longitude
     Returns modified existing dataframe to join new features
     Features added:
         - Time series info
@@ -236,34 +317,25 @@ def join_features(data):
     grouped = meck_vols.groupby(["ROUTE"], as_index=False).mean()
 
     # Main data join with other features
-    mean_vols, mean_curves, mean_lengths, signals_near, road_names, ages, pops = (
-        [], [], [], [], [], [], [])
-
-    for _, row in data.iterrows():
-
-        # Road information (volumes, curves, lengths)
-        vol, curve, length, name = extract_road_info(grouped, roads, row)
-        mean_vols.append(vol)
-        mean_curves.append(curve)
-        mean_lengths.append(length)
-        road_names.append(name)
-
-        # Signals proximity
-        signals_near.append(extract_signals(signals, row))
+    # Population and age for all rows in one spatial query
+    ages, pops = polygons.lookup(
+        data[features.get('lat')].values, data[features.get('long')].values)
 
-        # Population
-        ages.append(extract_pop_info(polygons, row)[0])
+    # Signals within 500 meters for all rows
+    signals_near = SignalIndex(signals, legacy_axis_swap=legacy_signal_axes).count_within(
+        data[features.get('lat')].values, data[features.get('long')].values, 500)
 
-        # Age
-        pops.append(extract_pop_info(polygons, row)[1])
+    # Road information (volumes, curves, lengths, names) per distinct street word
+    mean_vols, mean_curves, mean_lengths, road_names = RoadIndex(grouped, roads).lookup_many(
+        find_first_words(data[features.get('address')]))
 
     data[features.get('road')] = road_names
     data[features.get('road_curve')] = mean_curves
     data[features.get('road_length')] = mean_lengths
     data[features.get('road_volume')] = mean_vols
     data[features.get('signals_near')] = signals_near
-    data[features.get('road_speed')] = data[features.get(
-        'address')].apply(lambda x: extract_speed(x))
+    data[features.get('road_speed')] = extract_speeds(
+        data[features.get('address')])
     data[features.get('median_age')] = ages
     data[features.get('pop_sq_mile')] = pops
 
@@ -0,0 +1,34 @@
+from unittest import TestCase
+from unittest.mock import patch
+import io
+import logging
+import importlib
+import traffic_analyzer
+
+logger_module = importlib.import_module('traffic_analyzer.logger')
+
+
+class TestLogger(TestCase):
+    """ Queue logging tests """
+
+    def test_queue_logger(self):
+        with patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            logger = traffic_analyzer.Logger('AnalyzerQueueTest', use_queue=True).get()
+            self.assertIsInstance(logger.handlers[0], logging.handlers.QueueHandler)
+            self.assertFalse(logger.propagate)
+            logger.info('queued record')
+            traffic_analyzer.stop_log_listeners()  # flushes the queue to the stream handler
+        self.assertIn('queued record', stderr.getvalue())
+
+    def test_enable_queue_mode(self):
+        with patch.object(logger_module, '_root_loggers', []), \
+                patch.object(traffic_analyzer.Logger, 'queue_mode', False), \
+                patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            # ie, the preprocess logger created at import time
+            logger = traffic_analyzer.Logger('AnalyzerEarlyTest').get()
+            self.assertEqual(logger.handlers, [])
+            traffic_analyzer.enable_queue_mode()
+            self.assertIsInstance(logger.handlers[0], logging.handlers.QueueHandler)
+            logger.info('switched record')
+            traffic_analyzer.stop_log_listeners()
+        self.assertIn('switched record', stderr.getvalue())
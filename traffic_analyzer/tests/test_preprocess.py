@@ -0,0 +1,138 @@
+from unittest import TestCase
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point, LineString
+from traffic_analyzer import haversine_np
+from traffic_analyzer import PolygonIndex, SignalIndex, RoadIndex
+from traffic_analyzer import load_csv
+from traffic_analyzer import feature_map as features
+from traffic_analyzer.preprocess import create_roads, create_polygons, extract_pop_info, extract_signals
+from traffic_analyzer.preprocess import extract_road_info, find_first_word, find_first_words
+from traffic_analyzer.preprocess import extract_speed, extract_speeds
+
+
+def square(lat, lon, size):
+    """ Census coordinates string (lon,lat pairs) of a square """
+    corners = [(lat, lon), (lat + size, lon), (lat + size, lon + size), (lat, lon + size)]
+    return ','.join('{0},{1}'.format(c_lon, c_lat) for c_lat, c_lon in corners)
+
+
+def road_curves(roads):
+    """ Row by row road curves, the create_roads reference implementation """
+    road_curves = []
+    for _, row in roads.iterrows():
+        splitcoords = row["coordinates"].split(",")
+        longlats = list(zip(*[iter(splitcoords)]*2))
+        latlongs = [tuple(reversed(item)) for item in longlats]
+        line = LineString([Point(float(point[0]), float(point[1])) for point in latlongs])
+        dist = haversine_np(line.coords.xy[0][0], line.coords.xy[1][0],
+                            line.coords.xy[0][-1], line.coords.xy[1][-1])
+        road_curves.append((line.length / dist) if dist != 0 else 0)
+    return road_curves
+
+
+class TestPreprocess(TestCase):
+    """ Preprocessing feature extraction tests """
+
+    def test_polygon_index(self):
+        population = pd.DataFrame({
+            'coordinates': [square(35.0, -81.0, 0.5), square(35.2, -80.8, 0.5),
+                            square(36.0, -80.0, 0.1)],
+            'PopSqMi': [100.0, 200.0, 300.0],
+            'MedianAge': [30.0, 40.0, 50.0]})
+        polygons = create_polygons(population)
+        self.assertIsInstance(polygons, PolygonIndex)
+        self.assertEqual(len(polygons), 3)
+        self.assertEqual(list(polygons[0].keys()), ['poly', 'pop_sq_mile', 'median_age'])
+        rng = np.random.RandomState(1234)
+        data = pd.DataFrame({features.get('lat'): rng.uniform(34.9, 36.2, 500),
+                             features.get('long'): rng.uniform(-81.1, -79.8, 500)})
+        ages, pops = polygons.lookup(data[features.get('lat')], data[features.get('long')])
+        # overlapping squares resolve to the first polygon, like the list scan
+        for i, row in data.iterrows():
+            age, pop = extract_pop_info(list(polygons), row)
+            self.assertEqual(extract_pop_info(polygons, row), (age, pop))
+            if age is None:
+                self.assertTrue(np.isnan(ages[i]) and np.isnan(pops[i]))
+            else:
+                self.assertEqual((ages[i], pops[i]), (age, pop))
+        self.assertTrue(np.isnan(polygons.lookup([np.nan], [np.nan])[0][0]))
+
+    def test_signal_index(self):
+        signals = load_csv("signals.csv")
+        index = SignalIndex(signals)
+        rng = np.random.RandomState(1234)
+        data = pd.DataFrame({features.get('lat'): rng.uniform(35.0, 35.4, 300),
+                             features.get('long'): rng.uniform(-81.0, -80.6, 300)})
+        counts = index.count_within(
+            data[features.get('lat')], data[features.get('long')], 500)
+        # brute force haversine over every signal, longitude X and latitude Y
+        valid = signals[["X", "Y"]].astype(float).dropna()
+        brute = [int((haversine_np(valid["X"].values, valid["Y"].values,
+                                   row[features.get('long')], row[features.get('lat')]) < 500).sum())
+                 for _, row in data.iterrows()]
+        self.assertEqual(counts.tolist(), brute)
+        self.assertEqual([extract_signals(signals, row) for _, row in data.iterrows()], brute)
+        self.assertGreater(sum(brute), 0)
+        self.assertEqual(extract_signals(index, data.iloc[0]), brute[0])
+        self.assertEqual(index.count_within([np.nan], [np.nan], 500).tolist(), [0])
+        # the legacy flag keeps the original swapped pairing
+        legacy = SignalIndex(signals, legacy_axis_swap=True).count_within(
+            data[features.get('lat')], data[features.get('long')], 500)
+        self.assertEqual(legacy.tolist(), [extract_signals(signals, row, legacy_axis_swap=True)
+                                           for _, row in data.iterrows()])
+
+    def test_road_index(self):
+        roads = load_csv("roads.csv")
+        roads["curve"] = np.random.RandomState(1234).uniform(1, 2, len(roads))
+        traffic_vol = load_csv("traffic_volumes.csv")
+        meck_vols = traffic_vol[(traffic_vol["COUNTY"] == "MECKLENBURG") & (
+            traffic_vol["2016"] != ' ')][["ROUTE", "2016"]]
+        meck_vols["2016"] = meck_vols["2016"].astype(int)
+        grouped = meck_vols.groupby(["ROUTE"], as_index=False).mean()
+        index = RoadIndex(grouped, roads)
+        addresses = pd.Series(["I-85 N / SUGAR CREEK RD", "5400 N TRYON ST", "W T HARRIS BV/I-485",
+                               "MILL RD", "E 7TH ST", "&", "1 ZZZZQ AV", "PARK RD / WOODLAWN RD",
+                               "S TRYON ST / W WT HARRIS BV", "77 S"])
+        vols, curves, lengths, names = index.lookup_many(addresses.map(find_first_word))
+        for i, address in enumerate(addresses):
+            row = pd.Series({features.get('address'): address})
+            vol, curve, length, name = extract_road_info(grouped, roads, row)
+            self.assertEqual(names[i], name)
+            for actual, expected in ((vols[i], vol), (curves[i], curve), (lengths[i], length)):
+                if expected is None or np.isnan(expected):
+                    self.assertTrue(actual is None or np.isnan(actual))
+                else:
+                    self.assertAlmostEqual(actual, expected, places=6)
+        self.assertEqual(names[5], "GENERIC_STREET")
+
+    def test_address_parsing(self):
+        signals = load_csv("signals.csv")
+        traffic_vol = load_csv("traffic_volumes.csv")
+        crafted = ["I-85 N / SUGAR CREEK RD", "1485 X", "I-4850", "85TH ST", "HWY 77 RP",
+                   "E 3RD ST", "W 22ND ST", "RAMP", "FREEWAY", "&", "", "AB CD EF",
+                   "mill rd", "485/77", "S TRYON ST / W WT HARRIS BV"]
+        addresses = pd.Series(list(signals["UNITDESC"].dropna().astype(str)) +
+                              list(traffic_vol["ROUTE"].dropna().astype(str)) +
+                              list(traffic_vol["LOCATION"].dropna().astype(str)) + crafted * 2)
+        self.assertEqual(find_first_words(addresses).tolist(),
+                         [find_first_word(address) for address in addresses])
+        self.assertEqual(extract_speeds(addresses).tolist(),
+                         [extract_speed(address) for address in addresses])
+        self.assertEqual(find_first_words(pd.Series([None, np.nan, "MILL RD"])).tolist(),
+                         [None, None, "MILL"])
+        self.assertEqual(extract_speeds(pd.Series([None, np.nan, "MILL RD"])).tolist(),
+                         [45, 45, 45])
+
+    def test_create_roads(self):
+        roads = load_csv("roads.csv")
+        curves = create_roads(roads)
+        self.assertEqual(len(curves), len(roads))
+        np.testing.assert_allclose(curves, road_curves(roads), rtol=1e-9, atol=1e-12)
+        crafted = pd.DataFrame({"coordinates": [
+            "-80.9,35.2,-80.8,35.3,-80.7", "-80.9,35.2,-80.9,35.2", "-80.9,35.2,-80.8,35.2"]})
+        np.testing.assert_allclose(create_roads(crafted), road_curves(crafted))
+        # a single point road has no segments, so no curve (shapely rejects one point lines)
+        self.assertEqual(create_roads(pd.DataFrame({"coordinates": [
+            "-80.9,35.2", "-80.9,35.2,-80.8,35.3"]}))[0], 0)
+        self.assertEqual(create_roads(crafted.iloc[:0]), [])
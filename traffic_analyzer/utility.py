@@ -6,6 +6,8 @@ import numpy as np
 from joblib import dump, load
 import pkg_resources
 
+EARTH_RADIUS_M = 6367000  # haversine earth radius in meters
+
 
 def load_model(filename):
     """
@@ -62,5 +64,5 @@ def haversine_np(lon1, lat1, lon2, lat2):
     dlat = lat2 - lat1
     a = np.sin(dlat/2.0)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2.0)**2
     c = 2 * np.arcsin(np.sqrt(a))
-    m = 6367000 * c  # meters
+    m = EARTH_RADIUS_M * c  # meters
     return m